@@ -0,0 +1,82 @@
+"""Measure the per-token overhead of the LLM logging callback, eager f-strings vs level-gated lazy logging.
+
+Tokens are dispatched through the langchain callback manager, the way streamed generations are, with logs sent to
+a sink at `INFO`, the default `LOG_LEVEL`, so that the logs of both handlers are dropped.
+Usage (from the `api` directory): python -m benchmarks.callback_overhead [tokens]
+"""
+import asyncio
+import sys
+import time
+from typing import Any, Optional
+from uuid import UUID, uuid4
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun
+from langchain.schema.output import GenerationChunk
+from loguru import logger
+
+from sqlbot.callbacks import TracingLLMCallbackHandler
+
+LEVEL = "INFO"
+
+
+class EagerTracingLLMCallbackHandler(AsyncCallbackHandler):
+    """`TracingLLMCallbackHandler.on_llm_new_token` as it was, formatting every token whatever the level."""
+
+    async def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        chunk: Optional[GenerationChunk] = None,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        **kwargs: Any,
+    ) -> None:
+        logger.trace(
+            f"on_llm_new_token run_id={run_id} parent_run_id={parent_run_id} token={token} chunk={chunk}"
+        )
+
+
+async def per_token(handlers: list[AsyncCallbackHandler], tokens: int) -> float:
+    """Seconds spent per dispatched token."""
+    run_manager = AsyncCallbackManagerForLLMRun(
+        run_id=uuid4(),
+        handlers=handlers,
+        inheritable_handlers=handlers,
+        parent_run_id=uuid4(),
+    )
+    chunks = [GenerationChunk(text=f" token{i}") for i in range(100)]
+    start = time.perf_counter()
+    for i in range(tokens):
+        chunk = chunks[i % len(chunks)]
+        await run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+    return (time.perf_counter() - start) / tokens
+
+
+async def run(tokens: int) -> None:
+    handler = TracingLLMCallbackHandler(level=LEVEL)
+    cases = {
+        "eager": [EagerTracingLLMCallbackHandler()],
+        "lazy": [handler],
+        "lazy, not attached": [handler] if handler.enabled else [],
+    }
+    await per_token([], tokens)  # warm up
+    baseline = await per_token([], tokens)
+    print(f"log level: {LEVEL}, tokens: {tokens}")
+    print(f"{'handler':<20}{'us/token':>10}{'overhead':>10}")
+    print(f"{'no handler':<20}{baseline * 1e6:>10.2f}{0:>10.2f}")
+    for name, handlers in cases.items():
+        seconds = await per_token(handlers, tokens)
+        overhead = (seconds - baseline) * 1e6
+        print(f"{name:<20}{seconds * 1e6:>10.2f}{overhead:>10.2f}")
+
+
+def main():
+    tokens = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    logger.remove()
+    logger.add(lambda message: None, level=LEVEL)
+    asyncio.run(run(tokens))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""Compare the token count of query_executor observations, repr vs compact format.
+
+Rows are the sample rows of the `demo/imdb` schema, typed according to its DDL.
+Usage (from the `api` directory): python -m benchmarks.result_tokens [path/to/tokenizer.json]
+
+Pass the `tokenizer.json` of the served model to count real tokens (requires the `tokenizers` package).
+Otherwise tokens are approximated the way Llama / Mistral tokenizers split such text: digits and punctuation are
+one token each, words are one token each.
+"""
+import json
+import re
+import sys
+from pathlib import Path
+
+from sqlbot.tools.formatter import ResultFormatter
+
+TABLE_INFO = Path(__file__).parents[2] / "demo" / "imdb" / "table-info.json"
+COLUMN_DEF = re.compile(
+    r"^\t(\w+) ([a-z ]+?)(?:\(\d+\))?(?: primary key| references .*)?,?$"
+)
+APPROXIMATE_TOKEN = re.compile(r"\d| ?[^\W\d_]+| ?[^\s\w]|\s+")
+
+
+def get_tokenizer(path: str | None = None):
+    if path is None:
+        return "approximation", lambda s: len(APPROXIMATE_TOKEN.findall(s))
+    from tokenizers import Tokenizer
+
+    tokenizer = Tokenizer.from_file(path)
+    return path, lambda s: len(tokenizer.encode(s, add_special_tokens=False).ids)
+
+
+def parse_value(value: str, type_: str):
+    if value == "None":
+        return None
+    if type_ in ("bigint", "integer", "smallint"):
+        return int(value)
+    if type_ in ("double precision", "real", "numeric"):
+        return float(value)
+    return value
+
+
+def load_tables() -> dict[str, tuple[list[str], list[tuple]]]:
+    tables = {}
+    for name, info in json.loads(TABLE_INFO.read_text()).items():
+        types = dict(
+            match.groups()
+            for line in info.splitlines()
+            if (match := COLUMN_DEF.match(line))
+        )
+        sample = info.split(f"rows from {name} table:\n", 1)[1].rstrip("*/\n")
+        columns, *lines = sample.splitlines()
+        columns = columns.split("\t")
+        rows = [
+            tuple(
+                parse_value(value, types.get(column, "text"))
+                for column, value in zip(columns, line.split("\t"))
+            )
+            for line in lines
+        ]
+        tables[name] = (columns, rows)
+    return tables
+
+
+def main():
+    tokenizer_name, count_tokens = get_tokenizer(*sys.argv[1:2])
+    formatter = ResultFormatter()
+    print(f"tokenizer: {tokenizer_name}")
+    print(f"{'table':<20}{'repr':>8}{'compact':>10}{'saving':>10}")
+    total_repr = total_compact = 0
+    for name, (columns, rows) in load_tables().items():
+        repr_tokens = count_tokens(str(rows))
+        compact = "\n".join(
+            [formatter.format_header(columns)] + [formatter.format_row(r) for r in rows]
+        )
+        compact_tokens = count_tokens(compact)
+        total_repr += repr_tokens
+        total_compact += compact_tokens
+        saving = 1 - compact_tokens / repr_tokens
+        print(f"{name:<20}{repr_tokens:>8}{compact_tokens:>10}{saving:>10.0%}")
+    saving = 1 - total_compact / total_repr
+    print(f"{'total':<20}{total_repr:>8}{total_compact:>10}{saving:>10.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,8 +1,13 @@
 """SQL agent."""
+import asyncio
 import json
+import time
+from datetime import date
 from typing import Any, Optional, Sequence
 
 from langchain.agents.agent import Agent, AgentExecutor, AgentOutputParser
+from langchain.callbacks.base import Callbacks
+from langchain.callbacks.manager import AsyncCallbackManagerForChainRun
 from langchain.memory.chat_memory import BaseChatMemory
 from langchain.prompts import PromptTemplate
 from langchain.prompts.chat import (
@@ -20,17 +25,49 @@ from langchain.schema import (
 )
 from langchain.schema.language_model import BaseLanguageModel
 from langchain.tools import BaseTool
+from langchain.utilities.asyncio import asyncio_timeout
+from langchain.utils.input import get_color_mapping
+from loguru import logger
 from pydantic.v1 import Field
 
+from sqlbot.agent.candidates import CandidateSampler
+from sqlbot.agent.examples import ExampleStore
 from sqlbot.agent.output_parser import JsonOutputParser
-from sqlbot.agent.prompts import SYSTEM, TOOLS
+from sqlbot.agent.plan_cache import CachedPlanAction, PlanCache
+from sqlbot.agent.prompts import EXAMPLES, SYSTEM, TOOLS
 from sqlbot.agent.toolkit import SQLBotToolkit
 from sqlbot.prompts import ChatMLPromptTemplate
 from sqlbot.schemas import IntermediateSteps
 
+STOPPED_REASONS = ("early_stopped", "early_stopped_generated")
+"""Reasons of the answers of runs stopped by the iteration or time limit."""
+
+_background_tasks: set[asyncio.Task] = set()
+"""Tasks not awaited by anyone, referenced until they finish."""
+
 
 class AppendThoughtAgent(Agent):
     output_parser: Optional[AgentOutputParser] = Field(default_factory=JsonOutputParser)
+    candidates: Optional[CandidateSampler] = None
+    """Samples alternative queries alongside the main plan, if set."""
+
+    class Config:
+        arbitrary_types_allowed = True
+
+    async def aplan(
+        self,
+        intermediate_steps: list[tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> AgentAction | AgentFinish:
+        if self.candidates is None or not self.candidates.should_sample(
+            intermediate_steps
+        ):
+            return await super().aplan(intermediate_steps, callbacks, **kwargs)
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        return await self.candidates.aplan(
+            self.llm_chain, self.output_parser, full_inputs, callbacks
+        )
 
     @classmethod
     def create_prompt(cls, tools: Sequence[BaseTool]) -> BasePromptTemplate:
@@ -43,6 +80,7 @@ class AppendThoughtAgent(Agent):
         )
         messages = [
             SystemMessagePromptTemplate(prompt=system_prompt),
+            MessagesPlaceholder(variable_name="examples"),
             MessagesPlaceholder(variable_name="history"),
             HumanMessagePromptTemplate.from_template("{input}"),
             MessagesPlaceholder(variable_name="agent_scratchpad"),
@@ -85,6 +123,30 @@ class AppendThoughtAgent(Agent):
         **kwargs: Any,
     ) -> AgentFinish:
         """Return response when agent has been stopped due to max iterations."""
+        if early_stopping_method == "generate":
+            # Generate does one final forward pass
+            full_inputs = self._get_stopped_inputs(intermediate_steps, **kwargs)
+            full_output = self.llm_chain.predict(**full_inputs)
+            return self._parse_stopped_output(full_output)
+        return self._force_stop(early_stopping_method)
+
+    async def areturn_stopped_response(
+        self,
+        early_stopping_method: str,
+        intermediate_steps: list[tuple[AgentAction, str]],
+        callbacks: Callbacks = None,
+        **kwargs: Any,
+    ) -> AgentFinish:
+        """Async `return_stopped_response`, streaming the final answer to `callbacks`."""
+        if early_stopping_method == "generate":
+            full_inputs = self._get_stopped_inputs(intermediate_steps, **kwargs)
+            full_output = await self.llm_chain.apredict(
+                callbacks=callbacks, **full_inputs
+            )
+            return self._parse_stopped_output(full_output)
+        return self._force_stop(early_stopping_method)
+
+    def _force_stop(self, early_stopping_method: str) -> AgentFinish:
         if early_stopping_method == "force":
             # `force` just returns a constant string
             return AgentFinish(
@@ -94,41 +156,63 @@ class AppendThoughtAgent(Agent):
                 },
                 "",
             )
-        elif early_stopping_method == "generate":
-            # Generate does one final forward pass
-            thoughts = ""
-            for action, observation in intermediate_steps:
-                thoughts += action.log
-                thoughts += (
-                    f"\n{self.observation_prefix}{observation}\n{self.llm_prefix}"
-                )
-            # Adding to the previous steps, we now tell the LLM to make a final pred
-            thoughts += (
-                "\n\nI now need to return a final answer based on the previous steps:"
-            )
-            new_inputs = {"agent_scratchpad": thoughts, "stop": self._stop}
-            full_inputs = {**kwargs, **new_inputs}
-            full_output = self.llm_chain.predict(**full_inputs)
-            # We try to extract a final answer
-            parsed_output = self.output_parser.parse(full_output)
-            if isinstance(parsed_output, AgentFinish):
-                # If we can extract, we send the correct stuff
-                return parsed_output
-            else:
-                # If we can extract, but the tool is not the final tool,
-                # we just return the full output
-                return AgentFinish(
-                    {"output": full_output, "reason": "early_stopped"}, full_output
-                )
-        else:
-            raise ValueError(
-                "early_stopping_method should be one of `force` or `generate`, "
-                f"got {early_stopping_method}"
+        raise ValueError(
+            "early_stopping_method should be one of `force` or `generate`, "
+            f"got {early_stopping_method}"
+        )
+
+    def _get_stopped_inputs(
+        self, intermediate_steps: list[tuple[AgentAction, str]], **kwargs: Any
+    ) -> dict[str, Any]:
+        full_inputs = self.get_full_inputs(intermediate_steps, **kwargs)
+        # Adding to the previous steps, we now tell the LLM to make a final pred
+        full_inputs["agent_scratchpad"] = [
+            *full_inputs["agent_scratchpad"],
+            SystemMessage(
+                content="I now need to return a final answer based on the previous steps."
+            ),
+        ]
+        return full_inputs
+
+    def _parse_stopped_output(self, full_output: str) -> AgentFinish:
+        """The generated answer of a stopped run.
+
+        Its reason differs from the `force` one: the answer was streamed like any other, it is not sent again.
+        """
+        # We try to extract a final answer
+        parsed_output = self.output_parser.parse(full_output)
+        if isinstance(parsed_output, AgentFinish):
+            # If we can extract, we send the correct stuff
+            return AgentFinish(
+                {**parsed_output.return_values, "reason": "early_stopped_generated"},
+                parsed_output.log,
             )
+        # If we can extract, but the tool is not the final tool,
+        # we just return the full output
+        return AgentFinish(
+            {"output": full_output, "reason": "early_stopped_generated"}, full_output
+        )
 
 
 class CustomAgentExecutor(AgentExecutor):
+    example_store: Optional[ExampleStore] = None
+    """Store of past successful question -> SQL pairs, used as few-shot examples."""
+    num_examples: int = 3
+    plan_cache: Optional[PlanCache] = None
+    """Question -> SQL cache, used to skip planning for repeated questions."""
+
+    def _get_examples(self, question: str) -> list[BaseMessage]:
+        if self.example_store is None:
+            return []
+        examples = self.example_store.search(question, k=self.num_examples)
+        if not examples:
+            return []
+        content = EXAMPLES.format(examples="\n\n".join(map(str, examples)))
+        return [SystemMessage(content=content)]
+
     def prep_inputs(self, inputs: dict[str, Any] | Any) -> dict[str, str]:
+        if isinstance(inputs, dict) and "examples" not in inputs:
+            inputs = inputs | {"examples": self._get_examples(inputs.get("input", ""))}
         inputs = super().prep_inputs(inputs)
         if self.memory is not None and isinstance(self.memory, BaseChatMemory):
             self.memory.chat_memory.add_user_message(inputs[self.memory.input_key])
@@ -147,6 +231,7 @@ class CustomAgentExecutor(AgentExecutor):
             if "intermediate_steps" in outputs:
                 wrap = IntermediateSteps.model_validate(outputs["intermediate_steps"])
                 additional_kwargs["intermediate_steps"] = wrap.model_dump_json()
+                self._collect_plan(inputs, outputs, wrap)
             msg = AIMessage(
                 content=outputs[self.memory.output_key],
                 additional_kwargs=additional_kwargs,
@@ -157,6 +242,172 @@ class CustomAgentExecutor(AgentExecutor):
         else:
             return {**inputs, **outputs}
 
+    def _collect_plan(
+        self,
+        inputs: dict[str, str],
+        outputs: dict[str, Any],
+        intermediate_steps: IntermediateSteps,
+    ) -> None:
+        """Remember the question and the query that answered it, if the run finished normally.
+
+        Follow-up questions ("and for comedies?") only make sense along with the history, they are not remembered.
+        """
+        if outputs.get("reason") in STOPPED_REASONS or inputs.get("history"):
+            return
+        if (query := intermediate_steps.last_query()) is None:
+            return
+        if self.example_store is not None:
+            self.example_store.add(inputs["input"], query)
+        if self.plan_cache is not None:
+            args = (inputs["input"], _run_date(inputs), query)
+            try:
+                loop = asyncio.get_running_loop()
+            except RuntimeError:
+                self._put_plan(*args)
+                return
+            # storing may reflect the schema, keep it off the event loop
+            task = loop.create_task(asyncio.to_thread(self._put_plan, *args))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+    def _put_plan(self, question: str, today: date, query: str) -> None:
+        try:
+            self.plan_cache.put(question, today, query)
+        except Exception as e:
+            logger.warning(f"Failed to cache plan: {e}")
+
+    async def _acall(
+        self,
+        inputs: dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> dict[str, Any]:
+        """Same loop as `AgentExecutor._acall`, but stopped runs generate their final answer asynchronously.
+
+        The time limit only applies to the loop, so that a stopped run still has time to generate its answer.
+        """
+        name_to_tool_map = {tool.name: tool for tool in self.tools}
+        color_mapping = get_color_mapping(
+            [tool.name for tool in self.tools], excluded_colors=["green"]
+        )
+        intermediate_steps: list[tuple[AgentAction, str]] = []
+        iterations = 0
+        time_elapsed = 0.0
+        start_time = time.time()
+        try:
+            async with asyncio_timeout(self.max_execution_time):
+                while self._should_continue(iterations, time_elapsed):
+                    next_step_output = await self._atake_next_step(
+                        name_to_tool_map,
+                        color_mapping,
+                        inputs,
+                        intermediate_steps,
+                        run_manager=run_manager,
+                    )
+                    if isinstance(next_step_output, AgentFinish):
+                        return await self._areturn(
+                            next_step_output,
+                            intermediate_steps,
+                            run_manager=run_manager,
+                        )
+                    intermediate_steps.extend(next_step_output)
+                    if len(next_step_output) == 1:
+                        tool_return = self._get_tool_return(next_step_output[0])
+                        if tool_return is not None:
+                            return await self._areturn(
+                                tool_return, intermediate_steps, run_manager=run_manager
+                            )
+                    iterations += 1
+                    time_elapsed = time.time() - start_time
+        except TimeoutError:
+            # stop early when interrupted by the async timeout
+            pass
+        output = await self.agent.areturn_stopped_response(
+            self.early_stopping_method,
+            intermediate_steps,
+            callbacks=run_manager.get_child() if run_manager else None,
+            **inputs,
+        )
+        return await self._areturn(output, intermediate_steps, run_manager=run_manager)
+
+    async def _atake_next_step(
+        self,
+        name_to_tool_map: dict[str, BaseTool],
+        color_mapping: dict[str, str],
+        inputs: dict[str, str],
+        intermediate_steps: list[tuple[AgentAction, str]],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> AgentFinish | list[tuple[AgentAction, str]]:
+        """Replay the cached plan on the first step, if there is one and the question is not a follow-up."""
+        if (
+            not intermediate_steps
+            and self.plan_cache is not None
+            and not inputs.get("history")
+        ):
+            step = await self._areplay_plan(name_to_tool_map, inputs, run_manager)
+            if step is not None:
+                return [step]
+        return await super()._atake_next_step(
+            name_to_tool_map,
+            color_mapping,
+            inputs,
+            intermediate_steps,
+            run_manager=run_manager,
+        )
+
+    async def _areplay_plan(
+        self,
+        name_to_tool_map: dict[str, BaseTool],
+        inputs: dict[str, str],
+        run_manager: Optional[AsyncCallbackManagerForChainRun] = None,
+    ) -> Optional[tuple[AgentAction, str]]:
+        tool = name_to_tool_map.get(self.plan_cache.tool_name)
+        if tool is None:
+            return None
+        question = inputs["input"]
+        try:
+            # lookup may validate the plan against the database
+            query = await asyncio.to_thread(
+                self.plan_cache.get, question, _run_date(inputs)
+            )
+        except Exception as e:
+            logger.warning(f"Failed to lookup plan cache: {e}")
+            return None
+        if query is None:
+            return None
+        # mimic what the LLM would have generated, as the log ends up in the scratchpad
+        log = json.dumps({"tool_name": tool.name, "tool_input": query})
+        action = CachedPlanAction(tool=tool.name, tool_input=query, log=log)
+        if run_manager:
+            await run_manager.on_agent_action(action, verbose=self.verbose)
+        observation = await tool.arun(
+            query,
+            verbose=self.verbose,
+            callbacks=run_manager.get_child() if run_manager else None,
+        )
+        if isinstance(observation, str) and observation.startswith("Error:"):
+            self.plan_cache.invalidate(question)
+            return None
+        return action, observation
+
+    def _get_tool_return(
+        self, next_step_output: tuple[AgentAction, str]
+    ) -> Optional[AgentFinish]:
+        agent_action, observation = next_step_output
+        if (
+            isinstance(agent_action, CachedPlanAction)
+            and self.plan_cache is not None
+            and self.plan_cache.strict
+        ):
+            return AgentFinish({"output": observation, "reason": "plan_cache"}, "")
+        return super()._get_tool_return(next_step_output)
+
+
+def _run_date(inputs: dict[str, Any]) -> date:
+    run_date = inputs.get("date")
+    if isinstance(run_date, date):
+        return run_date
+    return date.fromisoformat(str(run_date)) if run_date else date.today()
+
 
 def create_sql_agent(
     llm: BaseLanguageModel,
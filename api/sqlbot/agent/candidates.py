@@ -0,0 +1,208 @@
+"""Sampling several SQL candidates at once, to skip the write -> error -> rewrite loop."""
+import asyncio
+import re
+from typing import Any, Optional
+
+from langchain.agents.agent import AgentOutputParser
+from langchain.callbacks.base import Callbacks
+from langchain.callbacks.manager import AsyncCallbackManager
+from langchain.chains import LLMChain
+from langchain.load.dump import dumpd
+from langchain.schema import AgentAction, AgentFinish, Generation, LLMResult
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+from sqlalchemy import text
+
+from sqlbot.warehouse import begin_read
+
+REPLAY_TOKEN = re.compile(r"\n+| ?\w+| ?[^\w\s]|\s+")
+"""Splits a replayed output into tokens like the ones of LLMs, e.g. "Action" or " Answer"."""
+
+
+class CandidateSampler:
+    """Samples alternative plans alongside the main one when the agent is about to write a query.
+
+    That is right after checking a query, or after a query failed. The main plan and `n - 1` alternatives are
+    generated concurrently, alternatives with distinct seeds, which TGI batches together. Every candidate calling
+    `tool_name` is validated by `EXPLAIN` as soon as it is generated, the first valid one wins. If the main plan does
+    not call `tool_name`, it wins as soon as it is parsed.
+
+    Nothing is streamed to the callbacks until the winner is picked, its output is then replayed to them as one LLM
+    run, so that the client sees the thought of the query that runs.
+    """
+
+    def __init__(
+        self,
+        db: SQLDatabase,
+        n: int = 3,
+        temperature: float = 0.7,
+        tool_name: str = "query_executor",
+        checker_tool_name: str = "query_checker",
+        statement_timeout: float = 5,
+    ):
+        self.db = db
+        self.n = n
+        self.temperature = temperature
+        self.tool_name = tool_name
+        self.checker_tool_name = checker_tool_name
+        self.statement_timeout = statement_timeout
+        """Timeout of the `EXPLAIN` of a candidate, in seconds. 0 disables it."""
+        self.rounds = 0
+        self.extra_calls = 0
+        """LLM calls made on top of the ones of the main plan, the extra GPU cost of sampling."""
+        self.extra_chars = 0
+        self.invalid = 0
+        self.alternatives_picked = 0
+        """Rounds won by an alternative, each likely saves a rewrite iteration."""
+
+    def should_sample(self, intermediate_steps: list[tuple[AgentAction, str]]) -> bool:
+        if self.n <= 1 or not intermediate_steps:
+            return False
+        action, observation = intermediate_steps[-1]
+        if action.tool == self.checker_tool_name:
+            return True
+        return (
+            action.tool == self.tool_name
+            and isinstance(observation, str)
+            and observation.startswith("Error:")
+        )
+
+    async def aplan(
+        self,
+        llm_chain: LLMChain,
+        output_parser: AgentOutputParser,
+        full_inputs: dict[str, Any],
+        callbacks: Callbacks = None,
+    ) -> AgentAction | AgentFinish:
+        self.rounds += 1
+        prompts, stop = await llm_chain.aprep_prompts([full_inputs])
+        # seed 0 is the main plan
+        attempts = {
+            asyncio.create_task(
+                self._attempt(llm_chain, output_parser, prompts, stop, seed)
+            ): seed
+            for seed in range(self.n)
+        }
+        main: Optional[tuple[str, Any]] = None
+        main_error: Optional[BaseException] = None
+        winner: Optional[tuple[str, Any]] = None
+        pending = set(attempts)
+        try:
+            while pending and winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                # the main plan first, then by seed
+                for attempt in sorted(done, key=attempts.get):
+                    is_main = attempts[attempt] == 0
+                    if (error := attempt.exception()) is not None:
+                        if is_main:
+                            main_error = error
+                        continue
+                    output, candidate, valid = attempt.result()
+                    if is_main:
+                        main = output, candidate
+                    if valid:
+                        winner = output, candidate
+                        if not is_main:
+                            self.alternatives_picked += 1
+                            logger.info("Picked an alternative query candidate")
+                        break
+        finally:
+            for attempt in pending:
+                attempt.cancel()
+        if winner is None:
+            if main is None:
+                raise main_error
+            # no valid candidate, let the executor report the error of the main plan
+            winner = main
+        output, candidate = winner
+        await self._replay(llm_chain, prompts, output, callbacks)
+        if isinstance(candidate, Exception):
+            raise candidate
+        return candidate
+
+    async def _attempt(
+        self,
+        llm_chain: LLMChain,
+        output_parser: AgentOutputParser,
+        prompts: list,
+        stop: Optional[list[str]],
+        seed: int,
+    ) -> tuple[str, Any, bool]:
+        """Generate and validate a candidate.
+
+        Returns the output, the candidate or the error parsing it, and whether the candidate may win.
+        """
+        if seed == 0:
+            result = await llm_chain.llm.agenerate_prompt(prompts, stop=stop)
+        else:
+            self.extra_calls += 1
+            result = await llm_chain.llm.agenerate_prompt(
+                prompts,
+                stop=stop,
+                do_sample=True,
+                seed=seed,
+                temperature=self.temperature,
+            )
+        output = result.generations[0][0].text
+        if seed != 0:
+            self.extra_chars += len(output)
+        try:
+            candidate = await output_parser.aparse(output)
+        except Exception as e:
+            return output, e, False
+        if not self._calls_tool(candidate):
+            # the main plan does something else than running a query, alternatives do not replace that
+            return output, candidate, seed == 0
+        valid = await asyncio.to_thread(self._is_valid, candidate.tool_input)
+        if not valid:
+            self.invalid += 1
+        return output, candidate, valid
+
+    async def _replay(
+        self, llm_chain: LLMChain, prompts: list, output: str, callbacks: Callbacks
+    ) -> None:
+        """Stream `output` to `callbacks`, as if it was the only generation."""
+        manager = AsyncCallbackManager.configure(callbacks)
+        run_managers = await manager.on_llm_start(
+            dumpd(llm_chain.llm),
+            [prompt.to_string() for prompt in prompts],
+            invocation_params={"replayed": True},
+        )
+        for run_manager in run_managers:
+            for token in REPLAY_TOKEN.findall(output):
+                await run_manager.on_llm_new_token(token)
+            await run_manager.on_llm_end(
+                LLMResult(generations=[[Generation(text=output)]])
+            )
+
+    def _calls_tool(self, candidate: AgentAction | AgentFinish) -> bool:
+        return isinstance(candidate, AgentAction) and candidate.tool == self.tool_name
+
+    def _is_valid(self, query: Any) -> bool:
+        try:
+            with begin_read(self.db) as connection:
+                if (
+                    self.statement_timeout > 0
+                    and connection.dialect.name == "postgresql"
+                ):
+                    # `SET LOCAL` only lasts until the end of the transaction
+                    timeout_ms = int(self.statement_timeout * 1000)
+                    connection.execute(
+                        text(f"SET LOCAL statement_timeout = {timeout_ms}")
+                    )
+                connection.execute(text(f"EXPLAIN {query}"))
+        except Exception as e:
+            logger.debug(f"Discarding query candidate that cannot be explained: {e}")
+            return False
+        return True
+
+    def stats(self) -> dict[str, int]:
+        return {
+            "rounds": self.rounds,
+            "extra_calls": self.extra_calls,
+            "extra_chars": self.extra_chars,
+            "invalid": self.invalid,
+            "alternatives_picked": self.alternatives_picked,
+        }
@@ -0,0 +1,85 @@
+"""Few-shot examples retrieved from past successful question -> SQL pairs."""
+import re
+from collections import OrderedDict
+
+from pydantic import BaseModel
+
+STOPWORDS = frozenset(
+    {"a", "an", "and", "are", "by", "for", "how", "i", "in", "is", "me", "of"}
+    | {"on", "show", "the", "to", "what", "which", "who", "with"}
+)
+
+
+def tokenize(text: str) -> frozenset[str]:
+    """Lowercased word tokens of `text`, without stopwords."""
+    return frozenset(
+        token for token in re.findall(r"\w+", text.lower()) if token not in STOPWORDS
+    )
+
+
+class Example(BaseModel):
+    question: str
+    sql: str
+
+    def __str__(self) -> str:
+        return f"Question: {self.question}\nSQL: {self.sql}"
+
+
+class ExampleStore:
+    """A bounded, in-process store of verified question -> SQL pairs.
+
+    Examples are indexed lexically by an inverted index over question tokens and ranked by Jaccard similarity.
+    Both memory and retrieval cost are bounded: the store keeps at most `max_size` examples (evicting the oldest),
+    and a search scores at most `max_candidates` examples, visiting the rarest query tokens first.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 1000,
+        max_candidates: int = 200,
+        min_score: float = 0.2,
+    ):
+        self.max_size = max_size
+        self.max_candidates = max_candidates
+        self.min_score = min_score
+        # keyed by the token set so that rephrasing the same question replaces the old example.
+        self._examples: OrderedDict[frozenset[str], Example] = OrderedDict()
+        self._index: dict[str, set[frozenset[str]]] = {}
+
+    def __len__(self) -> int:
+        return len(self._examples)
+
+    def add(self, question: str, sql: str) -> None:
+        tokens = tokenize(question)
+        if not tokens:
+            return
+        self._examples.pop(tokens, None)
+        self._examples[tokens] = Example(question=question, sql=sql)
+        for token in tokens:
+            self._index.setdefault(token, set()).add(tokens)
+        while len(self._examples) > self.max_size:
+            evicted, _ = self._examples.popitem(last=False)
+            for token in evicted:
+                postings = self._index[token]
+                postings.discard(evicted)
+                if not postings:
+                    del self._index[token]
+
+    def search(self, question: str, k: int = 3) -> list[Example]:
+        """Return at most `k` examples most similar to `question`."""
+        tokens = tokenize(question)
+        postings = sorted(
+            (self._index[token] for token in tokens if token in self._index), key=len
+        )
+        candidates: set[frozenset[str]] = set()
+        for posting in postings:
+            candidates.update(posting)
+            if len(candidates) >= self.max_candidates:
+                break
+        scored = []
+        for candidate in candidates:
+            score = len(tokens & candidate) / len(tokens | candidate)
+            if score >= self.min_score:
+                scored.append((score, candidate))
+        scored.sort(key=lambda x: x[0], reverse=True)
+        return [self._examples[candidate] for _, candidate in scored[:k]]
@@ -0,0 +1,242 @@
+"""Cache of question -> SQL plans, used to bypass the LLM for repeated questions."""
+import hashlib
+import json
+import re
+import time
+from datetime import date, timedelta
+from typing import Any, Literal, Optional
+
+from langchain.schema import AgentAction
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+from sqlalchemy import inspect, text
+
+DATE_LITERAL = re.compile(r"\b\d{4}-\d{2}-\d{2}\b")
+PLACEHOLDER = re.compile(
+    r"\{(?:date(\d+)|today([+-]\d+)|(week|month|quarter|year)([+-]\d+)(:end)?)\}"
+)
+RELATIVE_WORDING = re.compile(
+    r"\b(?:(?:last|this|next|past|previous|current|coming)\s+(?:\d+\s+)?"
+    r"(day|week|month|quarter|year)s?"
+    r"|\d+\s+(day|week|month|quarter|year)s?\s+ago"
+    r"|(today|yesterday|tomorrow)"
+    r"|(ytd|year to date))\b"
+)
+PERIOD_MONTHS = {"month": 1, "quarter": 3, "year": 12}
+
+
+class CachedPlanAction(AgentAction):
+    """An action replayed from the plan cache rather than planned by the LLM."""
+
+
+def normalize_question(question: str) -> tuple[str, list[str]]:
+    """Normalize a question for use as cache key.
+
+    Date literals are replaced by positional placeholders, so that the same question asked about another date hits the same entry.
+
+    Returns:
+        tuple[str, list[str]]: the normalized question and the date literals in it.
+    """
+    dates = DATE_LITERAL.findall(question)
+    for i, literal in enumerate(dates):
+        question = question.replace(literal, f"{{date{i}}}", 1)
+    tokens = re.findall(r"[\w{}]+", question.lower())
+    return " ".join(tokens), dates
+
+
+def relative_unit(question: str) -> Optional[str]:
+    """The unit of the dates relative to the day of the run the question refers to ("last month": `month`).
+
+    Returns None if the question has no relative wording, or `mixed` if it uses several units.
+    """
+    units = set()
+    for match in RELATIVE_WORDING.finditer(question.lower()):
+        period, ago, day, year_to_date = match.groups()
+        units.add(period or ago or ("day" if day else "year"))
+    if not units:
+        return None
+    return units.pop() if len(units) == 1 else "mixed"
+
+
+def _period_start(day: date, unit: str) -> date:
+    if unit == "week":
+        return day - timedelta(days=day.weekday())
+    months = PERIOD_MONTHS[unit]
+    return day.replace(month=(day.month - 1) // months * months + 1, day=1)
+
+
+def _shift_period(start: date, unit: str, n: int) -> date:
+    if unit == "week":
+        return start + timedelta(weeks=n)
+    month = start.year * 12 + start.month - 1 + n * PERIOD_MONTHS[unit]
+    return start.replace(year=month // 12, month=month % 12 + 1)
+
+
+def _periods_between(start: date, other: date, unit: str) -> int:
+    if unit == "week":
+        return (other - start).days // 7
+    months = (other.year - start.year) * 12 + other.month - start.month
+    return months // PERIOD_MONTHS[unit]
+
+
+def parameterize_query(
+    query: str, dates: list[str], today: date, unit: Optional[str] = None
+) -> Optional[str]:
+    """Replace date literals in `query` with placeholders.
+
+    Literals that appear in the question become `{dateN}`. Other literals are kept verbatim, unless the question
+    is relative to the day of the run with `unit` (see `relative_unit`): they are then made relative to it,
+    `{today-7}` for days, or the start or end of a period, `{month-1}` / `{month-1:end}`, so that "last month"
+    still means last month when replayed another month.
+
+    Returns None if a literal cannot be made relative to `unit`, the query should not be cached.
+    """
+
+    def _replace(match: re.Match) -> str:
+        literal = match.group(0)
+        if literal in dates:
+            return f"{{date{dates.index(literal)}}}"
+        if unit is None:
+            return literal
+        try:
+            day = date.fromisoformat(literal)
+        except ValueError:
+            return literal
+        if unit == "day" or day == today:
+            return f"{{today{(day - today).days:+d}}}"
+        if unit not in ("week", *PERIOD_MONTHS):
+            raise ValueError(f"Cannot make {literal} relative to {unit}")
+        start = _period_start(day, unit)
+        offset = _periods_between(_period_start(today, unit), start, unit)
+        if day == start:
+            return f"{{{unit}{offset:+d}}}"
+        if day == _shift_period(start, unit, 1) - timedelta(days=1):
+            return f"{{{unit}{offset:+d}:end}}"
+        raise ValueError(f"{literal} is not at a {unit} boundary")
+
+    try:
+        return DATE_LITERAL.sub(_replace, query)
+    except ValueError as e:
+        logger.debug(f"Not caching plan: {e}")
+        return None
+
+
+def render_query(template: str, dates: list[str], today: date) -> Optional[str]:
+    """Inverse of `parameterize_query`. Returns None if the question lacks a date the template needs."""
+
+    def _render(match: re.Match) -> str:
+        index, days, unit, periods, end = match.groups()
+        if index is not None:
+            return dates[int(index)]
+        if days is not None:
+            return (today + timedelta(days=int(days))).isoformat()
+        start = _shift_period(_period_start(today, unit), unit, int(periods))
+        if end is not None:
+            return (_shift_period(start, unit, 1) - timedelta(days=1)).isoformat()
+        return start.isoformat()
+
+    try:
+        return PLACEHOLDER.sub(_render, template)
+    except IndexError:
+        return None
+
+
+class PlanCache:
+    """Question -> SQL plan cache persisted in Redis.
+
+    Entries are recorded after successful runs and replayed on repeated questions.
+    Depending on `validation`, an entry is discarded when the schema changed since it was recorded ("schema"),
+    or additionally when the database refuses to `EXPLAIN` it ("explain").
+    """
+
+    def __init__(
+        self,
+        db: SQLDatabase,
+        redis_url: str = "redis://localhost:6379",
+        key_prefix: str = "sqlbot:plans:",
+        ttl: int = 7 * 24 * 3600,
+        validation: Literal["none", "schema", "explain"] = "schema",
+        strict: bool = False,
+        schema_check_interval: float = 300,
+        tool_name: str = "query_executor",
+    ):
+        from redis import Redis
+
+        self.db = db
+        self.client = Redis.from_url(redis_url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self.ttl = ttl
+        self.validation = validation
+        self.strict = strict
+        """In strict mode the query result is returned as is, without asking the LLM for a final answer."""
+        self.schema_check_interval = schema_check_interval
+        self.tool_name = tool_name
+        self._schema_version: Optional[str] = None
+        self._schema_checked_at = 0.0
+
+    def schema_version(self) -> str:
+        """A fingerprint of the usable tables and their columns, refreshed every `schema_check_interval` seconds."""
+        now = time.monotonic()
+        if (
+            self._schema_version is None
+            or now - self._schema_checked_at > self.schema_check_interval
+        ):
+            inspector = inspect(self.db._engine)
+            schema = [
+                (
+                    table,
+                    [(c["name"], str(c["type"])) for c in inspector.get_columns(table)],
+                )
+                for table in self.db.get_usable_table_names()
+            ]
+            self._schema_version = hashlib.sha1(
+                json.dumps(schema).encode("utf-8")
+            ).hexdigest()
+            self._schema_checked_at = now
+        return self._schema_version
+
+    def _key(self, normalized_question: str) -> str:
+        digest = hashlib.sha1(normalized_question.encode("utf-8")).hexdigest()
+        return f"{self.key_prefix}{digest}"
+
+    def get(self, question: str, today: date) -> Optional[str]:
+        """Get the cached query for `question`, or None if there is no valid entry."""
+        normalized, dates = normalize_question(question)
+        key = self._key(normalized)
+        if (raw := self.client.get(key)) is None:
+            return None
+        entry: dict[str, Any] = json.loads(raw)
+        query = render_query(entry["query"], dates, today)
+        if query is None or not self._is_valid(entry, query):
+            self.client.delete(key)
+            return None
+        return query
+
+    def put(self, question: str, today: date, query: str) -> None:
+        normalized, dates = normalize_question(question)
+        template = parameterize_query(query, dates, today, relative_unit(question))
+        if template is None:
+            return
+        entry = {"query": template}
+        if self.validation != "none":
+            entry["schema"] = self.schema_version()
+        self.client.set(self._key(normalized), json.dumps(entry), ex=self.ttl)
+
+    def invalidate(self, question: str) -> None:
+        normalized, _ = normalize_question(question)
+        self.client.delete(self._key(normalized))
+
+    def _is_valid(self, entry: dict[str, Any], query: str) -> bool:
+        if self.validation == "none":
+            return True
+        if entry.get("schema") != self.schema_version():
+            logger.info("Discarding cached plan as the schema changed")
+            return False
+        if self.validation == "explain":
+            try:
+                with self.db._engine.connect() as connection:
+                    connection.execute(text(f"EXPLAIN {query}"))
+            except Exception as e:
+                logger.info(f"Discarding cached plan as it cannot be explained: {e}")
+                return False
+        return True
@@ -0,0 +1,60 @@
+"""Speculative schema prefetch, started as soon as a question arrives."""
+import asyncio
+from collections import Counter
+
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+
+from sqlbot.agent.examples import tokenize
+from sqlbot.tools.schema_cache import SchemaCache
+
+
+def _stem(word: str) -> str:
+    # good enough to match "movies" with "movie", "actors" with "actor_id"
+    return word[:-1] if len(word) > 3 and word.endswith("s") else word
+
+
+def _parts(identifier: str) -> set[str]:
+    return {_stem(part) for part in identifier.lower().split("_") if part}
+
+
+def match_tables(db: SQLDatabase, question: str, max_tables: int = 5) -> list[str]:
+    """Tables whose name or columns lexically match `question`, best matches first.
+
+    A word of the table name counts 1, a word of a column name counts 1 / the number of tables having it,
+    so that generic columns (`id`, `name`) barely count.
+    """
+    words = {_stem(word) for word in tokenize(question)}
+    columns: dict[str, set[str]] = {}
+    for name in db.get_usable_table_names():
+        table = db._metadata.tables.get(name)
+        if table is not None:
+            columns[name] = set().union(*(_parts(c.name) for c in table.columns))
+    frequency = Counter(part for parts in columns.values() for part in parts)
+    scores = {
+        name: len(_parts(name) & words)
+        + sum(1 / frequency[part] for part in parts & words)
+        for name, parts in columns.items()
+    }
+    matches = sorted(
+        (name for name, score in scores.items() if score > 0.5),
+        key=lambda name: scores[name],
+        reverse=True,
+    )
+    return matches[:max_tables]
+
+
+async def prefetch_schema(
+    cache: SchemaCache, question: str, max_tables: int = 5
+) -> list[str]:
+    """Start fetching the schema of the tables matching `question` into `cache`, returns these tables."""
+    try:
+        tables = await asyncio.to_thread(match_tables, cache.db, question, max_tables)
+    except Exception as e:
+        # prefetching is only an optimization
+        logger.warning(f"Failed to match tables for prefetching: {e}")
+        return []
+    if tables:
+        logger.debug(f"Prefetching the schema of {tables}")
+        cache.prefetch(tables)
+    return tables
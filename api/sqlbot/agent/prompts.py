@@ -8,6 +8,5 @@ Use only the tools mentioned above."""
 TOOLS = """You are equipped with a bunch of powerful tools. You can utilize these tools and observe the outputs to help effectively tackle and resolve user inquiries.
 {tools}"""
 
-# TODO: maybe move to retrieval?
-EXAMPLES = """Here are some example conversations:
+EXAMPLES = """Here are some questions answered previously, along with the SQL queries that answered them:
 {examples}"""
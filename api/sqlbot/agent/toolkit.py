@@ -1,17 +1,32 @@
 """Toolkit for interacting with a SQL database."""
+from typing import Optional
+
 from langchain.agents.agent_toolkits.sql.toolkit import SQLDatabaseToolkit
 from langchain.tools import BaseTool
-from langchain.tools.sql_database.tool import (
-    InfoSQLDatabaseTool,
-    QuerySQLCheckerTool,
-    QuerySQLDataBaseTool,
-)
+from langchain.tools.sql_database.tool import QuerySQLCheckerTool
 
-from sqlbot.tools import QUERY_CHECKER_PROMPT, ListTableTool
+from sqlbot.tools import (
+    QUERY_CHECKER_PROMPT,
+    ListTableTool,
+    QueryExecutorTool,
+    TableSchemaTool,
+)
+from sqlbot.tools.cost_guard import CostGuard
+from sqlbot.tools.formatter import ResultFormatter
+from sqlbot.tools.schema_cache import SchemaCache
+from sqlbot.tools.summary import ResultSummarizer
 
 
 class SQLBotToolkit(SQLDatabaseToolkit):
     redis_url: str = "redis://localhost:6379"
+    column_stats_key_prefix: str = "sqlbot:column_stats:"
+    table_schema_timeout: float = 10.0
+    schema_cache: Optional[SchemaCache] = None
+    query_max_rows: int = 100
+    query_max_bytes: int = 16 * 1024
+    result_formatter: Optional[ResultFormatter] = None
+    result_summarizer: Optional[ResultSummarizer] = None
+    cost_guard: Optional[CostGuard] = None
 
     def get_tools(self) -> list[BaseTool]:
         """Get the tools in the toolkit."""
@@ -35,10 +50,14 @@ class SQLBotToolkit(SQLDatabaseToolkit):
           description: a comma-separated list of table names for which you wish to retrieve the schema
       required: [tool_name, tool_input]
     ```"""
-        table_schema_tool = InfoSQLDatabaseTool(
+        table_schema_tool = TableSchemaTool(
             db=self.db,
             name=table_schema_tool_name,
             description=table_schema_tool_desc,
+            redis_url=self.redis_url,
+            key_prefix=self.column_stats_key_prefix,
+            table_timeout=self.table_schema_timeout,
+            schema_cache=self.schema_cache,
         )
 
         query_executor_tool_name = "query_executor"
@@ -59,10 +78,15 @@ class SQLBotToolkit(SQLDatabaseToolkit):
           description: the SQL query you want to execute
       required: [tool_name, tool_input]
     ```"""
-        query_executor_tool = QuerySQLDataBaseTool(
+        query_executor_tool = QueryExecutorTool(
             db=self.db,
             name=query_executor_tool_name,
             description=query_executor_tool_desc,
+            max_rows=self.query_max_rows,
+            max_bytes=self.query_max_bytes,
+            formatter=self.result_formatter,
+            summarizer=self.result_summarizer,
+            cost_guard=self.cost_guard,
         )
 
         query_checker_tool_name = "query_checker"
@@ -1,6 +1,10 @@
 from sqlbot.callbacks.error import LCErrorCallbackHandler
 from sqlbot.callbacks.final_answer import StreamingFinalAnswerCallbackHandler
 from sqlbot.callbacks.human_approval import WebsocketHumanApprovalCallbackHandler
+from sqlbot.callbacks.latency import LatencyCallbackHandler
+from sqlbot.callbacks.metrics import MetricsCallbackHandler
+from sqlbot.callbacks.run_labels import RunLabelCallbackHandler
+from sqlbot.callbacks.spans import SpanCallbackHandler
 from sqlbot.callbacks.thought import StreamingIntermediateThoughtCallbackHandler
 from sqlbot.callbacks.tracing import TracingLLMCallbackHandler
 from sqlbot.callbacks.update_chat import UpdateConversationCallbackHandler
@@ -1,10 +1,11 @@
-from fastapi import WebSocket
 from langchain.callbacks.base import AsyncCallbackHandler
 
+from sqlbot.websocket import WebsocketWriter
+
 
 class WebsocketCallbackHandler(AsyncCallbackHandler):
     """Callback handler for streaming LLM responses."""
 
-    def __init__(self, websocket: WebSocket, conversation_id: str):
+    def __init__(self, websocket: WebsocketWriter, conversation_id: str):
         self.websocket = websocket
         self.conversation_id = conversation_id
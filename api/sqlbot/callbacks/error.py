@@ -1,3 +1,4 @@
+import asyncio
 from typing import Any, Optional
 from uuid import UUID
 
@@ -16,6 +17,9 @@ class LCErrorCallbackHandler(WebsocketCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when LLM errors."""
+        if isinstance(error, asyncio.CancelledError):
+            # cancelled on purpose
+            return
         message = ChatMessage(
             id=run_id,
             conversation=self.conversation_id,
@@ -35,6 +39,9 @@ class LCErrorCallbackHandler(WebsocketCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when chain errors."""
+        if isinstance(error, asyncio.CancelledError):
+            # cancelled on purpose
+            return
         message = ChatMessage(
             id=run_id,
             conversation=self.conversation_id,
@@ -54,6 +61,9 @@ class LCErrorCallbackHandler(WebsocketCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when tool errors."""
+        if isinstance(error, asyncio.CancelledError):
+            # cancelled on purpose
+            return
         message = ChatMessage(
             id=run_id,
             conversation=self.conversation_id,
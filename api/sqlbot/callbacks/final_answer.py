@@ -1,12 +1,12 @@
 from typing import Any, Optional
 from uuid import UUID
 
-from fastapi import WebSocket
 from langchain.schema import AgentFinish
 from langchain.schema.output import LLMResult
 
 from sqlbot.callbacks.base import WebsocketCallbackHandler
 from sqlbot.schemas import ChatMessage
+from sqlbot.websocket import WebsocketWriter
 
 DEFAULT_ANSWER_PREFIX_TOKENS = ["Final", "Answer", ":"]
 
@@ -19,7 +19,7 @@ class StreamingFinalAnswerCallbackHandler(WebsocketCallbackHandler):
 
     def __init__(
         self,
-        websocket: WebSocket,
+        websocket: WebsocketWriter,
         conversation_id: str,
         answer_prefix_tokens: Optional[list[str]] = None,
         strip_tokens: bool = True,
@@ -144,7 +144,8 @@ class StreamingFinalAnswerCallbackHandler(WebsocketCallbackHandler):
     ) -> None:
         """Run on agent end."""
         reason = finish.return_values.get("reason", None)
-        if reason == "early_stopped":
+        # no tokens were streamed for these answers, unlike generated answers of stopped runs
+        if reason in ("early_stopped", "plan_cache"):
             message = ChatMessage(
                 id=run_id,
                 conversation=self.conversation_id,
@@ -2,10 +2,10 @@ from typing import Any, Callable, Optional
 from uuid import UUID
 
 import sqlparse
-from fastapi import WebSocket
 
 from sqlbot.callbacks.base import WebsocketCallbackHandler
 from sqlbot.schemas import ChatMessage
+from sqlbot.websocket import WebsocketWriter
 
 
 class WebsocketHumanApprovalCallbackHandler(WebsocketCallbackHandler):
@@ -13,7 +13,7 @@ class WebsocketHumanApprovalCallbackHandler(WebsocketCallbackHandler):
 
     def __init__(
         self,
-        websocket: WebSocket,
+        websocket: WebsocketWriter,
         conversation_id: str,
         should_check: Callable[[dict[str, Any]], bool] = lambda _: True,
     ):
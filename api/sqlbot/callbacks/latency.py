@@ -0,0 +1,119 @@
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema.output import ChatGenerationChunk, GenerationChunk, LLMResult
+from loguru import logger
+
+from sqlbot.metrics import (
+    LLM_DURATION,
+    LLM_ERRORS,
+    LLM_TIME_TO_FIRST_TOKEN,
+    LLM_TOKENS_PER_SECOND,
+)
+
+
+class LatencyCallbackHandler(AsyncCallbackHandler):
+    """Callback handler measuring the latency of the LLM requests of a route, exported as metrics labelled by role."""
+
+    def __init__(self, route: str):
+        self.route = route
+        self.requests = 0
+        self.errors = 0
+        self.seconds = 0.0
+        self.max_seconds = 0.0
+        self.first_token_seconds = 0.0
+        self.streamed = 0
+        self._started: dict[UUID, float] = {}
+        # time of the first token and number of tokens, by run
+        self._streaming: dict[UUID, list] = {}
+
+    async def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM starts running."""
+        self._started[run_id] = time.perf_counter()
+
+    async def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        chunk: Optional[GenerationChunk | ChatGenerationChunk] = None,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        if (streaming := self._streaming.get(run_id)) is not None:
+            streaming[1] += 1
+            return
+        if run_id not in self._started:
+            return
+        now = time.perf_counter()
+        self._streaming[run_id] = [now, 1]
+        self.streamed += 1
+        self.first_token_seconds += now - self._started[run_id]
+        LLM_TIME_TO_FIRST_TOKEN.labels(self.route).observe(now - self._started[run_id])
+
+    async def on_llm_end(
+        self,
+        response: LLMResult,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM ends running."""
+        self._finish(run_id)
+
+    async def on_llm_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM errors."""
+        self.errors += 1
+        LLM_ERRORS.labels(self.route).inc()
+        self._finish(run_id)
+
+    def _finish(self, run_id: UUID) -> None:
+        streaming = self._streaming.pop(run_id, None)
+        if (start := self._started.pop(run_id, None)) is None:
+            return
+        end = time.perf_counter()
+        seconds = end - start
+        LLM_DURATION.labels(self.route).observe(seconds)
+        if streaming is not None and streaming[1] > 1 and end > streaming[0]:
+            LLM_TOKENS_PER_SECOND.labels(self.route).observe(
+                (streaming[1] - 1) / (end - streaming[0])
+            )
+        self.requests += 1
+        self.seconds += seconds
+        self.max_seconds = max(self.max_seconds, seconds)
+        logger.debug(f"LLM route {self.route} answered in {seconds:.3f}s")
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "mean_seconds": self.seconds / self.requests if self.requests else 0.0,
+            "max_seconds": self.max_seconds,
+            "mean_first_token_seconds": self.first_token_seconds / self.streamed
+            if self.streamed
+            else 0.0,
+        }
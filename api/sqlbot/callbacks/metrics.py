@@ -0,0 +1,113 @@
+import time
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema import AgentAction
+
+from sqlbot.metrics import AGENT_ITERATIONS, TOOL_DURATION, TOOL_ERRORS
+
+
+class MetricsCallbackHandler(AsyncCallbackHandler):
+    """Callback handler observing the duration of tool calls and the iterations of the agent."""
+
+    def __init__(self):
+        self._tools: dict[UUID, tuple[str, float]] = {}
+        self._iterations: dict[UUID, int] = {}
+
+    async def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain starts running."""
+        if parent_run_id is None:
+            self._iterations[run_id] = 0
+
+    async def on_agent_action(
+        self,
+        action: AgentAction,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run on agent action."""
+        if run_id in self._iterations:
+            self._iterations[run_id] += 1
+
+    async def on_chain_end(
+        self,
+        outputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain ends running."""
+        if (iterations := self._iterations.pop(run_id, None)) is not None:
+            AGENT_ITERATIONS.observe(iterations)
+
+    async def on_chain_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain errors."""
+        if (iterations := self._iterations.pop(run_id, None)) is not None:
+            AGENT_ITERATIONS.observe(iterations)
+
+    async def on_tool_start(
+        self,
+        serialized: Dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool starts running."""
+        self._tools[run_id] = (serialized.get("name", "unknown"), time.perf_counter())
+
+    async def on_tool_end(
+        self,
+        output: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool ends running."""
+        if (started := self._tools.pop(run_id, None)) is not None:
+            name, start = started
+            TOOL_DURATION.labels(name).observe(time.perf_counter() - start)
+
+    async def on_tool_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool errors."""
+        if (started := self._tools.pop(run_id, None)) is not None:
+            name, start = started
+            TOOL_DURATION.labels(name).observe(time.perf_counter() - start)
+            TOOL_ERRORS.labels(name).inc()
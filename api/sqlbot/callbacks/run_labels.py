@@ -0,0 +1,25 @@
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler
+
+from sqlbot.watchdog import run_labels
+
+
+class RunLabelCallbackHandler(AsyncCallbackHandler):
+    """Callback handler adding the id of the agent run to the labels of the current run."""
+
+    async def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain starts running."""
+        if parent_run_id is None and (labels := run_labels.get()) is not None:
+            labels["run_id"] = str(run_id)
@@ -0,0 +1,218 @@
+import asyncio
+from typing import Any, Dict, Optional
+from uuid import UUID
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.schema.output import ChatGenerationChunk, GenerationChunk, LLMResult
+from loguru import logger
+
+from sqlbot.tracing import Trace
+
+_exports: set[asyncio.Task] = set()
+"""Exports in progress, referenced until they finish."""
+
+
+def _span_id(run_id: UUID) -> str:
+    return run_id.hex[:16]
+
+
+def _parent_id(parent_run_id: Optional[UUID]) -> Optional[str]:
+    return _span_id(parent_run_id) if parent_run_id is not None else None
+
+
+class SpanCallbackHandler(AsyncCallbackHandler):
+    """Callback handler recording the runs of an agent run as a tree of spans, exported once the agent finishes.
+
+    Traces are exported in the background, the run does not wait for the exporter.
+    """
+
+    def __init__(self, trace: Trace, exporter: Any):
+        self.trace = trace
+        self.exporter = exporter
+        self._tokens: dict[UUID, int] = {}
+
+    async def on_chain_start(
+        self,
+        serialized: Dict[str, Any],
+        inputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain starts running."""
+        if parent_run_id is None:
+            self.trace.trace_id = run_id.hex
+        name = serialized.get("name") or (serialized.get("id") or ["chain"])[-1]
+        self.trace.start(
+            _span_id(run_id), name, "chain", parent_id=_parent_id(parent_run_id)
+        )
+
+    async def on_chain_end(
+        self,
+        outputs: Dict[str, Any],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain ends running."""
+        self.trace.end(_span_id(run_id))
+        if parent_run_id is None:
+            self._schedule_export()
+
+    async def on_chain_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when chain errors."""
+        self.trace.end(_span_id(run_id), error=repr(error))
+        if parent_run_id is None:
+            self._schedule_export()
+
+    async def on_llm_start(
+        self,
+        serialized: Dict[str, Any],
+        prompts: list[str],
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM starts running."""
+        self._tokens[run_id] = 0
+        self.trace.start(
+            _span_id(run_id),
+            "llm",
+            "llm",
+            parent_id=_parent_id(parent_run_id),
+            **{
+                # the route of the LLM, see `LLMRouter`
+                "llm.role": tags[-1] if tags else None,
+                "llm.prompt_chars": sum(len(prompt) for prompt in prompts),
+            },
+        )
+
+    async def on_llm_new_token(
+        self,
+        token: str,
+        *,
+        chunk: Optional[GenerationChunk | ChatGenerationChunk] = None,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run on new LLM token. Only available when streaming is enabled."""
+        if run_id in self._tokens:
+            self._tokens[run_id] += 1
+
+    async def on_llm_end(
+        self,
+        response: LLMResult,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM ends running."""
+        attributes = {
+            "llm.output_chars": sum(
+                len(generation.text)
+                for generations in response.generations
+                for generation in generations
+            )
+        }
+        if tokens := self._tokens.pop(run_id, 0):
+            attributes["llm.output_tokens"] = tokens
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        for key, value in usage.items():
+            attributes[f"llm.usage.{key}"] = value
+        self.trace.end(_span_id(run_id), **attributes)
+
+    async def on_llm_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when LLM errors."""
+        tokens = self._tokens.pop(run_id, 0)
+        self.trace.end(
+            _span_id(run_id), error=repr(error), **{"llm.output_tokens": tokens}
+        )
+
+    async def on_tool_start(
+        self,
+        serialized: Dict[str, Any],
+        input_str: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        metadata: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool starts running."""
+        self.trace.start(
+            _span_id(run_id),
+            serialized.get("name", "tool"),
+            "tool",
+            parent_id=_parent_id(parent_run_id),
+            **{"tool.input": input_str},
+        )
+
+    async def on_tool_end(
+        self,
+        output: str,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool ends running."""
+        self.trace.end(_span_id(run_id), **{"tool.output_chars": len(str(output))})
+
+    async def on_tool_error(
+        self,
+        error: Exception | KeyboardInterrupt,
+        *,
+        run_id: UUID,
+        parent_run_id: Optional[UUID] = None,
+        tags: Optional[list[str]] = None,
+        **kwargs: Any,
+    ) -> None:
+        """Run when tool errors."""
+        self.trace.end(_span_id(run_id), error=repr(error))
+
+    def _schedule_export(self) -> None:
+        task = asyncio.get_running_loop().create_task(self._export())
+        _exports.add(task)
+        task.add_done_callback(_exports.discard)
+
+    async def _export(self) -> None:
+        try:
+            await self.exporter.export(self.trace)
+        except Exception as e:
+            logger.warning(f"Failed to export trace {self.trace.trace_id}: {e}")
+
+
+async def wait_for_exports() -> None:
+    """Wait for the exports in progress, e.g. before closing the session of the exporter."""
+    if _exports:
+        await asyncio.gather(*_exports, return_exceptions=True)
@@ -1,10 +1,9 @@
 from typing import Any, Optional
 from uuid import UUID
 
-from fastapi import WebSocket
-
 from sqlbot.callbacks.base import WebsocketCallbackHandler
 from sqlbot.schemas import ChatMessage
+from sqlbot.websocket import WebsocketWriter
 
 DEFAULT_ACTION_PREFFIX_TOKEN = "Action"
 DEFAULT_ANSWER_PREFIX_TOKENS = ["Final", " Answer", ":"]
@@ -18,7 +17,7 @@ class StreamingIntermediateThoughtCallbackHandler(WebsocketCallbackHandler):
 
     def __init__(
         self,
-        websocket: WebSocket,
+        websocket: WebsocketWriter,
         conversation_id: str,
         action_preffix_token: Optional[str] = None,
         answer_prefix_tokens: Optional[list[str]] = None,
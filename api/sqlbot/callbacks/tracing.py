@@ -1,3 +1,4 @@
+import random
 from typing import Any, Dict, Optional
 from uuid import UUID
 
@@ -7,7 +8,27 @@ from loguru import logger
 
 
 class TracingLLMCallbackHandler(AsyncCallbackHandler):
-    """Callback handler for logging LLM input and output."""
+    """Callback handler for logging LLM input and output.
+
+    Logs are gated by `level`, the level of the log sink, and formatted lazily: below DEBUG, nothing is logged
+    but the prompts and responses of a `prompt_sample_rate` fraction of the LLM calls, which are logged at INFO,
+    or at `level` if it is above, so that the sink keeps them. Tokens are only logged at TRACE.
+    """
+
+    def __init__(self, level: str = "DEBUG", prompt_sample_rate: float = 0.0):
+        level_no = logger.level(level.upper()).no
+        self.debug = level_no <= logger.level("DEBUG").no
+        self.trace = level_no <= logger.level("TRACE").no
+        self.sample_level = max(
+            level.upper(), "INFO", key=lambda name: logger.level(name).no
+        )
+        self.prompt_sample_rate = prompt_sample_rate
+        self._sampled: set[UUID] = set()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether the handler logs anything at all, there is no point attaching it otherwise."""
+        return self.debug or self.prompt_sample_rate > 0
 
     async def on_llm_start(
         self,
@@ -21,9 +42,22 @@ class TracingLLMCallbackHandler(AsyncCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when LLM starts running."""
-        logger.debug(
-            f"on_llm_start run_id={run_id} parent_run_id={parent_run_id} prompts={prompts}"
-        )
+        if self.prompt_sample_rate > 0 and random.random() < self.prompt_sample_rate:
+            self._sampled.add(run_id)
+            logger.log(
+                self.sample_level,
+                "on_llm_start run_id={} parent_run_id={} prompts={}",
+                run_id,
+                parent_run_id,
+                prompts,
+            )
+        elif self.debug:
+            logger.debug(
+                "on_llm_start run_id={} parent_run_id={} prompts={}",
+                run_id,
+                parent_run_id,
+                prompts,
+            )
 
     async def on_llm_new_token(
         self,
@@ -36,9 +70,14 @@ class TracingLLMCallbackHandler(AsyncCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run on new LLM token. Only available when streaming is enabled."""
-        logger.trace(
-            f"on_llm_new_token run_id={run_id} parent_run_id={parent_run_id} token={token} chunk={chunk}"
-        )
+        if self.trace:
+            logger.trace(
+                "on_llm_new_token run_id={} parent_run_id={} token={} chunk={}",
+                run_id,
+                parent_run_id,
+                token,
+                chunk,
+            )
 
     async def on_llm_end(
         self,
@@ -50,9 +89,22 @@ class TracingLLMCallbackHandler(AsyncCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when LLM ends running."""
-        logger.debug(
-            f"on_llm_end run_id={run_id} parent_run_id={parent_run_id} response={response}"
-        )
+        if run_id in self._sampled:
+            self._sampled.discard(run_id)
+            logger.log(
+                self.sample_level,
+                "on_llm_end run_id={} parent_run_id={} response={}",
+                run_id,
+                parent_run_id,
+                response,
+            )
+        elif self.debug:
+            logger.debug(
+                "on_llm_end run_id={} parent_run_id={} response={}",
+                run_id,
+                parent_run_id,
+                response,
+            )
 
     async def on_llm_error(
         self,
@@ -64,6 +116,10 @@ class TracingLLMCallbackHandler(AsyncCallbackHandler):
         **kwargs: Any,
     ) -> None:
         """Run when LLM errors."""
+        self._sampled.discard(run_id)
         logger.error(
-            f"on_llm_error run_id={run_id} parent_run_id={parent_run_id} error={error}"
+            "on_llm_error run_id={} parent_run_id={} error={}",
+            run_id,
+            parent_run_id,
+            error,
         )
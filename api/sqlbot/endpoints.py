@@ -0,0 +1,420 @@
+"""Clients of text-generation-inference endpoints, and load balancing across them."""
+import asyncio
+import json
+import time
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Optional
+
+import aiohttp
+from loguru import logger
+from pydantic import ValidationError
+from text_generation import AsyncClient
+from text_generation.errors import (
+    OverloadedError,
+    ShardNotReadyError,
+    ShardTimeoutError,
+    parse_error,
+)
+from text_generation.types import Parameters, Request, Response, StreamResponse
+
+RETRYABLE_ERRORS = (
+    aiohttp.ClientError,
+    asyncio.TimeoutError,
+    OverloadedError,
+    ShardNotReadyError,
+    ShardTimeoutError,
+)
+"""Errors of an endpoint another endpoint may not have, as opposed to e.g. validation errors of the request."""
+
+
+class ConnectionStats:
+    """Counts the connections opened and reused by the sessions it traces."""
+
+    def __init__(self):
+        self.created = 0
+        self.reused = 0
+
+    def trace_config(self) -> aiohttp.TraceConfig:
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_create)
+        trace_config.on_connection_reuseconn.append(self._on_reuse)
+        return trace_config
+
+    async def _on_create(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: Any
+    ) -> None:
+        self.created += 1
+
+    async def _on_reuse(
+        self, session: aiohttp.ClientSession, context: SimpleNamespace, params: Any
+    ) -> None:
+        self.reused += 1
+
+    def stats(self) -> dict[str, float]:
+        total = self.created + self.reused
+        return {
+            "created": self.created,
+            "reused": self.reused,
+            "reuse_rate": self.reused / total if total else 0.0,
+        }
+
+
+def create_session(
+    max_connections: int = 100,
+    keepalive_timeout: float = 60,
+    stats: Optional[ConnectionStats] = None,
+) -> aiohttp.ClientSession:
+    """Create a session keeping connections to the endpoints alive between requests.
+
+    Must be called from a running event loop, and closed once done.
+    """
+    connector = aiohttp.TCPConnector(
+        limit=0,
+        limit_per_host=max_connections,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(
+        connector=connector,
+        trace_configs=[stats.trace_config()] if stats is not None else None,
+    )
+
+
+class KeepAliveClient(AsyncClient):
+    """`text_generation.AsyncClient` sending its requests through a long-lived session.
+
+    `AsyncClient` opens a new session, hence a new connection, for every request.
+    """
+
+    def __init__(
+        self,
+        base_url: str,
+        session: aiohttp.ClientSession,
+        headers: Optional[dict[str, str]] = None,
+        cookies: Optional[dict[str, str]] = None,
+        timeout: int = 10,
+    ):
+        super().__init__(base_url, headers=headers, cookies=cookies, timeout=timeout)
+        self.session = session
+
+    def _request(
+        self,
+        prompt: str,
+        stream: bool,
+        do_sample: bool = False,
+        max_new_tokens: int = 20,
+        best_of: Optional[int] = None,
+        repetition_penalty: Optional[float] = None,
+        return_full_text: bool = False,
+        seed: Optional[int] = None,
+        stop_sequences: Optional[list[str]] = None,
+        temperature: Optional[float] = None,
+        top_k: Optional[int] = None,
+        top_p: Optional[float] = None,
+        truncate: Optional[int] = None,
+        typical_p: Optional[float] = None,
+        watermark: bool = False,
+        decoder_input_details: bool = False,
+        top_n_tokens: Optional[int] = None,
+    ) -> dict[str, Any]:
+        parameters = Parameters(
+            best_of=best_of,
+            details=True,
+            decoder_input_details=decoder_input_details,
+            do_sample=do_sample,
+            max_new_tokens=max_new_tokens,
+            repetition_penalty=repetition_penalty,
+            return_full_text=return_full_text,
+            seed=seed,
+            stop=stop_sequences if stop_sequences is not None else [],
+            temperature=temperature,
+            top_k=top_k,
+            top_p=top_p,
+            truncate=truncate,
+            typical_p=typical_p,
+            watermark=watermark,
+            top_n_tokens=top_n_tokens,
+        )
+        return Request(inputs=prompt, stream=stream, parameters=parameters).model_dump()
+
+    def _post(self, request: dict[str, Any]):
+        return self.session.post(
+            self.base_url,
+            json=request,
+            headers=self.headers,
+            cookies=self.cookies,
+            timeout=self.timeout,
+        )
+
+    async def generate(self, prompt: str, **kwargs: Any) -> Response:
+        async with self._post(self._request(prompt, stream=False, **kwargs)) as resp:
+            payload = await resp.json()
+            if resp.status != 200:
+                raise parse_error(resp.status, payload)
+            return Response(**payload[0])
+
+    async def generate_stream(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncIterator[StreamResponse]:
+        async with self._post(self._request(prompt, stream=True, **kwargs)) as resp:
+            if resp.status != 200:
+                raise parse_error(resp.status, await resp.json())
+            # server-sent events
+            async for line in resp.content:
+                payload = line.decode("utf-8")
+                if not payload.startswith("data:"):
+                    continue
+                data = json.loads(payload.removeprefix("data:"))
+                try:
+                    response = StreamResponse(**data)
+                except ValidationError:
+                    # an error event
+                    raise parse_error(resp.status, data)
+                yield response
+
+
+class Endpoint:
+    def __init__(self, client: AsyncClient, alpha: float = 0.3):
+        self.client = client
+        self.alpha = alpha
+        self.ttft: Optional[float] = None
+        """Exponentially weighted moving average of the time to first token, in seconds."""
+        self.in_flight = 0
+        self.healthy = True
+
+    @property
+    def url(self) -> str:
+        return self.client.base_url
+
+    def score(self) -> tuple[float, int]:
+        """Lower is better. Endpoints without observations come first, so that they get some."""
+        return (self.ttft or 0.0) * (self.in_flight + 1), self.in_flight
+
+    def observe_ttft(self, seconds: float) -> None:
+        if self.ttft is None:
+            self.ttft = seconds
+        else:
+            self.ttft = self.alpha * seconds + (1 - self.alpha) * self.ttft
+
+
+class EndpointPool:
+    """Balances requests across TGI endpoints, by observed time to first token and requests in flight.
+
+    Quacks like `text_generation.AsyncClient`, so that it can replace the `async_client` of
+    `HuggingFaceTextGenInference`.
+
+    If `hedge_after` is set, a stream whose first token did not arrive within `hedge_after` seconds is hedged:
+    the same request is sent to the next best endpoint, the first to produce a token wins and the other is cancelled.
+    A request failing on an endpoint before its first token is retried once on another healthy endpoint.
+    Endpoints failing a request or their `/health` check are taken out of rotation until they pass a check again.
+    """
+
+    def __init__(
+        self,
+        urls: list[str],
+        timeout: int = 120,
+        hedge_after: Optional[float] = None,
+        alpha: float = 0.3,
+        session: Optional[aiohttp.ClientSession] = None,
+        **client_kwargs: Any,
+    ):
+        self.endpoints = [
+            Endpoint(
+                KeepAliveClient(url, session, timeout=timeout, **client_kwargs)
+                if session is not None
+                else AsyncClient(url, timeout=timeout, **client_kwargs),
+                alpha=alpha,
+            )
+            for url in urls
+        ]
+        self.session = session
+        self.hedge_after = hedge_after
+        self.hedged = 0
+        self.hedges_won = 0
+        self.failovers = 0
+        """Requests retried on another endpoint after a failure."""
+
+    def pick(
+        self, exclude: Optional[Endpoint] = None, healthy_only: bool = False
+    ) -> Optional[Endpoint]:
+        """The best endpoint. Unhealthy endpoints are only picked if all are, unless `healthy_only`."""
+        candidates = [e for e in self.endpoints if e is not exclude]
+        healthy = [e for e in candidates if e.healthy]
+        if not healthy and not healthy_only:
+            healthy = candidates
+        if not healthy:
+            return None
+        return min(healthy, key=Endpoint.score)
+
+    def _mark_down(self, endpoint: Endpoint, reason: Any) -> None:
+        if endpoint.healthy:
+            logger.warning(
+                f"Taking LLM endpoint {endpoint.url} out of rotation: {reason}"
+            )
+        endpoint.healthy = False
+
+    def _failover(self, failed: Endpoint, error: BaseException) -> Optional[Endpoint]:
+        """The healthy endpoint to retry a request `failed` could not serve, if the error is worth a retry."""
+        if not isinstance(error, RETRYABLE_ERRORS):
+            return None
+        if (endpoint := self.pick(exclude=failed, healthy_only=True)) is None:
+            return None
+        logger.info(f"Request to {failed.url} failed, retrying on {endpoint.url}")
+        self.failovers += 1
+        return endpoint
+
+    async def generate(self, prompt: str, **kwargs: Any) -> Response:
+        primary = self.pick()
+        try:
+            return await self._generate(primary, prompt, kwargs)
+        except RETRYABLE_ERRORS as e:
+            if (secondary := self._failover(primary, e)) is None:
+                raise
+        return await self._generate(secondary, prompt, kwargs)
+
+    async def _generate(
+        self, endpoint: Endpoint, prompt: str, kwargs: dict[str, Any]
+    ) -> Response:
+        endpoint.in_flight += 1
+        try:
+            return await endpoint.client.generate(prompt, **kwargs)
+        except aiohttp.ClientError as e:
+            self._mark_down(endpoint, e)
+            raise
+        finally:
+            endpoint.in_flight -= 1
+
+    async def generate_stream(
+        self, prompt: str, **kwargs: Any
+    ) -> AsyncIterator[StreamResponse]:
+        primary = self.pick()
+        first = asyncio.create_task(self._first_token(primary, prompt, kwargs))
+        attempts = {first}
+        endpoints = {first: primary}
+        hedge = winner = error = None
+
+        def _retry_on(endpoint: Endpoint) -> asyncio.Task:
+            attempt = asyncio.create_task(self._first_token(endpoint, prompt, kwargs))
+            attempts.add(attempt)
+            endpoints[attempt] = endpoint
+            return attempt
+
+        try:
+            done, _ = await asyncio.wait(attempts, timeout=self.hedge_after)
+            # only hedge to an endpoint known to be up
+            if not done and (
+                secondary := self.pick(exclude=primary, healthy_only=True)
+            ):
+                logger.info(
+                    f"No token from {primary.url} after {self.hedge_after}s, hedging to {secondary.url}"
+                )
+                self.hedged += 1
+                hedge = _retry_on(secondary)
+            while attempts:
+                done, attempts = await asyncio.wait(
+                    attempts, return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt in done:
+                    if (attempt_error := attempt.exception()) is not None:
+                        error = attempt_error
+                        # the primary failed before any hedge, retry once elsewhere
+                        if len(endpoints) == 1 and (
+                            secondary := self._failover(primary, attempt_error)
+                        ):
+                            _retry_on(secondary)
+                        continue
+                    if winner is None:
+                        winner = attempt
+                    else:
+                        # both endpoints answered at once, drop the late one
+                        await self._discard(endpoints[attempt], *attempt.result())
+                if winner is not None:
+                    break
+            if winner is None:
+                # every attempt failed, raise the error of the last one
+                raise error
+        finally:
+            for attempt in attempts:
+                attempt.cancel()
+        if winner is hedge:
+            self.hedges_won += 1
+        endpoint = endpoints[winner]
+        stream, first = winner.result()
+        try:
+            yield first
+            async for response in stream:
+                yield response
+        finally:
+            endpoint.in_flight -= 1
+            await stream.aclose()
+
+    async def _discard(
+        self, endpoint: Endpoint, stream: AsyncIterator[StreamResponse], _: Any
+    ) -> None:
+        endpoint.in_flight -= 1
+        await stream.aclose()
+
+    async def _first_token(
+        self, endpoint: Endpoint, prompt: str, kwargs: dict[str, Any]
+    ) -> tuple[AsyncIterator[StreamResponse], StreamResponse]:
+        """Start streaming from `endpoint`, returns the stream and its first token.
+
+        `endpoint.in_flight` is left incremented on success, for the caller to decrement once done.
+        """
+        endpoint.in_flight += 1
+        start = time.perf_counter()
+        stream = endpoint.client.generate_stream(prompt, **kwargs)
+        try:
+            first = await stream.__anext__()
+        except BaseException as e:
+            endpoint.in_flight -= 1
+            await stream.aclose()
+            if isinstance(e, aiohttp.ClientError):
+                self._mark_down(endpoint, e)
+            raise
+        endpoint.observe_ttft(time.perf_counter() - start)
+        return stream, first
+
+    async def check(self) -> None:
+        """Check the `/health` route of every endpoint."""
+        if self.session is not None:
+            await self._check(self.session)
+            return
+        async with aiohttp.ClientSession() as session:
+            await self._check(session)
+
+    async def _check(self, session: aiohttp.ClientSession) -> None:
+        timeout = aiohttp.ClientTimeout(total=5)
+        for endpoint in self.endpoints:
+            try:
+                async with session.get(
+                    f"{endpoint.url}/health", timeout=timeout
+                ) as response:
+                    healthy = response.status == 200
+            except Exception as e:
+                self._mark_down(endpoint, e)
+                continue
+            if not healthy:
+                self._mark_down(endpoint, f"health check returned {response.status}")
+            elif not endpoint.healthy:
+                logger.info(f"Putting LLM endpoint {endpoint.url} back into rotation")
+                endpoint.healthy = True
+
+    async def run(self, interval: float) -> None:
+        """Check the endpoints every `interval` seconds, until cancelled."""
+        while True:
+            try:
+                await self.check()
+            except Exception as e:
+                logger.error(f"Failed to check LLM endpoints: {e}")
+            await asyncio.sleep(interval)
+
+    def stats(self) -> dict[str, Any]:
+        return {
+            "hedged": self.hedged,
+            "hedges_won": self.hedges_won,
+            "failovers": self.failovers,
+            "endpoints": {
+                e.url: {"ttft": e.ttft, "in_flight": e.in_flight, "healthy": e.healthy}
+                for e in self.endpoints
+            },
+        }
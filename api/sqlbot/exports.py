@@ -0,0 +1,161 @@
+"""Export full query results, without going through the LLM."""
+import asyncio
+import csv
+import io
+import json
+import threading
+from typing import Any, AsyncIterator, Callable, Literal, Sequence
+
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+from sqlalchemy import text
+
+from sqlbot.warehouse import StatementCanceller, connect_read
+
+_DONE = object()
+
+
+class _QueryProducer:
+    """Runs a query read-only in a worker thread, and puts the column names, then chunks of rows, into an asyncio queue.
+
+    The worker thread is the only one touching the connection, `stop` can be called from any thread.
+    """
+
+    def __init__(
+        self,
+        db: SQLDatabase,
+        query: str,
+        loop: asyncio.AbstractEventLoop,
+        queue: asyncio.Queue,
+        chunk_size: int,
+    ):
+        self.db = db
+        self.query = query
+        self.loop = loop
+        self.queue = queue
+        self.chunk_size = chunk_size
+        self.stopped = threading.Event()
+        self.canceller = StatementCanceller()
+
+    def stop(self) -> None:
+        self.stopped.set()
+        # interrupt a long running statement, otherwise it stops before the next fetch
+        self.canceller.cancel()
+
+    def run(self) -> None:
+        try:
+            self._run()
+        except Exception as e:
+            if not self.stopped.is_set():
+                logger.error(f"Failed to export query result: {e}")
+                self._put(e)
+        finally:
+            self._put(_DONE)
+
+    def _run(self) -> None:
+        with connect_read(self.db) as connection, self.canceller.attach(connection):
+            if self.db.dialect == "postgresql":
+                connection.exec_driver_sql("SET TRANSACTION READ ONLY")
+            try:
+                result = connection.execution_options(
+                    stream_results=True, max_row_buffer=self.chunk_size
+                ).execute(text(self.query))
+                if not self._put(list(result.keys())):
+                    return
+                while not self.stopped.is_set():
+                    rows = result.fetchmany(self.chunk_size)
+                    if not rows or not self._put(rows):
+                        break
+                result.close()
+            finally:
+                # never commit anything
+                connection.rollback()
+
+    def _put(self, item: Any) -> bool:
+        """Put `item` into the queue, waiting for room unless stopped."""
+        future = asyncio.run_coroutine_threadsafe(self.queue.put(item), self.loop)
+        while not self.stopped.is_set():
+            try:
+                future.result(timeout=1)
+                return True
+            except TimeoutError:
+                continue
+        future.cancel()
+        return False
+
+
+async def stream_query(
+    db: SQLDatabase, query: str, chunk_size: int = 1000, max_chunks: int = 4
+) -> AsyncIterator[Sequence[Any]]:
+    """Stream the result of `query`, yielding the column names first, then chunks of rows.
+
+    At most `max_chunks` chunks are buffered, so memory usage does not depend on the size of the result.
+    Closing or cancelling the iteration (e.g. the client went away) cancels the query and releases the connection.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue(maxsize=max_chunks)
+    producer = _QueryProducer(db, query, loop, queue, chunk_size)
+    worker = loop.run_in_executor(None, producer.run)
+    try:
+        while (item := await queue.get()) is not _DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        producer.stop()
+        await asyncio.shield(worker)
+
+
+async def to_csv(chunks: AsyncIterator[Sequence[Any]]) -> AsyncIterator[str]:
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    columns = None
+    async for chunk in chunks:
+        if columns is None:
+            columns = chunk
+            writer.writerow(columns)
+        else:
+            writer.writerows(chunk)
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+async def to_ndjson(chunks: AsyncIterator[Sequence[Any]]) -> AsyncIterator[str]:
+    columns = None
+    async for chunk in chunks:
+        if columns is None:
+            columns = chunk
+            continue
+        yield "".join(
+            json.dumps(dict(zip(columns, row)), default=str) + "\n" for row in chunk
+        )
+
+
+ExportFormat = Literal["csv", "ndjson"]
+
+EXPORT_FORMATS: dict[str, tuple[str, Callable[..., AsyncIterator[str]]]] = {
+    "csv": ("text/csv", to_csv),
+    "ndjson": ("application/x-ndjson", to_ndjson),
+}
+
+
+async def export_query(
+    db: SQLDatabase, query: str, format: ExportFormat = "csv"
+) -> tuple[str, AsyncIterator[str]]:
+    """Returns the media type and the content of the result of `query` in `format`.
+
+    Waits for the column names, so that a query that fails to run raises here rather than midway through the content.
+    """
+    media_type, encode = EXPORT_FORMATS[format]
+    chunks = stream_query(db, query)
+    columns = await anext(chunks)
+    return media_type, encode(_prepend(columns, chunks))
+
+
+async def _prepend(
+    first: Sequence[Any], chunks: AsyncIterator[Sequence[Any]]
+) -> AsyncIterator[Sequence[Any]]:
+    yield first
+    async for chunk in chunks:
+        yield chunk
@@ -0,0 +1,86 @@
+"""LLMs served by text-generation-inference."""
+from typing import Any, Optional
+
+from aiohttp import ClientSession
+from langchain.callbacks.manager import AsyncCallbackManagerForLLMRun
+from langchain.llms.base import BaseLLM
+from langchain.llms.huggingface_text_gen_inference import HuggingFaceTextGenInference
+from pydantic.v1 import root_validator
+
+from sqlbot.callbacks import LatencyCallbackHandler
+from sqlbot.endpoints import EndpointPool, KeepAliveClient
+from sqlbot.scheduler import LLMScheduler
+
+
+class TextGenInference(HuggingFaceTextGenInference):
+    """`HuggingFaceTextGenInference` whose async requests wait for a slot of `scheduler`.
+
+    If `endpoints` is set, async requests are balanced across its endpoints instead of going to `inference_server_url`.
+    Otherwise, if `session` is set, async requests reuse its connections.
+    """
+
+    scheduler: Optional[LLMScheduler] = None
+    endpoints: Optional[EndpointPool] = None
+    session: Optional[ClientSession] = None
+
+    @root_validator()
+    def use_endpoints(cls, values: dict) -> dict:
+        if values.get("endpoints") is not None:
+            values["async_client"] = values["endpoints"]
+        elif values.get("session") is not None:
+            values["async_client"] = KeepAliveClient(
+                values["inference_server_url"],
+                values["session"],
+                timeout=values["timeout"],
+                **values["server_kwargs"],
+            )
+        return values
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        if self.scheduler is None:
+            return await super()._acall(prompt, stop, run_manager, **kwargs)
+        # routed copies are tagged with their route last, see `LLMRouter.get`
+        role = self.tags[-1] if self.tags else "main"
+        async with self.scheduler.slot(role):
+            return await super()._acall(prompt, stop, run_manager, **kwargs)
+
+
+class LLMRouter:
+    """Routes LLM tasks to LLMs by name, measuring the latency of each route.
+
+    The agent itself runs on the `main` LLM. Auxiliary tasks, such as checking queries, can be routed to a
+    smaller and faster model so that they do not compete with the agent for the same GPU slots.
+    """
+
+    def __init__(self, llms: dict[str, BaseLLM], routes: dict[str, str]):
+        self.llms = llms
+        self.routes = routes
+        self._routed: dict[str, BaseLLM] = {}
+        self._latencies: dict[str, LatencyCallbackHandler] = {}
+
+    def get(self, route: str) -> BaseLLM:
+        """Get the LLM serving `route`. Routes without a configured LLM use the `main` one."""
+        if (llm := self._routed.get(route)) is not None:
+            return llm
+        llm = self.llms[self.routes.get(route, "main")]
+        latency = LatencyCallbackHandler(route)
+        # a shallow copy sharing the clients of `llm`, `llm.copy()` would drop the fields excluded from serialization
+        routed = type(llm).construct(
+            **{
+                **llm.__dict__,
+                "callbacks": [*(llm.callbacks or []), latency],
+                "tags": [*(llm.tags or []), route],
+            }
+        )
+        self._latencies[route] = latency
+        self._routed[route] = routed
+        return routed
+
+    def stats(self) -> dict[str, dict[str, float]]:
+        return {route: latency.stats() for route, latency in self._latencies.items()}
@@ -1,73 +1,355 @@
 """Main entrypoint for the app."""
+import asyncio
 import json
+import sys
 import time
 from contextlib import asynccontextmanager
-from typing import Annotated
+from typing import Annotated, Iterable, Optional
 
+import aiohttp
 from aredis_om import Migrator, NotFoundError
 from fastapi import FastAPI, status
 from fastapi.encoders import jsonable_encoder
 from fastapi.requests import Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.staticfiles import StaticFiles
-from langchain.llms.huggingface_text_gen_inference import HuggingFaceTextGenInference
-from langchain.sql_database import SQLDatabase
 from loguru import logger
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from sqlbot.agent.candidates import CandidateSampler
+from sqlbot.agent.examples import ExampleStore
+from sqlbot.agent.plan_cache import PlanCache
 from sqlbot.agent.toolkit import SQLBotToolkit
 from sqlbot.callbacks import TracingLLMCallbackHandler
+from sqlbot.callbacks.spans import wait_for_exports
 from sqlbot.config import settings
+from sqlbot.endpoints import ConnectionStats, EndpointPool, create_session
+from sqlbot.llms import LLMRouter, TextGenInference
+from sqlbot.metrics import (
+    instrument_engine,
+    instrument_redis,
+    register_stats,
+    unregister_stats,
+)
+from sqlbot.profiler import ProfileStore
 from sqlbot.routers import router
-from sqlbot.state import app_state
+from sqlbot.scheduler import LLMScheduler
+from sqlbot.state import WarehouseContext, app_state
+from sqlbot.tools import ColumnStatsProfiler, CostGuard
+from sqlbot.tools.formatter import ResultFormatter
+from sqlbot.tools.schema_cache import SchemaCache
+from sqlbot.tools.summary import ResultSummarizer
+from sqlbot.tracing import FileTraceExporter, OTLPTraceExporter, trace_engine
 from sqlbot.utils import UserIdHeader
+from sqlbot.warehouse import (
+    DEFAULT_WAREHOUSE,
+    ReplicaPool,
+    Warehouse,
+    WarehouseRegistry,
+)
+from sqlbot.watchdog import LoopWatchdog
 
 
-@asynccontextmanager
-async def lifespan(app: FastAPI):
-    logger.info("Initializing app state")
-    start = time.perf_counter()
-    await Migrator().run()
+def load_custom_table_info() -> tuple[Optional[dict], Optional[Iterable[str]]]:
     try:
         with open(settings.custom_table_info, encoding="utf-8") as f:
             custom_table_info: dict = json.load(f)
-            tables = custom_table_info.keys()
+            return custom_table_info, custom_table_info.keys()
     except Exception as e:
         logger.warning(
             f"Cannot open custom table info, default to fetching from database. cause: {e}"
         )
-        custom_table_info = None
-        tables = None
-    app_state.warehouse = SQLDatabase.from_uri(
-        str(settings.warehouse_url),
+        return None, None
+
+
+def create_warehouse_context(warehouse_id: str) -> WarehouseContext:
+    """Connect to a warehouse and build the state bound to it. Blocks while reflecting the schema."""
+    if warehouse_id == DEFAULT_WAREHOUSE:
+        url = settings.warehouse_url
+        custom_table_info, tables = load_custom_table_info()
+        key_suffix = ""
+    else:
+        url = settings.warehouses[warehouse_id]
+        custom_table_info, tables = None, None
+        key_suffix = f"{warehouse_id}:"
+    warehouse = Warehouse.from_uri(
+        str(url),
         custom_table_info=custom_table_info,
         include_tables=tables,
         sample_rows_in_table_info=3,
     )
-    tracing_callback = TracingLLMCallbackHandler()
-    app_state.llm = HuggingFaceTextGenInference(
+    instrument_engine(warehouse._engine, warehouse_id)
+    if app_state.trace_exporter is not None:
+        trace_engine(warehouse._engine)
+    toolkit = SQLBotToolkit(
+        db=warehouse,
+        llm=app_state.llm_router.get("checker"),
+        redis_url=str(settings.redis_om_url),
+        column_stats_key_prefix=f"sqlbot:column_stats:{key_suffix}",
+        table_schema_timeout=settings.table_schema_timeout,
+        schema_cache=SchemaCache(warehouse, ttl=settings.table_schema_cache_ttl),
+        query_max_rows=settings.query_max_rows,
+        query_max_bytes=settings.query_max_bytes,
+        result_formatter=ResultFormatter(
+            float_precision=settings.query_float_precision,
+            date_format=settings.query_date_format,
+            datetime_format=settings.query_datetime_format,
+            max_value_length=settings.query_max_value_length,
+        )
+        if settings.query_result_format == "compact"
+        else None,
+        result_summarizer=ResultSummarizer(max_rows=settings.query_summary_max_rows)
+        if settings.query_summary_max_rows > 0
+        else None,
+        cost_guard=CostGuard(
+            max_cost=settings.query_max_cost,
+            max_rows=settings.query_max_estimated_rows,
+            statement_timeout=settings.query_statement_timeout,
+            redis_url=str(settings.redis_om_url),
+        )
+        if settings.query_max_cost > 0
+        or settings.query_max_estimated_rows > 0
+        or settings.query_statement_timeout > 0
+        else None,
+    )
+    context = WarehouseContext(id=warehouse_id, warehouse=warehouse, toolkit=toolkit)
+    if settings.examples_max_size > 0:
+        context.example_store = ExampleStore(max_size=settings.examples_max_size)
+    if settings.plan_cache != "off":
+        context.plan_cache = PlanCache(
+            db=warehouse,
+            redis_url=str(settings.redis_om_url),
+            key_prefix=f"sqlbot:plans:{key_suffix}",
+            ttl=settings.plan_cache_ttl,
+            validation=settings.plan_cache_validation,
+            strict=settings.plan_cache == "strict",
+        )
+    if settings.query_candidates > 1:
+        context.candidates = CandidateSampler(
+            warehouse,
+            n=settings.query_candidates,
+            temperature=settings.query_candidates_temperature,
+        )
+    return context
+
+
+def register_metrics() -> None:
+    """Expose the stats of the components of the app as metrics."""
+    if app_state.llm_scheduler is not None:
+        register_stats(
+            "llm_scheduler",
+            app_state.llm_scheduler.stats,
+            counters=["requests", "wait_seconds"],
+        )
+    register_stats(
+        "llm_connections",
+        app_state.llm_connections.stats,
+        counters=["created", "reused"],
+    )
+    if app_state.llm_endpoints is not None:
+        register_stats(
+            "llm_endpoints",
+            app_state.llm_endpoints.stats,
+            counters=["hedged", "hedges_won", "failovers"],
+        )
+        register_stats(
+            "llm_endpoint",
+            lambda: app_state.llm_endpoints.stats()["endpoints"],
+            label="endpoint",
+        )
+    register_stats(
+        "llm_route",
+        app_state.llm_router.stats,
+        label="role",
+        counters=["requests", "errors"],
+    )
+    if app_state.watchdog is not None:
+        register_stats("event_loop", app_state.watchdog.stats, counters=["stalls"])
+    register_stats(
+        "schema_cache",
+        lambda: {
+            warehouse_id: context.toolkit.schema_cache.stats()
+            for warehouse_id, context in app_state.warehouses.loaded().items()
+            if context.toolkit.schema_cache is not None
+        },
+        label="warehouse",
+        counters=[
+            "hits",
+            "misses",
+            "prefetched",
+            "prefetch_hits",
+            "prefetch_wasted",
+        ],
+    )
+    register_stats(
+        "query_candidates",
+        lambda: {
+            warehouse_id: context.candidates.stats()
+            for warehouse_id, context in app_state.warehouses.loaded().items()
+            if context.candidates is not None
+        },
+        label="warehouse",
+        counters=[
+            "rounds",
+            "extra_calls",
+            "extra_chars",
+            "invalid",
+            "alternatives_picked",
+        ],
+    )
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    logger.remove()
+    logger.add(sys.stderr, level=settings.log_level)
+    logger.info("Initializing app state")
+    start = time.perf_counter()
+    if settings.loop_stall_threshold > 0:
+        app_state.watchdog = LoopWatchdog(threshold=settings.loop_stall_threshold)
+        app_state.watchdog.start()
+    instrument_redis()
+    trace_session = None
+    if settings.trace_otlp_url is not None:
+        trace_session = aiohttp.ClientSession()
+        app_state.trace_exporter = OTLPTraceExporter(
+            str(settings.trace_otlp_url), trace_session
+        )
+    elif settings.trace_dir is not None:
+        app_state.trace_exporter = FileTraceExporter(settings.trace_dir)
+    if settings.profile_users:
+        app_state.profile_store = ProfileStore(
+            redis_url=str(settings.redis_om_url), ttl=settings.profile_ttl
+        )
+    await Migrator().run()
+    tracing_callback = TracingLLMCallbackHandler(
+        level=settings.log_level, prompt_sample_rate=settings.llm_prompt_sample_rate
+    )
+    if settings.llm_max_concurrency > 0:
+        app_state.llm_scheduler = LLMScheduler(
+            max_concurrency=settings.llm_max_concurrency,
+            redis_url=str(settings.redis_om_url)
+            if settings.llm_global_max_concurrency > 0
+            else None,
+            global_concurrency=settings.llm_global_max_concurrency,
+        )
+    app_state.llm_connections = ConnectionStats()
+    app_state.llm_session = create_session(
+        max_connections=settings.llm_max_connections,
+        keepalive_timeout=settings.llm_keepalive_timeout,
+        stats=app_state.llm_connections,
+    )
+    background_tasks: list[asyncio.Task] = []
+    if settings.isvc_llm_replicas:
+        app_state.llm_endpoints = EndpointPool(
+            [str(url) for url in [settings.isvc_llm, *settings.isvc_llm_replicas]],
+            hedge_after=settings.llm_hedge_after or None,
+            session=app_state.llm_session,
+        )
+        background_tasks.append(
+            asyncio.create_task(
+                app_state.llm_endpoints.run(settings.llm_health_check_interval)
+            )
+        )
+    app_state.llm = TextGenInference(
         inference_server_url=str(settings.isvc_llm),
         max_new_tokens=512,
         temperature=0.1,
         top_p=0.8,
         stop_sequences=["</s>"],
         streaming=True,
-        callbacks=[tracing_callback],
+        callbacks=[tracing_callback] if tracing_callback.enabled else None,
+        scheduler=app_state.llm_scheduler,
+        endpoints=app_state.llm_endpoints,
+        session=app_state.llm_session,
     )
-    app_state.coder_llm = HuggingFaceTextGenInference(
-        inference_server_url=str(settings.isvc_llm),
-        max_new_tokens=512,
-        temperature=0.1,
-        top_p=0.8,
-        stop_sequences=["</s>"],
+    if settings.isvc_coder_llm is not None:
+        app_state.coder_llm = TextGenInference(
+            inference_server_url=str(settings.isvc_coder_llm),
+            max_new_tokens=settings.coder_llm_max_new_tokens,
+            temperature=settings.coder_llm_temperature,
+            top_p=settings.coder_llm_top_p,
+            stop_sequences=["</s>"],
+            session=app_state.llm_session,
+        )
+    else:
+        app_state.coder_llm = TextGenInference(
+            inference_server_url=str(settings.isvc_llm),
+            max_new_tokens=settings.coder_llm_max_new_tokens,
+            temperature=settings.coder_llm_temperature,
+            top_p=settings.coder_llm_top_p,
+            stop_sequences=["</s>"],
+            scheduler=app_state.llm_scheduler,
+            endpoints=app_state.llm_endpoints,
+            session=app_state.llm_session,
+        )
+    app_state.llm_router = LLMRouter(
+        {"main": app_state.llm, "coder": app_state.coder_llm},
+        routes=settings.llm_routes,
     )
-    app_state.toolkit = SQLBotToolkit(
-        db=app_state.warehouse,
-        llm=app_state.coder_llm,
-        redis_url=str(settings.redis_om_url),
+    default = create_warehouse_context(DEFAULT_WAREHOUSE)
+    app_state.warehouse = default.warehouse
+    app_state.toolkit = default.toolkit
+    app_state.example_store = default.example_store
+    app_state.plan_cache = default.plan_cache
+    app_state.warehouses = WarehouseRegistry(
+        create_warehouse_context,
+        on_evict=WarehouseContext.dispose,
+        max_size=settings.warehouse_cache_size,
+        idle_timeout=settings.warehouse_idle_timeout,
+        pinned=[DEFAULT_WAREHOUSE],
     )
+    app_state.warehouses.put(DEFAULT_WAREHOUSE, default)
+    if settings.warehouses:
+        background_tasks.append(
+            asyncio.create_task(
+                app_state.warehouses.run(settings.warehouse_idle_timeout / 10)
+            )
+        )
+    if settings.warehouse_replica_urls:
+        app_state.warehouse.replicas = ReplicaPool(
+            app_state.warehouse._engine,
+            [str(url) for url in settings.warehouse_replica_urls],
+            max_lag=settings.warehouse_replica_max_lag,
+        )
+        for replica in app_state.warehouse.replicas.replicas:
+            instrument_engine(replica.engine, DEFAULT_WAREHOUSE)
+            if app_state.trace_exporter is not None:
+                trace_engine(replica.engine)
+        background_tasks.append(
+            asyncio.create_task(
+                app_state.warehouse.replicas.run(
+                    settings.warehouse_replica_check_interval
+                )
+            )
+        )
+    if settings.column_stats_interval > 0:
+        profiler = ColumnStatsProfiler(
+            db=app_state.warehouse,
+            redis_url=str(settings.redis_om_url),
+            sample_size=settings.column_stats_sample_size,
+            max_values=settings.column_stats_max_values,
+            time_budget=settings.column_stats_time_budget,
+            ttl=2 * settings.column_stats_interval,
+        )
+        background_tasks.append(
+            asyncio.create_task(profiler.run(settings.column_stats_interval))
+        )
+    register_metrics()
     end = time.perf_counter()
     logger.info(f"App initialized in {(end - start):.4}s")
     yield
+    unregister_stats()
+    for task in background_tasks:
+        task.cancel()
+    app_state.warehouses.close()
+    logger.info(f"LLM connections: {app_state.llm_connections.stats()}")
+    await wait_for_exports()
+    await app_state.llm_session.close()
+    if trace_session is not None:
+        await trace_session.close()
+    if app_state.watchdog is not None:
+        app_state.watchdog.stop()
 
 
 app = FastAPI(lifespan=lifespan)
@@ -80,6 +362,11 @@ def healthz():
     return "OK"
 
 
+@app.get("/api/metrics")
+def metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 @app.get("/api/userinfo")
 def userinfo(userid: Annotated[str | None, UserIdHeader()] = None):
     return {"username": userid}
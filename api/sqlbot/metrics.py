@@ -0,0 +1,215 @@
+"""Prometheus metrics."""
+import functools
+import time
+from typing import Any, Callable, Iterable, Iterator, Optional
+
+import redis
+import redis.asyncio
+from prometheus_client import REGISTRY, Counter, Gauge, Histogram
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily, Metric
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LLM_BUCKETS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80)
+
+LLM_TIME_TO_FIRST_TOKEN = Histogram(
+    "sqlbot_llm_time_to_first_token_seconds",
+    "Time to the first token of streamed LLM calls.",
+    ["role"],
+    buckets=LLM_BUCKETS,
+)
+LLM_TOKENS_PER_SECOND = Histogram(
+    "sqlbot_llm_tokens_per_second",
+    "Generation speed of streamed LLM calls, after the first token.",
+    ["role"],
+    buckets=(1, 2.5, 5, 10, 20, 40, 80, 160),
+)
+LLM_DURATION = Histogram(
+    "sqlbot_llm_duration_seconds",
+    "Duration of LLM calls.",
+    ["role"],
+    buckets=LLM_BUCKETS,
+)
+LLM_ERRORS = Counter("sqlbot_llm_errors", "Failed LLM calls.", ["role"])
+LLM_QUEUE_WAIT = Histogram(
+    "sqlbot_llm_queue_wait_seconds",
+    "Time LLM calls waited for a slot of the scheduler.",
+    ["role"],
+    buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+TOOL_DURATION = Histogram(
+    "sqlbot_tool_duration_seconds", "Duration of tool calls.", ["tool"]
+)
+TOOL_ERRORS = Counter("sqlbot_tool_errors", "Failed tool calls.", ["tool"])
+AGENT_ITERATIONS = Histogram(
+    "sqlbot_agent_iterations",
+    "Tool calls of the agent per turn.",
+    buckets=(0, 1, 2, 3, 4, 5, 6, 8, 10, 15),
+)
+WAREHOUSE_QUERY_DURATION = Histogram(
+    "sqlbot_warehouse_query_seconds",
+    "Duration of the statements sent to the warehouses.",
+    ["warehouse"],
+)
+REDIS_COMMAND_DURATION = Histogram(
+    "sqlbot_redis_command_seconds",
+    "Duration of Redis commands, pipelines being one command.",
+    ["command"],
+)
+WEBSOCKET_FRAMES_SENT = Counter(
+    "sqlbot_websocket_frames_sent", "Frames sent to the websockets."
+)
+WEBSOCKETS_ACTIVE = Gauge("sqlbot_websockets_active", "Open websockets.")
+
+
+def instrument_engine(engine: Engine, warehouse: str) -> None:
+    """Observe the duration of the statements run by `engine`."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("sqlbot_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["sqlbot_query_start"].pop()
+        WAREHOUSE_QUERY_DURATION.labels(warehouse).observe(time.perf_counter() - start)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if (starts := context.connection.info.get("sqlbot_query_start")) is not None:
+            starts.clear()
+
+
+def _timed(func: Callable, command: Callable[..., str]) -> Callable:
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command(*args)).observe(
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+def _atimed(func: Callable, command: Callable[..., str]) -> Callable:
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            REDIS_COMMAND_DURATION.labels(command(*args)).observe(
+                time.perf_counter() - start
+            )
+
+    return wrapper
+
+
+def _command_name(client: Any, *args: Any) -> str:
+    return str(args[0]).split(" ")[0].upper() if args else "UNKNOWN"
+
+
+def _pipeline_name(*args: Any) -> str:
+    return "PIPELINE"
+
+
+_redis_instrumented = False
+
+
+def instrument_redis() -> None:
+    """Observe the duration of the commands of all Redis clients, sync and async.
+
+    The clients are created by several libraries (langchain, redis-om), there is no single place to hook into.
+    """
+    global _redis_instrumented
+    if _redis_instrumented:
+        return
+    _redis_instrumented = True
+    redis.Redis.execute_command = _timed(redis.Redis.execute_command, _command_name)
+    redis.client.Pipeline.execute = _timed(
+        redis.client.Pipeline.execute, _pipeline_name
+    )
+    redis.asyncio.Redis.execute_command = _atimed(
+        redis.asyncio.Redis.execute_command, _command_name
+    )
+    redis.asyncio.client.Pipeline.execute = _atimed(
+        redis.asyncio.client.Pipeline.execute, _pipeline_name
+    )
+
+
+class StatsCollector(Collector):
+    """Exposes the `stats()` of a component as metrics, read at scrape time.
+
+    `stats` returns numbers by name, or if `label` is set, such dicts by value of `label`.
+    Numbers named in `counters` only ever grow and are exposed as counters, the others as gauges.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        stats: Callable[[], dict[str, Any]],
+        label: Optional[str] = None,
+        counters: Iterable[str] = (),
+    ):
+        self.name = name
+        self.stats = stats
+        self.label = label
+        self.counters = frozenset(counters)
+
+    def collect(self) -> Iterator[Metric]:
+        stats = self.stats()
+        rows = stats.items() if self.label is not None else [(None, stats)]
+        families: dict[str, Metric] = {}
+        for label_value, row in rows:
+            for key, value in row.items():
+                if not isinstance(value, (int, float)):
+                    continue
+                if (family := families.get(key)) is None:
+                    family_type = (
+                        CounterMetricFamily
+                        if key in self.counters
+                        else GaugeMetricFamily
+                    )
+                    family = family_type(
+                        f"sqlbot_{self.name}_{key}",
+                        f"{key} of {self.name}",
+                        labels=[self.label] if self.label is not None else None,
+                    )
+                    families[key] = family
+                if self.label is not None:
+                    family.add_metric([label_value], float(value))
+                else:
+                    family.add_metric([], float(value))
+        yield from families.values()
+
+
+_stats_collectors: dict[str, StatsCollector] = {}
+
+
+def register_stats(
+    name: str,
+    stats: Callable[[], dict[str, Any]],
+    label: Optional[str] = None,
+    counters: Iterable[str] = (),
+) -> StatsCollector:
+    """Expose `stats` as metrics, replacing the collector registered under `name` if any.
+
+    The app may be started several times in a process (tests, reloads), each time with new components.
+    """
+    if (previous := _stats_collectors.pop(name, None)) is not None:
+        REGISTRY.unregister(previous)
+    collector = StatsCollector(name, stats, label, counters)
+    REGISTRY.register(collector)
+    _stats_collectors[name] = collector
+    return collector
+
+
+def unregister_stats() -> None:
+    """Stop exposing the stats registered by `register_stats`."""
+    while _stats_collectors:
+        _, collector = _stats_collectors.popitem()
+        REGISTRY.unregister(collector)
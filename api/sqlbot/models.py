@@ -1,4 +1,5 @@
 from datetime import datetime
+from typing import Optional
 
 from aredis_om import Field, JsonModel
 
@@ -8,5 +9,6 @@ from sqlbot.utils import utcnow
 class Conversation(JsonModel):
     title: str
     owner: str = Field(index=True)
+    warehouse: Optional[str] = None
     created_at: datetime = Field(default_factory=utcnow)
     updated_at: datetime = created_at
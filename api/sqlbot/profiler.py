@@ -0,0 +1,207 @@
+"""Sampling profiler of single agent runs, writing speedscope profiles."""
+import asyncio
+import json
+import sys
+import threading
+import time
+from types import FrameType
+from typing import Any, Optional
+
+from sqlbot.watchdog import label_tasks, task_labels
+
+SPEEDSCOPE_SCHEMA = "https://www.speedscope.app/file-format-schema.json"
+
+
+class RunProfiler:
+    """Samples the stacks of one agent run every `interval` seconds, from a thread.
+
+    The run is identified by its labels (see `watchdog.set_labels`), shared by all the tasks it creates. When one
+    of them runs on the loop, the stack of the loop thread is sampled under `[running]`. Otherwise the await
+    chains of its tasks are, under `[waiting]`, showing what the run waits for: LLM tokens, tools in worker
+    threads, Redis... Samples are weighted by the time elapsed since the previous one, the profile shows
+    wall-clock time. Runs not profiled cost nothing.
+    """
+
+    def __init__(
+        self,
+        labels: dict[str, str],
+        interval: float = 0.005,
+        max_samples: int = 100_000,
+    ):
+        self.labels = labels
+        self.interval = interval
+        self.max_samples = max_samples
+        self.frames: list[dict[str, Any]] = []
+        """Speedscope frames, samples refer to them by index."""
+        self.samples: list[list[int]] = []
+        """Stacks, from the root to the leaf."""
+        self.weights: list[float] = []
+        self._frame_ids: dict[tuple[str, str, int], int] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Profile the run of the current task, on the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        label_tasks(self._loop)
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._sample_loop, name="run-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _sample_loop(self) -> None:
+        last = time.perf_counter()
+        while not self._stopped.wait(self.interval):
+            now = time.perf_counter()
+            if len(self.samples) < self.max_samples:
+                self._sample(now - last)
+            last = now
+
+    def _sample(self, weight: float) -> None:
+        task = asyncio.current_task(self._loop)
+        if task is not None and task_labels(task) is self.labels:
+            frame = sys._current_frames().get(self._loop_thread)
+            if frame is not None:
+                self._record("[running]", _stack(frame), weight)
+            return
+        tasks = [
+            task
+            for task in asyncio.all_tasks(self._loop)
+            if task_labels(task) is self.labels
+        ]
+        awaited: set[asyncio.Task] = set()
+        chains = {task: _await_chain(task, awaited) for task in tasks}
+        # the chains of tasks awaited by others are part of those
+        chains = [
+            chain for task, chain in chains.items() if chain and task not in awaited
+        ]
+        # concurrent tasks of the run share the elapsed time
+        for chain in chains:
+            self._record("[waiting]", chain, weight / len(chains))
+
+    def _record(self, root: str, stack: list[FrameType], weight: float) -> None:
+        sample = [self._frame_id(root, "", 0)]
+        sample.extend(
+            self._frame_id(
+                frame.f_code.co_name,
+                frame.f_code.co_filename,
+                frame.f_code.co_firstlineno,
+            )
+            for frame in stack
+        )
+        self.samples.append(sample)
+        self.weights.append(weight)
+
+    def _frame_id(self, name: str, file: str, line: int) -> int:
+        key = (name, file, line)
+        if (frame_id := self._frame_ids.get(key)) is None:
+            frame_id = len(self.frames)
+            self._frame_ids[key] = frame_id
+            self.frames.append(
+                {"name": name, "file": file, "line": line} if file else {"name": name}
+            )
+        return frame_id
+
+    def to_speedscope(self, name: str) -> dict[str, Any]:
+        return {
+            "$schema": SPEEDSCOPE_SCHEMA,
+            "name": name,
+            "exporter": "sqlbot",
+            "shared": {"frames": self.frames},
+            "profiles": [
+                {
+                    "type": "sampled",
+                    "name": name,
+                    "unit": "seconds",
+                    "startValue": 0,
+                    "endValue": sum(self.weights),
+                    "samples": self.samples,
+                    "weights": self.weights,
+                }
+            ],
+        }
+
+
+def _stack(frame: Optional[FrameType]) -> list[FrameType]:
+    """The frames of a thread, from the root to `frame`."""
+    stack = []
+    while frame is not None:
+        stack.append(frame)
+        frame = frame.f_back
+    stack.reverse()
+    return stack
+
+
+def _await_chain(task: asyncio.Task, awaited: set[asyncio.Task]) -> list[FrameType]:
+    """The frames of a suspended task and of what it awaits, from the outermost.
+
+    Tasks awaited along the way are followed and added to `awaited`.
+    """
+    chain = []
+    while task is not None:
+        coro = task.get_coro()
+        while coro is not None:
+            frame = getattr(coro, "cr_frame", None) or getattr(coro, "ag_frame", None)
+            frame = frame or getattr(coro, "gi_frame", None)
+            if frame is None:
+                break
+            chain.append(frame)
+            coro = (
+                getattr(coro, "cr_await", None)
+                or getattr(coro, "ag_await", None)
+                or getattr(coro, "gi_yieldfrom", None)
+            )
+        # the future the task is suspended on, as used by `Task.cancel`
+        task = getattr(task, "_fut_waiter", None)
+        if not isinstance(task, asyncio.Task) or task in awaited:
+            break
+        awaited.add(task)
+    return chain
+
+
+class ProfileStore:
+    """Stores profiles in Redis for `ttl` seconds, along with an index of the latest `keep` ones."""
+
+    def __init__(
+        self,
+        redis_url: str = "redis://localhost:6379",
+        key_prefix: str = "sqlbot:profiles:",
+        ttl: int = 24 * 3600,
+        keep: int = 100,
+    ):
+        from redis import Redis
+
+        self.client = Redis.from_url(redis_url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self.index_key = f"{key_prefix}index"
+        self.ttl = ttl
+        self.keep = keep
+
+    def save(self, profile_id: str, profile: dict[str, Any]) -> None:
+        with self.client.pipeline() as pipe:
+            pipe.set(f"{self.key_prefix}{profile_id}", json.dumps(profile), ex=self.ttl)
+            pipe.zadd(self.index_key, {profile_id: time.time()})
+            pipe.zremrangebyrank(self.index_key, 0, -self.keep - 1)
+            pipe.zremrangebyscore(self.index_key, "-inf", time.time() - self.ttl)
+            pipe.execute()
+
+    def get(self, profile_id: str) -> Optional[str]:
+        """The speedscope JSON of the profile, or None if it expired."""
+        return self.client.get(f"{self.key_prefix}{profile_id}")
+
+    def latest(self) -> list[dict[str, Any]]:
+        """The latest profiles, newest first."""
+        entries = self.client.zrevrange(self.index_key, 0, -1, withscores=True)
+        return [
+            {"id": profile_id, "created_at": created_at}
+            for profile_id, created_at in entries
+        ]
@@ -1,31 +1,51 @@
+import asyncio
 from datetime import date
-from typing import Annotated
+from functools import partial
+from typing import Annotated, Optional
+from uuid import UUID
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from fastapi.responses import Response, StreamingResponse
 from langchain.memory import ConversationBufferWindowMemory, RedisChatMessageHistory
 from langchain.schema import HumanMessage
 from loguru import logger
+from pydantic import ValidationError
+from sqlalchemy.exc import OperationalError, SQLAlchemyError
 
 from sqlbot.agent import create_sql_agent
+from sqlbot.agent.prefetch import prefetch_schema
 from sqlbot.callbacks import (
     LCErrorCallbackHandler,
+    MetricsCallbackHandler,
+    RunLabelCallbackHandler,
+    SpanCallbackHandler,
     StreamingFinalAnswerCallbackHandler,
     StreamingIntermediateThoughtCallbackHandler,
     UpdateConversationCallbackHandler,
     WebsocketHumanApprovalCallbackHandler,
 )
 from sqlbot.config import settings
+from sqlbot.exports import ExportFormat, export_query
 from sqlbot.history import CustomRedisChatMessageHistory
+from sqlbot.metrics import WEBSOCKETS_ACTIVE
 from sqlbot.models import Conversation as ORMConversation
+from sqlbot.profiler import RunProfiler
 from sqlbot.prompts import AI_PREFIX, HUMAN_PREFIX
+from sqlbot.scheduler import current_user, queue_listener
 from sqlbot.schemas import (
     ChatMessage,
     Conversation,
     ConversationDetail,
+    CreateConversation,
+    IntermediateSteps,
     UpdateConversation,
 )
-from sqlbot.state import app_state
+from sqlbot.state import WarehouseContext, app_state
+from sqlbot.tracing import Trace, current_trace
 from sqlbot.utils import UserIdHeader, utcnow
+from sqlbot.warehouse import DEFAULT_WAREHOUSE
+from sqlbot.watchdog import set_labels
+from sqlbot.websocket import WebsocketWriter
 
 router = APIRouter(
     prefix="/api",
@@ -33,6 +53,12 @@ router = APIRouter(
 )
 
 
+async def get_warehouse(conversation_id: str) -> WarehouseContext:
+    """Get the warehouse the conversation is about."""
+    conv = await ORMConversation.get(conversation_id)
+    return await app_state.warehouses.get(conv.warehouse or DEFAULT_WAREHOUSE)
+
+
 @router.get("/conversations")
 async def get_conversations(
     userid: Annotated[str | None, UserIdHeader()] = None
@@ -66,11 +92,68 @@ async def get_conversation(
     )
 
 
+@router.get(
+    "/conversations/{conversation_id}/messages/{message_id}/steps/{step}/result"
+)
+async def download_step_result(
+    conversation_id: str,
+    message_id: UUID,
+    step: int,
+    format: ExportFormat = "csv",
+    userid: Annotated[str | None, UserIdHeader()] = None,
+) -> StreamingResponse:
+    """Re-run the query of an intermediate step and stream the full result.
+
+    The observation the LLM sees is truncated, this is the way to get all rows without another LLM round trip.
+    """
+    history = RedisChatMessageHistory(
+        url=str(settings.redis_om_url),
+        session_id=f"{userid}:{conversation_id}",
+    )
+    messages = await asyncio.to_thread(lambda: history.messages)
+    message = next(
+        (
+            message
+            for message in messages
+            if message.additional_kwargs.get("id") in (message_id.hex, str(message_id))
+        ),
+        None,
+    )
+    if message is None:
+        raise HTTPException(status_code=404, detail="Message not found")
+    steps_str = message.additional_kwargs.get("intermediate_steps")
+    steps = IntermediateSteps.model_validate_json(steps_str) if steps_str else []
+    if not 0 <= step < len(steps):
+        raise HTTPException(status_code=404, detail="Step not found")
+    action, _ = steps[step]
+    if action.get("tool") != "query_executor":
+        raise HTTPException(status_code=400, detail="Step did not execute a query")
+    warehouse = await get_warehouse(conversation_id)
+    try:
+        media_type, content = await export_query(
+            warehouse.warehouse, action["tool_input"], format
+        )
+    except OperationalError as e:
+        raise HTTPException(status_code=503, detail=f"Warehouse unavailable: {e}")
+    except SQLAlchemyError as e:
+        raise HTTPException(status_code=400, detail=f"Query failed: {e}")
+    filename = f"{message_id}-{step}.{format}"
+    return StreamingResponse(
+        content,
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.post("/conversations", status_code=201)
 async def create_conversation(
-    userid: Annotated[str | None, UserIdHeader()] = None
+    payload: CreateConversation | None = None,
+    userid: Annotated[str | None, UserIdHeader()] = None,
 ) -> ConversationDetail:
-    conv = ORMConversation(title=f"New chat", owner=userid)
+    warehouse = payload.warehouse if payload is not None else None
+    if warehouse is not None and warehouse not in settings.warehouses:
+        raise HTTPException(status_code=400, detail="Unknown warehouse")
+    conv = ORMConversation(title=f"New chat", owner=userid, warehouse=warehouse)
     await conv.save()
     return ConversationDetail(**conv.dict())
 
@@ -94,76 +177,242 @@ async def delete_conversation(
     await ORMConversation.delete(conversation_id)
 
 
+def _require_profiling(userid: Optional[str]) -> None:
+    if not _may_profile(userid):
+        raise HTTPException(status_code=403, detail="Profiling not allowed")
+
+
+def _may_profile(userid: Optional[str]) -> bool:
+    return app_state.profile_store is not None and userid in settings.profile_users
+
+
+@router.get("/profiles", tags=["profiling"])
+async def get_profiles(
+    userid: Annotated[str | None, UserIdHeader()] = None
+) -> list[dict]:
+    """The latest profiles of agent runs, newest first."""
+    _require_profiling(userid)
+    return await asyncio.to_thread(app_state.profile_store.latest)
+
+
+@router.get("/profiles/{profile_id}", tags=["profiling"])
+async def get_profile(
+    profile_id: str, userid: Annotated[str | None, UserIdHeader()] = None
+) -> Response:
+    """The profile of an agent run, to open in https://www.speedscope.app."""
+    _require_profiling(userid)
+    content = await asyncio.to_thread(app_state.profile_store.get, profile_id)
+    if content is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    filename = f"{profile_id}.speedscope.json"
+    return Response(
+        content,
+        media_type="application/json",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
 @router.websocket("/chat")
 async def generate(
     websocket: WebSocket,
     userid: Annotated[str | None, UserIdHeader()] = None,
 ):
+    """Receives messages while agents run, one run per conversation.
+
+    Runs of different conversations are concurrent, up to `chat_max_concurrent_runs`. A run is cancelled when the
+    client disconnects, sends a `cancel` message, or sends a new message to the same conversation.
+    Runs are profiled if the client sends `profile_header` and the user is one of `profile_users`.
+    """
     await websocket.accept()
-    while True:
-        try:
+    profile = bool(websocket.headers.get(settings.profile_header)) and _may_profile(
+        userid
+    )
+    WEBSOCKETS_ACTIVE.inc()
+    writer = WebsocketWriter(websocket)
+    writer.start()
+    # the run of each conversation, running or waiting for its turn
+    runs: dict[str, asyncio.Task] = {}
+    slots = asyncio.Semaphore(settings.chat_max_concurrent_runs)
+
+    async def _run(message: ChatMessage, previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # let the cancelled run of the conversation unwind before touching its history
+            await asyncio.wait([previous])
+        async with slots:
+            await run_agent(writer, userid, message, profile=profile)
+
+    def _forget(conversation_id: str, run: asyncio.Task) -> None:
+        if runs.get(conversation_id) is run:
+            del runs[conversation_id]
+
+    try:
+        while True:
             payload: str = await websocket.receive_text()
-            message = ChatMessage.model_validate_json(payload)
+            try:
+                message = ChatMessage.model_validate_json(payload)
+            except ValidationError as e:
+                logger.error(f"Invalid message, err: {e}")
+                continue
+            if (previous := runs.get(message.conversation)) is not None:
+                logger.info(f"Cancelling run of conversation {message.conversation}")
+                previous.cancel()
+            if message.type == "cancel":
+                continue
+            run = asyncio.create_task(_run(message, previous))
+            runs[message.conversation] = run
+            run.add_done_callback(partial(_forget, message.conversation))
+    except WebSocketDisconnect:
+        logger.info("websocket disconnected")
+    finally:
+        for run in runs.values():
+            run.cancel()
+        await writer.close()
+        WEBSOCKETS_ACTIVE.dec()
 
-            streaming_thought_callback = StreamingIntermediateThoughtCallbackHandler(
-                websocket, message.conversation
-            )
-            streaming_answer_callback = StreamingFinalAnswerCallbackHandler(
-                websocket, message.conversation
-            )
-            update_conversation_callback = UpdateConversationCallbackHandler(
-                message.conversation
-            )
-            error_callback = LCErrorCallbackHandler(websocket, message.conversation)
 
-            def _require_approve(serialized_obj: dict) -> bool:
-                # Only require approval on sql_db_query.
-                return serialized_obj.get("name") == "sql_db_query"
+async def _send_queue_position(
+    websocket: WebsocketWriter, conversation_id: str, position: int
+) -> None:
+    message = ChatMessage(
+        conversation=conversation_id,
+        from_="ai",
+        content=str(position),
+        type="info/queue",
+    )
+    await websocket.send_text(message.model_dump_json())
+
 
-            human_approval_callback = WebsocketHumanApprovalCallbackHandler(
-                websocket, message.conversation, should_check=_require_approve
+async def run_agent(
+    websocket: WebsocketWriter,
+    userid: Optional[str],
+    message: ChatMessage,
+    profile: bool = False,
+) -> None:
+    profiler = None
+    try:
+        # queue LLM requests under this user, and tell them while they wait
+        current_user.set(userid)
+        queue_listener.set(
+            partial(_send_queue_position, websocket, message.conversation)
+        )
+        # name the run in reports of blocking calls
+        labels = set_labels(conversation=message.conversation, message=str(message.id))
+        if profile:
+            profiler = RunProfiler(labels, interval=settings.profile_interval)
+            profiler.start()
+        warehouse = await get_warehouse(message.conversation)
+        # warm the schema cache while the first LLM call streams
+        prefetch_task = None
+        if (
+            settings.schema_prefetch_max_tables > 0
+            and warehouse.toolkit.schema_cache is not None
+        ):
+            prefetch_task = asyncio.create_task(
+                prefetch_schema(
+                    warehouse.toolkit.schema_cache,
+                    message.content,
+                    settings.schema_prefetch_max_tables,
+                )
             )
 
-            history = CustomRedisChatMessageHistory(
-                url=str(settings.redis_om_url),
-                session_id=f"{userid}:{message.conversation}",
-            )
-            memory = ConversationBufferWindowMemory(
-                human_prefix=HUMAN_PREFIX,
-                ai_prefix=AI_PREFIX,
-                memory_key="history",
-                chat_memory=history,
-                return_messages=True,
-                input_key="input",
-                output_key="output",
-            )
+        streaming_thought_callback = StreamingIntermediateThoughtCallbackHandler(
+            websocket, message.conversation
+        )
+        streaming_answer_callback = StreamingFinalAnswerCallbackHandler(
+            websocket, message.conversation
+        )
+        update_conversation_callback = UpdateConversationCallbackHandler(
+            message.conversation
+        )
+        error_callback = LCErrorCallbackHandler(websocket, message.conversation)
 
-            agent_executor = create_sql_agent(
-                llm=app_state.llm,
-                toolkit=app_state.toolkit,
-                agent_executor_kwargs={
-                    "memory": memory,
-                    "return_intermediate_steps": True,
-                },
-            )
+        def _require_approve(serialized_obj: dict) -> bool:
+            # Only require approval on sql_db_query.
+            return serialized_obj.get("name") == "sql_db_query"
+
+        human_approval_callback = WebsocketHumanApprovalCallbackHandler(
+            websocket, message.conversation, should_check=_require_approve
+        )
 
-            await agent_executor.acall(
-                inputs={
-                    "date": date.today(),
-                    "input": message.content,
-                    "top_k": 10,
-                    "dialect": app_state.warehouse.dialect,
-                },
-                callbacks=[
-                    streaming_thought_callback,
-                    streaming_answer_callback,
-                    update_conversation_callback,
-                    error_callback,
-                    human_approval_callback,
-                ],
+        history = CustomRedisChatMessageHistory(
+            url=str(settings.redis_om_url),
+            session_id=f"{userid}:{message.conversation}",
+        )
+        memory = ConversationBufferWindowMemory(
+            human_prefix=HUMAN_PREFIX,
+            ai_prefix=AI_PREFIX,
+            memory_key="history",
+            chat_memory=history,
+            return_messages=True,
+            input_key="input",
+            output_key="output",
+        )
+
+        agent_executor = create_sql_agent(
+            llm=app_state.llm_router.get("agent"),
+            toolkit=warehouse.toolkit,
+            early_stopping_method=settings.agent_early_stopping_method,
+            agent_executor_kwargs={
+                "memory": memory,
+                "return_intermediate_steps": True,
+                "example_store": warehouse.example_store,
+                "num_examples": settings.examples_top_k,
+                "plan_cache": warehouse.plan_cache,
+            },
+            candidates=warehouse.candidates,
+        )
+
+        callbacks = [
+            streaming_thought_callback,
+            streaming_answer_callback,
+            update_conversation_callback,
+            error_callback,
+            human_approval_callback,
+            RunLabelCallbackHandler(),
+            MetricsCallbackHandler(),
+        ]
+        if app_state.trace_exporter is not None:
+            trace = Trace({"conversation": message.conversation})
+            # SQL statements of the tools are traced from worker threads
+            current_trace.set(trace)
+            callbacks.append(SpanCallbackHandler(trace, app_state.trace_exporter))
+
+        await agent_executor.acall(
+            inputs={
+                "date": date.today(),
+                "input": message.content,
+                "top_k": 10,
+                "dialect": warehouse.warehouse.dialect,
+            },
+            callbacks=callbacks,
+        )
+        if prefetch_task is not None:
+            logger.debug(
+                f"Schema cache stats: {warehouse.toolkit.schema_cache.stats()}"
             )
-        except WebSocketDisconnect:
-            logger.info("websocket disconnected")
-            return
-        except Exception as e:
-            logger.error(f"Something goes wrong, err: {e}")
+        if warehouse.candidates is not None:
+            logger.debug(f"Query candidates stats: {warehouse.candidates.stats()}")
+    except asyncio.CancelledError:
+        logger.info(f"Run of conversation {message.conversation} cancelled")
+        raise
+    except Exception as e:
+        logger.error(f"Something goes wrong, err: {e}")
+    finally:
+        if profiler is not None:
+            await _save_profile(profiler, userid, message)
+
+
+async def _save_profile(
+    profiler: RunProfiler, userid: Optional[str], message: ChatMessage
+) -> None:
+    profiler.stop()
+    profile_id = str(message.id)
+    name = f"{userid} {message.conversation} {profile_id}"
+    try:
+        await asyncio.to_thread(
+            app_state.profile_store.save, profile_id, profiler.to_speedscope(name)
+        )
+    except Exception as e:
+        logger.error(f"Cannot save profile {profile_id}, err: {e}")
+        return
+    logger.info(f"Saved profile {profile_id} of conversation {message.conversation}")
@@ -0,0 +1,221 @@
+"""Admission control in front of the LLM servers."""
+import asyncio
+import time
+import uuid
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import AsyncIterator, Awaitable, Callable, Optional
+
+from loguru import logger
+
+from sqlbot.metrics import LLM_QUEUE_WAIT
+
+current_user: ContextVar[Optional[str]] = ContextVar("current_user", default=None)
+"""The user on behalf of whom LLM requests are made."""
+queue_listener: ContextVar[Optional[Callable[[int], Awaitable[None]]]] = ContextVar(
+    "queue_listener", default=None
+)
+"""Called with the position in the queue of LLM requests waiting for a slot, 0 being the next one."""
+
+# take a lease on a global slot if there are less than ARGV[2] unexpired leases
+ACQUIRE_LEASE = """
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[2]) then
+    redis.call('ZADD', KEYS[1], ARGV[3], ARGV[4])
+    return 1
+end
+return 0
+"""
+
+
+class _Waiter:
+    def __init__(self, user: str):
+        self.user = user
+        self.granted: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.changed = asyncio.Event()
+        self.listener = queue_listener.get()
+
+
+class LLMScheduler:
+    """Limits the number of concurrent LLM requests, queuing the others fairly between users.
+
+    At most `max_concurrency` requests of this process run at the same time. Waiting requests are queued per user,
+    and users are served in turn (round robin), so that a user sending many requests cannot starve the others.
+    While waiting, the `queue_listener` of the request is notified of its position in the queue.
+
+    If `redis_url` is set, requests additionally take a lease on one of `global_concurrency` slots shared by all
+    processes. Leases expire after `lease_ttl` seconds, so that a crashed process does not hold its slots forever.
+    """
+
+    def __init__(
+        self,
+        max_concurrency: int = 8,
+        redis_url: Optional[str] = None,
+        global_concurrency: Optional[int] = None,
+        key: str = "sqlbot:llm_slots",
+        lease_ttl: float = 300,
+        poll_interval: float = 0.1,
+    ):
+        self.max_concurrency = max_concurrency
+        self.running = 0
+        self._queues: OrderedDict[str, deque[_Waiter]] = OrderedDict()
+        self.client = None
+        if redis_url is not None:
+            from redis import Redis
+
+            self.client = Redis.from_url(redis_url, decode_responses=True)
+            self._acquire_lease = self.client.register_script(ACQUIRE_LEASE)
+        self.global_concurrency = global_concurrency or max_concurrency
+        self.key = key
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.requests = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, role: str = "main") -> AsyncIterator[None]:
+        """Wait for a slot, held until exiting the context.
+
+        The wait is observed in the queue wait histogram, under `role`: the route of the LLM task.
+        """
+        start = time.perf_counter()
+        await self._acquire()
+        try:
+            lease = await self._acquire_global()
+        except BaseException:
+            self._release()
+            raise
+        self._record_wait(time.perf_counter() - start, role)
+        try:
+            yield
+        finally:
+            self._release()
+            if lease is not None:
+                await self._release_global(lease)
+
+    def _record_wait(self, seconds: float, role: str) -> None:
+        LLM_QUEUE_WAIT.labels(role).observe(seconds)
+        self.requests += 1
+        self.wait_seconds += seconds
+        self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+        logger.debug(f"LLM request waited {seconds:.3f}s for a slot")
+
+    def stats(self) -> dict[str, float]:
+        return {
+            "running": self.running,
+            "waiting": self.waiting,
+            "requests": self.requests,
+            "wait_seconds": self.wait_seconds,
+            "max_wait_seconds": self.max_wait_seconds,
+        }
+
+    async def _acquire(self) -> None:
+        if self.running < self.max_concurrency and not self._queues:
+            self.running += 1
+            return
+        waiter = _Waiter(current_user.get() or "")
+        self._queues.setdefault(waiter.user, deque()).append(waiter)
+        self._notify_all()
+        try:
+            await self._wait(waiter)
+        except BaseException:
+            if waiter.granted.done() and not waiter.granted.cancelled():
+                # granted while being cancelled, pass the slot on
+                self._release()
+            else:
+                waiter.granted.cancel()
+                self._remove(waiter)
+            raise
+
+    async def _wait(self, waiter: _Waiter) -> None:
+        notified = None
+        while not waiter.granted.done():
+            position = self._position(waiter)
+            if waiter.listener is not None and position != notified:
+                notified = position
+                try:
+                    await waiter.listener(position)
+                except Exception as e:
+                    logger.warning(f"Failed to notify queue position: {e}")
+                continue
+            waiter.changed.clear()
+            changed = asyncio.ensure_future(waiter.changed.wait())
+            try:
+                await asyncio.wait(
+                    [waiter.granted, changed], return_when=asyncio.FIRST_COMPLETED
+                )
+            finally:
+                changed.cancel()
+
+    def _position(self, waiter: _Waiter) -> int:
+        """Position of `waiter` in the round robin order."""
+        queues = list(self._queues.values())
+        position = 0
+        for round_ in range(max((len(q) for q in queues), default=0)):
+            for queue in queues:
+                if round_ < len(queue):
+                    if queue[round_] is waiter:
+                        return position
+                    position += 1
+        return position
+
+    def _remove(self, waiter: _Waiter) -> None:
+        queue = self._queues.get(waiter.user)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        if not queue:
+            del self._queues[waiter.user]
+        self._notify_all()
+
+    def _release(self) -> None:
+        self.running -= 1
+        while self._queues and self.running < self.max_concurrency:
+            # serve the user first in turn, then move them to the back
+            user, queue = next(iter(self._queues.items()))
+            waiter = queue.popleft()
+            self._queues.pop(user)
+            if queue:
+                self._queues[user] = queue
+            if waiter.granted.done():
+                continue
+            waiter.granted.set_result(None)
+            self.running += 1
+        self._notify_all()
+
+    def _notify_all(self) -> None:
+        for queue in self._queues.values():
+            for waiter in queue:
+                waiter.changed.set()
+
+    async def _acquire_global(self) -> Optional[str]:
+        if self.client is None:
+            return None
+        lease = uuid.uuid4().hex
+        while True:
+            now = time.time()
+            try:
+                acquired = await asyncio.to_thread(
+                    self._acquire_lease,
+                    keys=[self.key],
+                    args=[now, self.global_concurrency, now + self.lease_ttl, lease],
+                )
+            except Exception as e:
+                # do not fail LLM requests because of the coordination
+                logger.warning(f"Failed to acquire LLM slot lease: {e}")
+                return None
+            if acquired:
+                return lease
+            await asyncio.sleep(self.poll_interval)
+
+    async def _release_global(self, lease: str) -> None:
+        try:
+            await asyncio.to_thread(self.client.zrem, self.key, lease)
+        except Exception as e:
+            logger.warning(f"Failed to release LLM slot lease: {e}")
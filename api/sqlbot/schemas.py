@@ -61,6 +61,16 @@ class IntermediateSteps(RootModel):
     def __getitem__(self, item):
         return self.root[item]
 
+    def last_query(self, tool_name: str = "query_executor") -> Optional[str]:
+        """Get the last query that was successfully executed by `tool_name`."""
+        for action, observation in reversed(self.root):
+            if action.get("tool") != tool_name:
+                continue
+            if isinstance(observation, str) and observation.startswith("Error:"):
+                continue
+            return action.get("tool_input")
+        return None
+
 
 class ChatMessage(BaseModel):
     model_config = ConfigDict(populate_by_name=True, arbitrary_types_allowed=True)
@@ -112,6 +122,8 @@ class Conversation(BaseModel):
     id: Optional[str] = None
     title: str
     owner: str
+    warehouse: Optional[str] = None
+    """Id of the warehouse the conversation is about, None for the default one."""
     created_at: datetime = Field(default_factory=utcnow)
     updated_at: datetime = created_at
 
@@ -129,5 +141,9 @@ class ConversationDetail(Conversation):
     messages: list[ChatMessage] = []
 
 
+class CreateConversation(BaseModel):
+    warehouse: Optional[str] = None
+
+
 class UpdateConversation(BaseModel):
     title: str
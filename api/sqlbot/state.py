@@ -1,10 +1,44 @@
-from typing import Optional
+from typing import Optional, Union
 
+from aiohttp import ClientSession
 from langchain.agents.agent_toolkits.base import BaseToolkit
 from langchain.llms.base import LLM
 from langchain.sql_database import SQLDatabase
 from pydantic import BaseModel, ConfigDict
 
+from sqlbot.agent.candidates import CandidateSampler
+from sqlbot.agent.examples import ExampleStore
+from sqlbot.agent.plan_cache import PlanCache
+from sqlbot.endpoints import ConnectionStats, EndpointPool
+from sqlbot.llms import LLMRouter
+from sqlbot.profiler import ProfileStore
+from sqlbot.scheduler import LLMScheduler
+from sqlbot.tracing import FileTraceExporter, OTLPTraceExporter
+from sqlbot.warehouse import Warehouse, WarehouseRegistry
+from sqlbot.watchdog import LoopWatchdog
+
+
+class WarehouseContext(BaseModel):
+    """Stores the state bound to one warehouse."""
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    id: str
+    warehouse: SQLDatabase
+    toolkit: BaseToolkit
+    example_store: Optional[ExampleStore] = None
+    plan_cache: Optional[PlanCache] = None
+    candidates: Optional[CandidateSampler] = None
+
+    def dispose(self) -> None:
+        """Close the connection pools."""
+        self.warehouse._engine.dispose()
+        if (
+            isinstance(self.warehouse, Warehouse)
+            and self.warehouse.replicas is not None
+        ):
+            self.warehouse.replicas.dispose()
+
 
 class AppState(BaseModel):
     """Stores global state for the app.
@@ -17,7 +51,20 @@ class AppState(BaseModel):
     warehouse: Optional[SQLDatabase] = None
     llm: Optional[LLM] = None
     coder_llm: Optional[LLM] = None
+    llm_scheduler: Optional[LLMScheduler] = None
+    llm_session: Optional[ClientSession] = None
+    """Keeps the connections to the LLM endpoints alive, shared by all LLMs."""
+    llm_connections: Optional[ConnectionStats] = None
+    llm_endpoints: Optional[EndpointPool] = None
+    llm_router: Optional[LLMRouter] = None
     toolkit: Optional[BaseToolkit] = None
+    example_store: Optional[ExampleStore] = None
+    plan_cache: Optional[PlanCache] = None
+    watchdog: Optional[LoopWatchdog] = None
+    profile_store: Optional[ProfileStore] = None
+    trace_exporter: Optional[Union[FileTraceExporter, OTLPTraceExporter]] = None
+    warehouses: Optional[WarehouseRegistry[WarehouseContext]] = None
+    """Warehouses conversations can select, the fields above are those of the default warehouse."""
 
 
 app_state = AppState()
@@ -1,4 +1,15 @@
+from sqlbot.tools.column_stats import ColumnStatsProfiler
+from sqlbot.tools.cost_guard import CostGuard
 from sqlbot.tools.list_tables import ListTableTool
 from sqlbot.tools.query_checker import QUERY_CHECKER_PROMPT
+from sqlbot.tools.query_executor import QueryExecutorTool
+from sqlbot.tools.table_schema import TableSchemaTool
 
-__all__ = ["ListTableTool", "QUERY_CHECKER_PROMPT"]
+__all__ = [
+    "ColumnStatsProfiler",
+    "CostGuard",
+    "ListTableTool",
+    "QueryExecutorTool",
+    "QUERY_CHECKER_PROMPT",
+    "TableSchemaTool",
+]
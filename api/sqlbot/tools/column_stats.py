@@ -0,0 +1,174 @@
+"""Column value statistics, precomputed so that the agent does not need to explore enum values itself."""
+import asyncio
+import json
+import time
+from datetime import date, datetime
+from datetime import time as dt_time
+from decimal import Decimal
+from typing import Any, Optional
+
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+from sqlalchemy import Column, Table, distinct, func, select, text
+
+from sqlbot.utils import utcnow
+from sqlbot.warehouse import connect_read
+
+ORDERABLE_TYPES = (int, float, Decimal, date, datetime, dt_time)
+ENUMERABLE_TYPES = (str, int, bool)
+
+
+def _python_type(column: Column) -> Optional[type]:
+    try:
+        return column.type.python_type
+    except NotImplementedError:
+        return None
+
+
+def _orderable(column: Column) -> bool:
+    python_type = _python_type(column)
+    # bool is a subclass of int, but postgres does not support `min(bool)`
+    return python_type is not bool and python_type in ORDERABLE_TYPES
+
+
+def _enumerable(column: Column) -> bool:
+    return _python_type(column) in ENUMERABLE_TYPES
+
+
+def _truncate(value: Any, length: int = 50) -> str:
+    value = str(value)
+    return value if len(value) <= length else f"{value[:length - 3]}..."
+
+
+def format_column_stats(stats: dict[str, Any]) -> str:
+    """Format column stats compactly, to be appended to the table info."""
+    lines = [f"Column stats (sampled {stats['rows']} rows):"]
+    for name, column in stats["columns"].items():
+        parts = []
+        if "values" in column:
+            values = ", ".join(
+                repr(_truncate(v)) if isinstance(v, str) else str(v)
+                for v in column["values"]
+            )
+            parts.append(f"values [{values}]")
+        elif "distinct" in column:
+            parts.append(f"{column['distinct']} distinct")
+        if "min" in column:
+            parts.append(f"min {column['min']}, max {column['max']}")
+        if column.get("null_rate"):
+            parts.append(f"{column['null_rate']:.0%} null")
+        if parts:
+            lines.append(f"{name}: {'; '.join(parts)}")
+    return "\n".join(lines)
+
+
+class ColumnStatsProfiler:
+    """Profiles the reflected tables of a `SQLDatabase` and stores column stats in Redis.
+
+    For each column it computes the null rate, the number of distinct values, min / max for orderable columns,
+    and the list of values for low-cardinality columns.
+    Stats are computed on the first `sample_size` rows of each table, and each table is given `time_budget` seconds.
+    Columns that cannot be profiled within the budget are left out.
+    """
+
+    def __init__(
+        self,
+        db: SQLDatabase,
+        redis_url: str = "redis://localhost:6379",
+        key_prefix: str = "sqlbot:column_stats:",
+        sample_size: int = 10000,
+        max_values: int = 20,
+        time_budget: float = 5.0,
+        ttl: Optional[int] = None,
+    ):
+        from redis import Redis
+
+        self.db = db
+        self.client = Redis.from_url(redis_url, decode_responses=True)
+        self.key_prefix = key_prefix
+        self.sample_size = sample_size
+        self.max_values = max_values
+        self.time_budget = time_budget
+        self.ttl = ttl
+        self._stopped = False
+
+    def profile_table(self, table: Table) -> dict[str, Any]:
+        deadline = time.monotonic() + self.time_budget
+        sample = select(table).limit(self.sample_size).subquery()
+        columns = [c for c in sample.columns if _enumerable(c) or _orderable(c)]
+        aggregates = [func.count().label("rows")]
+        for i, column in enumerate(columns):
+            aggregates.append(func.count(column).label(f"nonnull_{i}"))
+            aggregates.append(func.count(distinct(column)).label(f"distinct_{i}"))
+            if _orderable(column):
+                aggregates.append(func.min(column).label(f"min_{i}"))
+                aggregates.append(func.max(column).label(f"max_{i}"))
+
+        stats = {"rows": 0, "columns": {}, "profiled_at": utcnow().isoformat()}
+        with connect_read(self.db) as connection:
+            if self.db.dialect == "postgresql":
+                # `SET LOCAL` only lasts until the end of the (implicit) transaction
+                budget_ms = int(self.time_budget * 1000)
+                connection.execute(text(f"SET LOCAL statement_timeout = {budget_ms}"))
+            row = connection.execute(select(*aggregates).select_from(sample)).one()
+            row = row._mapping
+            stats["rows"] = rows = row["rows"]
+            if not rows:
+                return stats
+            for i, column in enumerate(columns):
+                result = {
+                    "null_rate": 1 - row[f"nonnull_{i}"] / rows,
+                    "distinct": row[f"distinct_{i}"],
+                }
+                if _orderable(column):
+                    result["min"] = row[f"min_{i}"]
+                    result["max"] = row[f"max_{i}"]
+                stats["columns"][column.name] = result
+            for column in columns:
+                result = stats["columns"][column.name]
+                if not (
+                    _enumerable(column) and 0 < result["distinct"] <= self.max_values
+                ):
+                    continue
+                if time.monotonic() > deadline:
+                    logger.info(f"Time budget exceeded when profiling {table.name}")
+                    break
+                values = connection.execute(
+                    select(column).where(column.isnot(None)).distinct().order_by(column)
+                ).scalars()
+                result["values"] = list(values)
+        return stats
+
+    def profile(self) -> None:
+        """Profile all usable tables, one after another."""
+        self._stopped = False
+        tables = set(self.db.get_usable_table_names())
+        for table in self.db._metadata.sorted_tables:
+            if self._stopped:
+                return
+            if table.name not in tables:
+                continue
+            start = time.perf_counter()
+            try:
+                stats = self.profile_table(table)
+            except Exception as e:
+                logger.warning(f"Failed to profile table {table.name}: {e}")
+                continue
+            self.client.set(
+                f"{self.key_prefix}{table.name}",
+                json.dumps(stats, default=str),
+                ex=self.ttl,
+            )
+            logger.debug(
+                f"Profiled table {table.name} in {(time.perf_counter() - start):.4}s"
+            )
+
+    async def run(self, interval: float) -> None:
+        """Profile tables every `interval` seconds, in a worker thread."""
+        try:
+            while True:
+                await asyncio.to_thread(self.profile)
+                await asyncio.sleep(interval)
+        finally:
+            # stop the worker thread after the table it is profiling
+            self._stopped = True
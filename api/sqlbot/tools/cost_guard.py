@@ -0,0 +1,103 @@
+"""EXPLAIN-based admission of agent generated queries."""
+import json
+from typing import Any, Optional
+
+from loguru import logger
+from sqlalchemy import Connection, text
+
+from sqlbot.utils import utcnow
+
+
+class CostGuard:
+    """Rejects queries the planner estimates to be too expensive, before running them.
+
+    Queries are `EXPLAIN`ed (without `ANALYZE`, so nothing is executed), and rejected when the estimated total cost
+    exceeds `max_cost` or the estimated number of rows exceeds `max_rows`. A threshold of 0 disables that check.
+    Admitted queries run with `statement_timeout` (seconds) as a last line of defense.
+    Only PostgreSQL is supported, queries against other dialects are always admitted.
+
+    Every decision is logged, and the last `decisions_size` decisions are kept in a Redis list for tuning the thresholds.
+    """
+
+    def __init__(
+        self,
+        max_cost: float = 0,
+        max_rows: float = 0,
+        statement_timeout: float = 0,
+        redis_url: Optional[str] = None,
+        decisions_key: str = "sqlbot:cost_guard:decisions",
+        decisions_size: int = 1000,
+    ):
+        self.max_cost = max_cost
+        self.max_rows = max_rows
+        self.statement_timeout = statement_timeout
+        self.client = None
+        if redis_url is not None:
+            from redis import Redis
+
+            self.client = Redis.from_url(redis_url, decode_responses=True)
+        self.decisions_key = decisions_key
+        self.decisions_size = decisions_size
+
+    def admit(self, connection: Connection, query: str) -> Optional[str]:
+        """Prepare `connection` to run `query`.
+
+        Returns:
+            Optional[str]: None if the query is admitted, otherwise an observation explaining the rejection.
+        """
+        if connection.dialect.name != "postgresql":
+            return None
+        if self.statement_timeout > 0:
+            # `SET LOCAL` only lasts until the end of the transaction
+            timeout_ms = int(self.statement_timeout * 1000)
+            connection.execute(text(f"SET LOCAL statement_timeout = {timeout_ms}"))
+        if self.max_cost <= 0 and self.max_rows <= 0:
+            return None
+        explained = connection.execute(text(f"EXPLAIN (FORMAT JSON) {query}")).scalar()
+        if isinstance(explained, str):
+            explained = json.loads(explained)
+        plan = explained[0]["Plan"]
+        cost, rows = plan["Total Cost"], plan["Plan Rows"]
+        rejection = self.check(cost, rows)
+        self.record(query, cost, rows, rejection is None)
+        return rejection
+
+    def check(self, cost: float, rows: float) -> Optional[str]:
+        """Check estimates against the thresholds, returns the rejection observation if any is exceeded."""
+        reasons = []
+        if self.max_cost > 0 and cost > self.max_cost:
+            reasons.append(
+                f"its estimated cost is {cost:.0f}, over the limit of {self.max_cost:.0f}"
+            )
+        if self.max_rows > 0 and rows > self.max_rows:
+            reasons.append(
+                f"it is estimated to return {rows:.0f} rows, over the limit of {self.max_rows:.0f}"
+            )
+        if not reasons:
+            return None
+        return (
+            f"Error: the query was not executed as {' and '.join(reasons)}. "
+            "Rewrite it to scan less data: add filters (WHERE), aggregations (GROUP BY) or a LIMIT clause, "
+            "and make sure every JOIN has a join condition."
+        )
+
+    def record(self, query: str, cost: float, rows: float, admitted: bool) -> None:
+        decision: dict[str, Any] = {
+            "query": query,
+            "cost": cost,
+            "rows": rows,
+            "admitted": admitted,
+            "at": utcnow().isoformat(),
+        }
+        logger.info(
+            f"Cost guard {'admitted' if admitted else 'rejected'} query, cost: {cost}, rows: {rows}"
+        )
+        if self.client is None:
+            return
+        try:
+            with self.client.pipeline() as pipe:
+                pipe.lpush(self.decisions_key, json.dumps(decision))
+                pipe.ltrim(self.decisions_key, 0, self.decisions_size - 1)
+                pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to record cost guard decision: {e}")
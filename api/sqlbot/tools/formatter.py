@@ -0,0 +1,66 @@
+from datetime import date, datetime, time
+from decimal import Decimal
+from typing import Any, Iterable
+
+
+class ResultFormatter:
+    """Renders query results compactly for the LLM.
+
+    A header row of column names, followed by one delimited line per row.
+    Compared to the `repr` of a list of tuples, this drops the quotes, `Decimal(...)` and `datetime.date(...)` noise.
+    """
+
+    def __init__(
+        self,
+        delimiter: str = "|",
+        null: str = "NULL",
+        float_precision: int = 4,
+        date_format: str = "%Y-%m-%d",
+        datetime_format: str = "%Y-%m-%d %H:%M:%S",
+        max_value_length: int = 100,
+    ):
+        self.delimiter = delimiter
+        self.null = null
+        self.float_precision = float_precision
+        """Maximum number of decimal places of floats and decimals, smaller non-zero values use scientific notation."""
+        self.date_format = date_format
+        self.datetime_format = datetime_format
+        self.max_value_length = max_value_length
+
+    def format_value(self, value: Any) -> str:
+        if value is None:
+            return self.null
+        if isinstance(value, (float, Decimal)):
+            formatted = f"{value:.{self.float_precision}f}"
+            if "." in formatted:
+                formatted = formatted.rstrip("0").rstrip(".")
+            if formatted in ("0", "-0") and value != 0:
+                # too small for the decimal places, keep it from reading as zero
+                digits = max(self.float_precision - 1, 0)
+                mantissa, exponent = f"{value:.{digits}e}".split("e")
+                if "." in mantissa:
+                    mantissa = mantissa.rstrip("0").rstrip(".")
+                formatted = f"{mantissa}e{exponent}"
+            return formatted
+        # datetime is a subclass of date, check it first
+        if isinstance(value, datetime):
+            return value.strftime(self.datetime_format)
+        if isinstance(value, date):
+            return value.strftime(self.date_format)
+        if isinstance(value, time):
+            return value.isoformat()
+        formatted = str(value)
+        if len(formatted) > self.max_value_length:
+            formatted = f"{formatted[: self.max_value_length - 3]}..."
+        # keep one row per line, and keep the delimiter unambiguous
+        return (
+            formatted.replace("\\", "\\\\")
+            .replace("\n", "\\n")
+            .replace(self.delimiter, f"\\{self.delimiter}")
+        )
+
+    def format_row(self, values: Iterable[Any]) -> str:
+        return self.delimiter.join(self.format_value(value) for value in values)
+
+    def format_header(self, columns: Iterable[str]) -> str:
+        return self.delimiter.join(columns)
@@ -0,0 +1,155 @@
+import asyncio
+from itertools import chain
+from typing import Any, Iterable, Optional, Sequence
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from langchain.tools.sql_database.tool import QuerySQLDataBaseTool
+from langchain.utilities.sql_database import truncate_word
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from sqlbot.tools.cost_guard import CostGuard
+from sqlbot.tools.formatter import ResultFormatter
+from sqlbot.tools.summary import ResultSummarizer
+from sqlbot.warehouse import StatementCanceller, begin_read
+
+
+class QueryExecutorTool(QuerySQLDataBaseTool):
+    """Tool for executing queries, with bounded memory usage.
+
+    Rows are streamed through a server-side cursor, and only the first `max_rows` rows, up to `max_bytes`, are kept.
+    The remaining rows are counted (up to `max_omitted_count`) but never held in memory.
+    If a `summarizer` is set, results exceeding these limits are summarized instead, along with a few sample rows.
+    """
+
+    name: str = "query_executor"
+    max_rows: int = 100
+    """Maximum number of rows in the observation."""
+    max_bytes: int = 16 * 1024
+    """Maximum size of the observation, in bytes."""
+    max_omitted_count: int = 10000
+    """Stop counting omitted rows after this many, so that huge results do not keep the warehouse busy."""
+    formatter: Optional[ResultFormatter] = None
+    """Renders rows compactly with a header row. If not set, rows are rendered as a list of tuples like `SQLDatabase.run` does."""
+    summarizer: Optional[ResultSummarizer] = None
+    summary_sample_rows: int = 5
+    """Number of sample rows shown along with the summary."""
+    cost_guard: Optional[CostGuard] = None
+    """Rejects queries estimated to be too expensive before running them."""
+
+    def _run(
+        self,
+        query: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Execute the query, return the results or an error message."""
+        return self._execute_no_throw(query)
+
+    async def _arun(
+        self,
+        query: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Execute the query in a worker thread, cancelling the statement if the run is cancelled."""
+        canceller = StatementCanceller()
+        task = asyncio.ensure_future(
+            asyncio.to_thread(self._execute_no_throw, query, canceller)
+        )
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            canceller.cancel()
+            raise
+
+    def _execute_no_throw(
+        self, query: str, canceller: Optional[StatementCanceller] = None
+    ) -> str:
+        try:
+            return self._execute(query, canceller)
+        except SQLAlchemyError as e:
+            return f"Error: {e}"
+
+    def _execute(
+        self, query: str, canceller: Optional[StatementCanceller] = None
+    ) -> str:
+        rows: list[str] = []
+        raw_rows: list[Sequence[Any]] = []
+        omitted = 0
+        canceller = canceller or StatementCanceller()
+        with begin_read(self.db) as connection, canceller.attach(connection):
+            if canceller.cancelled:
+                return ""
+            if self.cost_guard is not None:
+                rejection = self.cost_guard.admit(connection, query)
+                if rejection is not None:
+                    return rejection
+            result = connection.execution_options(
+                stream_results=True, max_row_buffer=self.max_rows
+            ).execute(text(query))
+            if not result.returns_rows:
+                return ""
+            header = self._render_header(result.keys())
+            size = len(header.encode("utf-8"))
+            for row in result:
+                if omitted:
+                    omitted += 1
+                    if omitted > self.max_omitted_count:
+                        break
+                    continue
+                rendered = self._render_row(row)
+                rendered_size = len(rendered.encode("utf-8")) + 2  # the separator
+                if len(rows) >= self.max_rows or size + rendered_size > self.max_bytes:
+                    if self.summarizer is not None:
+                        return self._summarize(
+                            list(result.keys()), raw_rows, chain([row], result)
+                        )
+                    omitted = 1
+                    continue
+                if self.summarizer is not None:
+                    raw_rows.append(row)
+                rows.append(rendered)
+                size += rendered_size
+            result.close()
+        if not rows and not omitted:
+            return ""
+        observation = self._render(header, rows)
+        if omitted > self.max_omitted_count:
+            observation += f"\n({self.max_omitted_count}+ more rows omitted, add filters or aggregations to narrow down the result)"
+        elif omitted:
+            observation += f"\n({omitted} more rows omitted, add filters or aggregations to narrow down the result)"
+        return observation
+
+    def _summarize(
+        self,
+        columns: list[str],
+        head: list[Sequence[Any]],
+        rest: Iterable[Sequence[Any]],
+    ) -> str:
+        format_value = str if self.formatter is None else self.formatter.format_value
+        summary = self.summarizer.summarize(
+            columns, chain(head, rest), formatter=format_value
+        )
+        samples = [self._render_row(row) for row in head[: self.summary_sample_rows]]
+        sample = self._render(self._render_header(columns), samples)
+        return f"{summary}\nSample rows:\n{sample}"
+
+    def _render(self, header: str, rows: list[str]) -> str:
+        if self.formatter is None:
+            return f"[{', '.join(rows)}]"
+        return "\n".join([header, *rows])
+
+    def _render_header(self, columns: Iterable[str]) -> str:
+        if self.formatter is None:
+            return "[]"
+        return self.formatter.format_header(columns)
+
+    def _render_row(self, row: Sequence[Any]) -> str:
+        if self.formatter is None:
+            # same format as `SQLDatabase.run`
+            return str(
+                tuple(truncate_word(c, length=self.db._max_string_length) for c in row)
+            )
+        return self.formatter.format_row(row)
@@ -0,0 +1,107 @@
+"""In-process cache of table schemas, shared by the schema lookups of a warehouse."""
+import contextvars
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable
+
+from langchain.sql_database import SQLDatabase
+
+# shared by every warehouse, bounds the load schema lookups put on the warehouses
+_executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="table_schema")
+
+
+@dataclass
+class _Entry:
+    future: Future
+    expires_at: float
+    prefetched: bool
+    used: bool
+
+
+class SchemaCache:
+    """Caches the table info (DDL and sample rows) of tables for `ttl` seconds.
+
+    Entries are futures, so that a lookup of a table being fetched (e.g. prefetched) waits for that fetch
+    instead of starting another one. Tables are fetched on a shared, bounded executor.
+
+    Prefetched entries are accounted for: a prefetch is a hit when the entry is looked up before it expires,
+    and wasted otherwise.
+    """
+
+    def __init__(self, db: SQLDatabase, ttl: float = 600):
+        self.db = db
+        self.ttl = ttl
+        self._entries: dict[str, _Entry] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.prefetched = 0
+        self.prefetch_hits = 0
+        self.prefetch_wasted = 0
+
+    def _load(self, table: str) -> str:
+        return self.db.get_table_info_no_throw([table])
+
+    def _valid(self, entry: _Entry, now: float) -> bool:
+        if entry.future.cancelled():
+            return False
+        if entry.future.done() and entry.future.exception() is not None:
+            return False
+        # entries being fetched are always valid, they expire once fetched
+        return not entry.future.done() or entry.expires_at > now
+
+    def _discard(self, table: str) -> None:
+        entry = self._entries.pop(table)
+        if entry.prefetched and not entry.used:
+            self.prefetch_wasted += 1
+
+    def _fetch(self, table: str, prefetch: bool) -> Future[str]:
+        now = time.monotonic()
+        entry = self._entries.get(table)
+        if entry is not None and self._valid(entry, now):
+            if not prefetch:
+                self.hits += 1
+                if entry.prefetched and not entry.used:
+                    self.prefetch_hits += 1
+                entry.used = True
+            return entry.future
+        if entry is not None:
+            self._discard(table)
+        if prefetch:
+            self.prefetched += 1
+        else:
+            self.misses += 1
+        # in the context of the caller, so that e.g. the schema queries are traced in its `current_trace`
+        future = _executor.submit(contextvars.copy_context().run, self._load, table)
+        if self.ttl > 0 or prefetch:
+            self._entries[table] = _Entry(
+                future, now + self.ttl, prefetched=prefetch, used=not prefetch
+            )
+        return future
+
+    def get(self, table: str) -> Future[str]:
+        """The info of `table`, fetching it unless cached."""
+        with self._lock:
+            return self._fetch(table, prefetch=False)
+
+    def prefetch(self, tables: Iterable[str]) -> None:
+        """Start fetching `tables` unless cached, without waiting."""
+        with self._lock:
+            for table in tables:
+                self._fetch(table, prefetch=True)
+
+    def stats(self) -> dict[str, int]:
+        with self._lock:
+            now = time.monotonic()
+            for table, entry in list(self._entries.items()):
+                if not self._valid(entry, now):
+                    self._discard(table)
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetched": self.prefetched,
+                "prefetch_hits": self.prefetch_hits,
+                "prefetch_wasted": self.prefetch_wasted,
+            }
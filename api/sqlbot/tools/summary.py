@@ -0,0 +1,206 @@
+"""Statistical summaries of query results too large to be shown to the LLM row by row."""
+from decimal import Decimal
+from itertools import islice
+from typing import Any, Iterable, Iterator, Optional, Sequence
+
+import numpy as np
+
+INTEGER_TYPES = frozenset({int, np.int64})
+NUMBER_TYPES = INTEGER_TYPES | {float, Decimal, np.float64}
+
+
+class ColumnSummary:
+    """Running statistics of a single column, updated one chunk at a time.
+
+    Memory is bounded regardless of the number of rows:
+    distinct values and value counts are tracked up to `max_tracked` values, and quantiles are computed on a
+    reservoir sample of `sample_size` values.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        max_tracked: int = 10000,
+        sample_size: int = 10000,
+        rng: Optional[np.random.Generator] = None,
+    ):
+        self.name = name
+        self.max_tracked = max_tracked
+        self.sample_size = sample_size
+        self.rng = rng or np.random.default_rng()
+        self.count = 0
+        self.nulls = 0
+        self.numeric = True
+        self.integral = True
+        """Whether all values are integers, their min, max and counts are kept as such."""
+        self.orderable = True
+        """Whether all values compare with each other, `min` and `max` are unknown otherwise."""
+        self.min: Any = None
+        self.max: Any = None
+        self.sum = 0.0
+        self.numbers_seen = 0
+        self.reservoir = np.empty(0, dtype=np.float64)
+        self.counts: dict[Any, int] = {}
+        self.overflowed = False
+        """Whether there were more than `max_tracked` distinct values."""
+
+    def update(self, values: np.ndarray) -> None:
+        """Update the statistics with a chunk of values, `values` being an object array."""
+        present = values[values != None]  # noqa: E711, elementwise comparison
+        self.nulls += len(values) - len(present)
+        self.count += len(present)
+        if not len(present):
+            return
+        # bool is a subclass of int, but summing booleans makes no sense
+        types = set(map(type, present))
+        self.numeric = self.numeric and types <= NUMBER_TYPES
+        self.integral = self.numeric and self.integral and types <= INTEGER_TYPES
+        if self.numeric:
+            numbers = present.astype(np.float64)
+            exact = present.astype(np.int64) if self.integral else numbers
+            self._update_numbers(numbers, exact)
+            # numeric columns with many distinct values are described by quantiles instead
+            if not self.overflowed:
+                self._update_counts(exact)
+        else:
+            self._update_range(present)
+            self._update_counts(present)
+
+    def _update_numbers(self, numbers: np.ndarray, exact: np.ndarray) -> None:
+        """`exact` are the same values as `numbers`, as integers for integer columns."""
+        chunk_min, chunk_max = exact.min(), exact.max()
+        self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+        self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        self.sum += numbers.sum()
+        # vectorized reservoir sampling (algorithm R)
+        seen = self.numbers_seen
+        self.numbers_seen += len(numbers)
+        room = max(self.sample_size - len(self.reservoir), 0)
+        if room:
+            self.reservoir = np.concatenate([self.reservoir, numbers[:room]])
+            numbers = numbers[room:]
+            seen += room
+        if len(numbers):
+            slots = self.rng.integers(0, seen + np.arange(1, len(numbers) + 1))
+            replace = slots < self.sample_size
+            self.reservoir[slots[replace]] = numbers[replace]
+
+    def _update_range(self, values: np.ndarray) -> None:
+        if not self.orderable:
+            return
+        try:
+            chunk_min, chunk_max = min(values), max(values)
+            # values of earlier chunks may not compare with these either, e.g. numbers then strings
+            self.min = chunk_min if self.min is None else min(self.min, chunk_min)
+            self.max = chunk_max if self.max is None else max(self.max, chunk_max)
+        except TypeError:
+            self.orderable = False
+            self.min = self.max = None
+
+    def _update_counts(self, values: np.ndarray) -> None:
+        try:
+            uniques, counts = np.unique(values, return_counts=True)
+        except TypeError:
+            # mixed types that cannot be sorted, count them one by one
+            uniques, counts = np.unique(values.astype(str), return_counts=True)
+        for value, count in zip(uniques.tolist(), counts.tolist()):
+            if value in self.counts:
+                self.counts[value] += count
+            elif len(self.counts) < self.max_tracked:
+                self.counts[value] = count
+            else:
+                self.overflowed = True
+
+    def describe(
+        self,
+        top_k: int = 5,
+        formatter=str,
+        quantiles: Sequence[float] = (0.25, 0.5, 0.75),
+    ) -> str:
+        parts = [f"{self.count} non-null"]
+        if self.count:
+            distinct = len(self.counts)
+            parts.append(
+                f"{distinct}+ distinct" if self.overflowed else f"{distinct} distinct"
+            )
+        if self.min is not None:
+            parts.append(f"min {formatter(self.min)}, max {formatter(self.max)}")
+        if self.numeric and self.numbers_seen:
+            parts.append(f"mean {formatter(self.sum / self.numbers_seen)}")
+            values = np.quantile(self.reservoir, quantiles)
+            parts.append(
+                ", ".join(
+                    f"p{round(q * 100)} {formatter(float(v))}"
+                    for q, v in zip(quantiles, values)
+                )
+            )
+        if self.counts and (not self.numeric or len(self.counts) <= top_k):
+            top = sorted(self.counts.items(), key=lambda x: x[1], reverse=True)[:top_k]
+            parts.append(
+                "top "
+                + ", ".join(
+                    f"{formatter(value)} ({count / self.count:.0%})"
+                    for value, count in top
+                )
+            )
+        return f"{self.name}: {'; '.join(parts)}"
+
+
+class ResultSummarizer:
+    """Summarizes a query result in a single pass, a chunk of rows at a time.
+
+    Each chunk is transposed into column arrays, on which statistics are computed in a vectorized manner.
+    At most `max_rows` rows are scanned.
+    """
+
+    def __init__(
+        self,
+        chunk_size: int = 10000,
+        max_rows: int = 1_000_000,
+        top_k: int = 5,
+        max_tracked: int = 10000,
+        sample_size: int = 10000,
+        seed: Optional[int] = None,
+    ):
+        self.chunk_size = chunk_size
+        self.max_rows = max_rows
+        self.top_k = top_k
+        self.max_tracked = max_tracked
+        self.sample_size = sample_size
+        self.seed = seed
+
+    def _chunks(self, rows: Iterable[Sequence[Any]]) -> Iterator[list[Sequence[Any]]]:
+        rows = islice(rows, self.max_rows + 1)
+        while chunk := list(islice(rows, self.chunk_size)):
+            yield chunk
+
+    def summarize(
+        self,
+        columns: Sequence[str],
+        rows: Iterable[Sequence[Any]],
+        formatter=str,
+    ) -> str:
+        rng = np.random.default_rng(self.seed)
+        summaries = [
+            ColumnSummary(column, self.max_tracked, self.sample_size, rng)
+            for column in columns
+        ]
+        total = 0
+        for chunk in self._chunks(rows):
+            if total + len(chunk) > self.max_rows:
+                chunk = chunk[: self.max_rows - total]
+                total = self.max_rows + 1
+            else:
+                total += len(chunk)
+            for summary, values in zip(summaries, zip(*chunk)):
+                summary.update(np.fromiter(values, dtype=object, count=len(values)))
+        if total > self.max_rows:
+            header = f"Summary of the first {self.max_rows} rows (more rows omitted):"
+        else:
+            header = f"Summary of {total} rows:"
+        lines = [header]
+        lines.extend(
+            summary.describe(top_k=self.top_k, formatter=formatter)
+            for summary in summaries
+        )
+        return "\n".join(lines)
@@ -0,0 +1,120 @@
+import asyncio
+import json
+from concurrent.futures import Future, wait
+from typing import Any, Optional
+
+from langchain.callbacks.manager import (
+    AsyncCallbackManagerForToolRun,
+    CallbackManagerForToolRun,
+)
+from langchain.tools.sql_database.tool import InfoSQLDatabaseTool
+from loguru import logger
+from pydantic.v1 import root_validator
+
+from sqlbot.tools.column_stats import format_column_stats
+from sqlbot.tools.schema_cache import SchemaCache
+
+
+class TableSchemaTool(InfoSQLDatabaseTool):
+    """Tool for getting the schema of tables, along with their column stats.
+
+    Tables are fetched concurrently through `schema_cache`. Tables not fetched within `table_timeout` seconds are
+    reported as such, so that one slow table does not block the whole step.
+    """
+
+    name: str = "table_schema_tool"
+
+    redis_url: str = "redis://localhost:6379"
+    key_prefix: str = "sqlbot:column_stats:"
+    client: Any = None
+    table_timeout: float = 10.0
+    """Seconds to wait for the schema of the tables."""
+    schema_cache: Optional[SchemaCache] = None
+    """Shared by the tools of a warehouse. If not set, tables are fetched on every call."""
+
+    @root_validator(pre=True)
+    def validate_environment(cls, values):
+        from redis import Redis
+
+        values["client"] = Redis.from_url(
+            values.get("redis_url", cls.__fields__["redis_url"].default),
+            decode_responses=True,
+        )
+        if values.get("schema_cache") is None and "db" in values:
+            values["schema_cache"] = SchemaCache(values["db"], ttl=0)
+        return values
+
+    def _run(
+        self,
+        table_names: str,
+        run_manager: Optional[CallbackManagerForToolRun] = None,
+    ) -> str:
+        """Get the schema for tables in a comma-separated list."""
+        tables = _split(table_names)
+        stats = self._get_stats(tables)
+        futures = [self.schema_cache.get(table) for table in tables]
+        try:
+            wait(futures, timeout=self.table_timeout)
+        finally:
+            self._cancel(futures)
+        return self._join(tables, stats, futures)
+
+    async def _arun(
+        self,
+        table_names: str,
+        run_manager: Optional[AsyncCallbackManagerForToolRun] = None,
+    ) -> str:
+        """Get the schema for tables in a comma-separated list."""
+        tables = _split(table_names)
+        stats = await asyncio.to_thread(self._get_stats, tables)
+        futures = [self.schema_cache.get(table) for table in tables]
+        try:
+            await asyncio.wait(
+                [asyncio.wrap_future(f) for f in futures], timeout=self.table_timeout
+            )
+        finally:
+            self._cancel(futures)
+        return self._join(tables, stats, futures)
+
+    def _cancel(self, futures: list[Future[str]]) -> None:
+        """Do not fetch tables that did not start yet, unless they end up in the cache for the next lookup."""
+        if self.schema_cache.ttl > 0:
+            return
+        for future in futures:
+            future.cancel()
+
+    def _get_stats(self, tables: list[str]) -> list[Optional[str]]:
+        try:
+            return self.client.mget([f"{self.key_prefix}{name}" for name in tables])
+        except Exception:
+            # column stats are nice to have, don't fail the tool because of them
+            return [None] * len(tables)
+
+    def _join(
+        self,
+        tables: list[str],
+        stats: list[Optional[str]],
+        futures: list[Future[str]],
+    ) -> str:
+        infos = []
+        for table, table_stats, future in zip(tables, stats, futures):
+            if not future.done() or future.cancelled():
+                logger.warning(f"Timed out getting the schema of {table}")
+                infos.append(
+                    f"Error: timed out getting the schema of {table}, try again later"
+                )
+                continue
+            try:
+                info = future.result()
+            except Exception as e:
+                logger.warning(f"Failed to get the schema of {table}: {e}")
+                infos.append(f"Error: failed to get the schema of {table}: {e}")
+                continue
+            if table_stats is not None:
+                info += f"\n\n/*\n{format_column_stats(json.loads(table_stats))}\n*/"
+            infos.append(info)
+        return "\n\n".join(infos)
+
+
+def _split(table_names: str) -> list[str]:
+    return [name.strip() for name in table_names.split(",") if name.strip()]
@@ -0,0 +1,217 @@
+"""Traces of agent runs, as trees of spans exported in the OTLP JSON format."""
+import asyncio
+import json
+import os
+import time
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+import aiohttp
+from loguru import logger
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+MAX_STATEMENT_LENGTH = 1000
+
+
+@dataclass
+class Span:
+    span_id: str
+    name: str
+    kind: str
+    """One of `chain`, `llm`, `tool` or `sql`."""
+    start_ns: int
+    parent_id: Optional[str] = None
+    end_ns: Optional[int] = None
+    attributes: dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+class Trace:
+    """The spans of one agent run.
+
+    Spans of langchain runs are linked by their `run_id` and `parent_run_id`. SQL statements run in worker threads,
+    out of reach of the callbacks, they are recorded through `current_trace` and attached to the innermost tool
+    span enclosing them.
+    """
+
+    def __init__(self, attributes: Optional[dict[str, Any]] = None):
+        self.trace_id: Optional[str] = None
+        self.attributes = attributes or {}
+        self.spans: dict[str, Span] = {}
+        self.statements: list[Span] = []
+
+    def start(
+        self,
+        span_id: str,
+        name: str,
+        kind: str,
+        parent_id: Optional[str] = None,
+        **attributes: Any,
+    ) -> Span:
+        span = Span(
+            span_id=span_id,
+            name=name,
+            kind=kind,
+            start_ns=time.time_ns(),
+            parent_id=parent_id if parent_id in self.spans else None,
+            attributes=attributes,
+        )
+        self.spans[span_id] = span
+        return span
+
+    def end(self, span_id: str, error: Optional[str] = None, **attributes: Any) -> None:
+        if (span := self.spans.get(span_id)) is None:
+            return
+        span.end_ns = time.time_ns()
+        span.error = error
+        span.attributes.update(attributes)
+
+    def _parent_of(self, statement: Span) -> Optional[str]:
+        enclosing = [
+            span
+            for span in self.spans.values()
+            if span.kind == "tool"
+            and span.start_ns <= statement.start_ns
+            and (span.end_ns is None or statement.end_ns <= span.end_ns)
+        ]
+        if enclosing:
+            return max(enclosing, key=lambda span: span.start_ns).span_id
+        roots = [span for span in self.spans.values() if span.parent_id is None]
+        return roots[0].span_id if roots else None
+
+    def to_otlp(self) -> dict[str, Any]:
+        spans = list(self.spans.values())
+        for statement in self.statements:
+            statement.parent_id = self._parent_of(statement)
+            spans.append(statement)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": _attributes(
+                            {"service.name": "sqlbot", **self.attributes}
+                        )
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": "sqlbot"},
+                            "spans": [self._otlp_span(span) for span in spans],
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def _otlp_span(self, span: Span) -> dict[str, Any]:
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            # SPAN_KIND_INTERNAL, or SPAN_KIND_CLIENT for calls to other services
+            "kind": 3 if span.kind in ("llm", "sql") else 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns or span.start_ns),
+            "attributes": _attributes({"sqlbot.kind": span.kind, **span.attributes}),
+            "status": {"code": 2, "message": span.error}
+            if span.error is not None
+            else {"code": 1},
+        }
+        if span.parent_id is not None:
+            otlp["parentSpanId"] = span.parent_id
+        return otlp
+
+
+def _attributes(attributes: dict[str, Any]) -> list[dict[str, Any]]:
+    def _value(value: Any) -> dict[str, Any]:
+        if isinstance(value, bool):
+            return {"boolValue": value}
+        if isinstance(value, int):
+            return {"intValue": str(value)}
+        if isinstance(value, float):
+            return {"doubleValue": value}
+        return {"stringValue": str(value)}
+
+    return [
+        {"key": key, "value": _value(value)}
+        for key, value in attributes.items()
+        if value is not None
+    ]
+
+
+current_trace: ContextVar[Optional[Trace]] = ContextVar("current_trace", default=None)
+"""The trace of the current agent run, inherited by the worker threads of its tools."""
+
+
+def trace_engine(engine: Engine) -> None:
+    """Record the statements run by `engine` into the current trace."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        if (trace := current_trace.get()) is None:
+            return
+        span = Span(
+            span_id=os.urandom(8).hex(),
+            name="sql",
+            kind="sql",
+            start_ns=time.time_ns(),
+            attributes={"db.statement": statement[:MAX_STATEMENT_LENGTH]},
+        )
+        conn.info.setdefault("sqlbot_spans", []).append(span)
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        if (trace := current_trace.get()) is None:
+            return
+        if not (spans := conn.info.get("sqlbot_spans")):
+            return
+        span = spans.pop()
+        span.end_ns = time.time_ns()
+        span.attributes["db.rows"] = cursor.rowcount
+        trace.statements.append(span)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        if (trace := current_trace.get()) is None:
+            return
+        if not (spans := context.connection.info.get("sqlbot_spans")):
+            return
+        span = spans.pop()
+        span.end_ns = time.time_ns()
+        span.error = str(context.original_exception)
+        trace.statements.append(span)
+
+
+class FileTraceExporter:
+    """Writes each trace to `{directory}/{trace_id}.json`."""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    async def export(self, trace: Trace) -> None:
+        await asyncio.to_thread(self._write, trace)
+
+    def _write(self, trace: Trace) -> None:
+        path = os.path.join(self.directory, f"{trace.trace_id}.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(trace.to_otlp(), f)
+
+
+class OTLPTraceExporter:
+    """Posts each trace to an OTLP/HTTP collector, e.g. `http://localhost:4318/v1/traces`."""
+
+    def __init__(self, url: str, session: aiohttp.ClientSession):
+        self.url = url
+        self.session = session
+
+    async def export(self, trace: Trace) -> None:
+        timeout = aiohttp.ClientTimeout(total=5)
+        async with self.session.post(
+            self.url, json=trace.to_otlp(), timeout=timeout
+        ) as response:
+            if response.status >= 400:
+                logger.warning(
+                    f"Collector refused trace {trace.trace_id}: {response.status}"
+                )
@@ -0,0 +1,312 @@
+"""Warehouse connections: routing of read-only traffic to replicas, and per-warehouse state."""
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Generic, Iterable, Iterator, Optional, TypeVar
+
+from langchain.sql_database import SQLDatabase
+from loguru import logger
+from sqlalchemy import Connection, Engine, Table, create_engine, select, text
+from sqlalchemy.exc import DBAPIError, ProgrammingError
+
+T = TypeVar("T")
+
+# seconds the replica is behind its primary, 0 if it is not a replica or has replayed everything it received
+REPLICATION_LAG = """SELECT CASE
+    WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+    ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+END"""
+
+
+class Replica:
+    def __init__(self, engine: Engine):
+        self.engine = engine
+        self.outstanding = 0
+        """Number of connections currently checked out through the pool."""
+        self.healthy = True
+        self.lag: Optional[float] = None
+
+    @property
+    def name(self) -> str:
+        return self.engine.url.render_as_string(hide_password=True)
+
+
+class ReplicaPool:
+    """Balances read-only connections across replicas, with health checks.
+
+    A connection is taken from the healthy replica with the least outstanding connections.
+    A replica is taken out of rotation when connecting to it fails, or when the health check finds it down or lagging
+    more than `max_lag` seconds behind its primary. The health check puts it back once it recovered.
+    When no replica is healthy, the primary is used.
+    """
+
+    def __init__(
+        self,
+        primary: Engine,
+        replica_urls: list[str],
+        max_lag: float = 30,
+        **engine_kwargs: Any,
+    ):
+        self.primary = primary
+        self.replicas = [
+            Replica(create_engine(url, **engine_kwargs)) for url in replica_urls
+        ]
+        self.max_lag = max_lag
+        self._lock = threading.Lock()
+
+    def _acquire(self) -> Optional[Replica]:
+        with self._lock:
+            healthy = [r for r in self.replicas if r.healthy]
+            if not healthy:
+                return None
+            least = min(r.outstanding for r in healthy)
+            replica = random.choice([r for r in healthy if r.outstanding == least])
+            replica.outstanding += 1
+            return replica
+
+    def _release(self, replica: Replica) -> None:
+        with self._lock:
+            replica.outstanding -= 1
+
+    def _mark_down(self, replica: Replica, reason: Any) -> None:
+        if replica.healthy:
+            logger.warning(f"Taking replica {replica.name} out of rotation: {reason}")
+        replica.healthy = False
+
+    @contextmanager
+    def connect(self) -> Iterator[Connection]:
+        """A read-only connection, to a replica if one is healthy."""
+        replica = self._acquire()
+        if replica is not None:
+            try:
+                connection = replica.engine.connect()
+            except Exception as e:
+                self._mark_down(replica, e)
+                self._release(replica)
+                replica = None
+        if replica is None:
+            with self.primary.connect() as connection:
+                yield connection
+            return
+        try:
+            with connection:
+                try:
+                    yield connection
+                except DBAPIError as e:
+                    if e.connection_invalidated:
+                        self._mark_down(replica, e)
+                    raise
+        finally:
+            self._release(replica)
+
+    @contextmanager
+    def begin(self) -> Iterator[Connection]:
+        """Like `connect`, within a transaction."""
+        with self.connect() as connection, connection.begin():
+            yield connection
+
+    def check(self) -> None:
+        """Check the health and replication lag of every replica."""
+        for replica in self.replicas:
+            try:
+                with replica.engine.connect() as connection:
+                    lag = connection.execute(text(REPLICATION_LAG)).scalar()
+            except Exception as e:
+                self._mark_down(replica, e)
+                continue
+            replica.lag = float(lag)
+            if replica.lag > self.max_lag:
+                self._mark_down(replica, f"replication lag {replica.lag:.1f}s")
+            elif not replica.healthy:
+                logger.info(f"Putting replica {replica.name} back into rotation")
+                replica.healthy = True
+
+    async def run(self, interval: float) -> None:
+        """Check the replicas every `interval` seconds, until cancelled."""
+        while True:
+            try:
+                await asyncio.to_thread(self.check)
+            except Exception as e:
+                logger.error(f"Failed to check replicas: {e}")
+            await asyncio.sleep(interval)
+
+    def dispose(self) -> None:
+        for replica in self.replicas:
+            replica.engine.dispose()
+
+
+class StatementCanceller:
+    """Cancels the statement running on a connection, from another thread.
+
+    The thread running the statement attaches its connection for the duration of the statement,
+    any thread can then `cancel` it.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._dbapi_connection: Any = None
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def attach(self, connection: Connection) -> Iterator[None]:
+        with self._lock:
+            self._dbapi_connection = connection.connection.dbapi_connection
+        try:
+            yield
+        finally:
+            # the connection goes back to the pool, never cancel what runs on it next
+            with self._lock:
+                self._dbapi_connection = None
+
+    def cancel(self) -> None:
+        with self._lock:
+            self.cancelled = True
+            if (connection := self._dbapi_connection) is None:
+                return
+            try:
+                if hasattr(connection, "cancel"):
+                    # psycopg
+                    connection.cancel()
+                elif hasattr(connection, "interrupt"):
+                    # sqlite3
+                    connection.interrupt()
+            except Exception as e:
+                logger.warning(f"Failed to cancel statement: {e}")
+
+
+class Warehouse(SQLDatabase):
+    """`SQLDatabase` sending sample rows queries to replicas.
+
+    Schema reflection stays on the primary engine (`_engine`), so that the schema is always up to date.
+    """
+
+    def __init__(self, *args: Any, replicas: Optional[ReplicaPool] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replicas = replicas
+
+    def _get_sample_rows(self, table: Table) -> str:
+        # same as `SQLDatabase._get_sample_rows`, through a read-only connection
+        command = select(table).limit(self._sample_rows_in_table_info)
+        columns_str = "\t".join([col.name for col in table.columns])
+        try:
+            with connect_read(self) as connection:
+                sample_rows = [
+                    [str(i)[:100] for i in row] for row in connection.execute(command)
+                ]
+            sample_rows_str = "\n".join(["\t".join(row) for row in sample_rows])
+        except ProgrammingError:
+            sample_rows_str = ""
+        return (
+            f"{self._sample_rows_in_table_info} rows from {table.name} table:\n"
+            f"{columns_str}\n"
+            f"{sample_rows_str}"
+        )
+
+
+def connect_read(db: SQLDatabase):
+    """A connection for read-only queries, to a replica if `db` has any."""
+    if isinstance(db, Warehouse) and db.replicas is not None:
+        return db.replicas.connect()
+    return db._engine.connect()
+
+
+def begin_read(db: SQLDatabase):
+    """Like `connect_read`, within a transaction."""
+    if isinstance(db, Warehouse) and db.replicas is not None:
+        return db.replicas.begin()
+    return db._engine.begin()
+
+
+DEFAULT_WAREHOUSE = "default"
+"""Id of the warehouse at `Settings.warehouse_url`, used by conversations that did not select one."""
+
+
+class WarehouseRegistry(Generic[T]):
+    """Per-warehouse state, loaded on first use and kept in a bounded LRU.
+
+    `factory` builds the state of a warehouse from its id, it may block (e.g. reflecting the schema) and runs in a
+    worker thread. Least recently used entries are evicted when there are more than `max_size` of them, or when they
+    have not been used for `idle_timeout` seconds; `on_evict` is then called to release their resources.
+    Pinned warehouses are never evicted.
+    """
+
+    def __init__(
+        self,
+        factory: Callable[[str], T],
+        on_evict: Optional[Callable[[T], None]] = None,
+        max_size: int = 16,
+        idle_timeout: float = 1800,
+        pinned: Iterable[str] = (),
+    ):
+        self.factory = factory
+        self.on_evict = on_evict
+        self.max_size = max_size
+        self.idle_timeout = idle_timeout
+        self.pinned = set(pinned)
+        self._entries: OrderedDict[str, tuple[T, float]] = OrderedDict()
+        self._loading: dict[str, asyncio.Lock] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, warehouse_id: str) -> bool:
+        return warehouse_id in self._entries
+
+    def loaded(self) -> dict[str, T]:
+        """The warehouses currently loaded, by id."""
+        return {
+            warehouse_id: entry for warehouse_id, (entry, _) in self._entries.items()
+        }
+
+    def put(self, warehouse_id: str, entry: T) -> None:
+        self._entries[warehouse_id] = (entry, time.monotonic())
+        self._entries.move_to_end(warehouse_id)
+        self._evict_overflow()
+
+    async def get(self, warehouse_id: str) -> T:
+        if warehouse_id not in self._entries:
+            lock = self._loading.setdefault(warehouse_id, asyncio.Lock())
+            async with lock:
+                # another coroutine may have loaded it while we were waiting
+                if warehouse_id not in self._entries:
+                    logger.info(f"Loading warehouse {warehouse_id}")
+                    entry = await asyncio.to_thread(self.factory, warehouse_id)
+                    self.put(warehouse_id, entry)
+            self._loading.pop(warehouse_id, None)
+        entry, _ = self._entries[warehouse_id]
+        self._entries[warehouse_id] = (entry, time.monotonic())
+        self._entries.move_to_end(warehouse_id)
+        return entry
+
+    def _evict(self, warehouse_id: str) -> None:
+        entry, _ = self._entries.pop(warehouse_id)
+        logger.info(f"Evicting warehouse {warehouse_id}")
+        if self.on_evict is not None:
+            try:
+                self.on_evict(entry)
+            except Exception as e:
+                logger.warning(f"Failed to release warehouse {warehouse_id}: {e}")
+
+    def _evict_overflow(self) -> None:
+        evictable = [w for w in self._entries if w not in self.pinned]
+        for warehouse_id in evictable[: max(len(self._entries) - self.max_size, 0)]:
+            self._evict(warehouse_id)
+
+    def evict_idle(self) -> None:
+        deadline = time.monotonic() - self.idle_timeout
+        for warehouse_id, (_, last_used) in list(self._entries.items()):
+            if warehouse_id not in self.pinned and last_used < deadline:
+                self._evict(warehouse_id)
+
+    async def run(self, interval: float) -> None:
+        """Evict idle warehouses every `interval` seconds, until cancelled."""
+        while True:
+            await asyncio.sleep(interval)
+            self.evict_idle()
+
+    def close(self) -> None:
+        for warehouse_id in list(self._entries):
+            self._evict(warehouse_id)
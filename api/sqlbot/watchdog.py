@@ -0,0 +1,159 @@
+"""Detection of blocking calls stalling the event loop."""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from contextvars import ContextVar
+from typing import Any, Optional
+
+from loguru import logger
+
+run_labels: ContextVar[Optional[dict[str, str]]] = ContextVar(
+    "run_labels", default=None
+)
+"""Labels of the run on behalf of which the current task works, reported along with stalls."""
+
+_task_labels: "weakref.WeakKeyDictionary[asyncio.Task, dict[str, str]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def set_labels(**labels: str) -> dict[str, str]:
+    """Label the current task, and the tasks it creates from now on, with `labels`.
+
+    The returned dict is shared by all of them, labels added to it later are reported too.
+    """
+    current = dict(labels)
+    run_labels.set(current)
+    if (task := asyncio.current_task()) is not None:
+        _task_labels[task] = current
+    return current
+
+
+def label_tasks(loop: asyncio.AbstractEventLoop) -> None:
+    """Make the tasks created on `loop` inherit the labels of the current context."""
+    if loop.get_task_factory() is None:
+        loop.set_task_factory(_task_factory)
+
+
+def task_labels(task: asyncio.Task) -> Optional[dict[str, str]]:
+    return _task_labels.get(task)
+
+
+def _task_factory(
+    loop: asyncio.AbstractEventLoop, coro: Any, context: Any = None
+) -> asyncio.Task:
+    task = asyncio.Task(coro, loop=loop, context=context)
+    labels = context.get(run_labels) if context is not None else run_labels.get()
+    if labels is not None:
+        _task_labels[task] = labels
+    return task
+
+
+class Stall:
+    def __init__(self, seconds: float, call_site: str, stack: str, labels: dict):
+        self.seconds = seconds
+        """How long the loop had been stalled when the stack was captured."""
+        self.call_site = call_site
+        self.stack = stack
+        self.labels = labels
+
+
+class LoopWatchdog:
+    """Reports the call sites blocking the event loop for more than `threshold` seconds.
+
+    A coroutine beats every `interval` seconds, a thread checks the beat. When the beat is late by more than
+    `threshold`, the thread captures the stack of the loop thread, that is of the blocking call, and logs it
+    along with the labels of the running task (see `set_labels`). The cost when nothing stalls is one wake up of
+    the loop and of the thread per `interval`.
+    """
+
+    def __init__(self, threshold: float = 0.5, interval: float = 0.1, keep: int = 100):
+        self.threshold = threshold
+        self.interval = interval
+        self.stalls: deque[Stall] = deque(maxlen=keep)
+        """The latest stalls."""
+        self.stall_count = 0
+        self.max_lag = 0.0
+        """Longest delay of a beat seen, in seconds."""
+        self._beat = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._heart: Optional[asyncio.Task] = None
+        self._stopped = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def start(self) -> None:
+        """Watch the running loop."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        label_tasks(self._loop)
+        self._beat = time.monotonic()
+        self._heart = asyncio.create_task(self._run_heart())
+        self._stopped.clear()
+        self._thread = threading.Thread(
+            target=self._watch, name="loop-watchdog", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._heart is not None:
+            self._heart.cancel()
+        if self._thread is not None:
+            self._thread.join()
+
+    async def _run_heart(self) -> None:
+        while True:
+            before = time.monotonic()
+            self._beat = before
+            await asyncio.sleep(self.interval)
+            lag = time.monotonic() - before - self.interval
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self) -> None:
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            late = time.monotonic() - beat - self.interval
+            if late > self.threshold and reported != beat:
+                # report each stall once
+                reported = beat
+                self._report(late)
+
+    def _report(self, late: float) -> None:
+        frame = sys._current_frames().get(self._loop_thread)
+        if frame is None:
+            return
+        summary = traceback.extract_stack(frame)
+        task = asyncio.current_task(self._loop)
+        labels = dict(_task_labels.get(task, {})) if task is not None else {}
+        stall = Stall(
+            seconds=late,
+            call_site=_call_site(summary),
+            stack="".join(summary.format()),
+            labels=labels,
+        )
+        self.stall_count += 1
+        self.stalls.append(stall)
+        logger.warning(
+            f"Event loop blocked for {late:.3f}s at {stall.call_site}, labels: {labels}\n{stall.stack}"
+        )
+
+    def stats(self) -> dict[str, float]:
+        return {"stalls": self.stall_count, "max_lag_seconds": self.max_lag}
+
+
+def _call_site(summary: traceback.StackSummary) -> str:
+    """The innermost frame of this package, or the innermost frame if none."""
+    frame = next(
+        (f for f in reversed(summary) if f.filename.startswith(_PACKAGE_DIR)),
+        summary[-1],
+    )
+    return f"{frame.filename}:{frame.lineno} in {frame.name}"
@@ -0,0 +1,47 @@
+"""Websocket helpers."""
+import asyncio
+from typing import Optional
+
+from fastapi import WebSocket
+from loguru import logger
+
+from sqlbot.metrics import WEBSOCKET_FRAMES_SENT
+
+
+class WebsocketWriter:
+    """The single writer of a websocket.
+
+    Frames are queued and sent one at a time by a writer task, so that frames of concurrent runs never interleave.
+    At most `max_queued` frames are queued, senders wait for room beyond that.
+    """
+
+    def __init__(self, websocket: WebSocket, max_queued: int = 1000):
+        self.websocket = websocket
+        self._queue: asyncio.Queue[str] = asyncio.Queue(maxsize=max_queued)
+        self._task: Optional[asyncio.Task] = None
+        self._error: Optional[Exception] = None
+
+    def start(self) -> None:
+        self._task = asyncio.create_task(self._write())
+
+    async def close(self) -> None:
+        """Stop writing, dropping the frames not sent yet."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+
+    async def send_text(self, data: str) -> None:
+        if self._error is not None:
+            raise self._error
+        await self._queue.put(data)
+
+    async def _write(self) -> None:
+        while True:
+            data = await self._queue.get()
+            try:
+                await self.websocket.send_text(data)
+            except Exception as e:
+                logger.warning(f"Failed to write to websocket: {e}")
+                self._error = e
+                return
+            WEBSOCKET_FRAMES_SENT.inc()
@@ -0,0 +1,160 @@
+import asyncio
+import json
+import unittest
+from typing import Any, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.llms.base import LLM
+from langchain.tools import Tool
+
+from sqlbot.agent.base import AppendThoughtAgent, CustomAgentExecutor
+from sqlbot.callbacks import StreamingFinalAnswerCallbackHandler
+
+
+class AsyncOnlyLLM(LLM):
+    """Streams its responses word by word, and refuses to be called synchronously."""
+
+    responses: list[str]
+    i: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "async-only"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        raise AssertionError("blocking call")
+
+    async def _acall(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        response = self.responses[self.i]
+        self.i += 1
+        for word in response.split(" "):
+            if run_manager:
+                await run_manager.on_llm_new_token(word)
+        return response
+
+
+class TokenCollector(AsyncCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens.append(token)
+
+
+class FrameCollector:
+    """Stands for the websocket, keeping the type and content of the frames sent."""
+
+    def __init__(self):
+        self.frames = []
+
+    async def send_text(self, data: str) -> None:
+        message = json.loads(data)
+        self.frames.append((message["type"], message.get("content")))
+
+
+class TestStoppedResponse(unittest.TestCase):
+    def _executor(self, llm: LLM, method: str) -> CustomAgentExecutor:
+        tools = [
+            Tool(
+                name="query_executor",
+                func=lambda query: "[(42,)]",
+                coroutine=lambda query: asyncio.sleep(0, "[(42,)]"),
+                description="runs a query",
+            )
+        ]
+        agent = AppendThoughtAgent.from_llm_and_tools(llm=llm, tools=tools)
+        return CustomAgentExecutor.from_agent_and_tools(
+            agent=agent,
+            tools=tools,
+            max_iterations=1,
+            early_stopping_method=method,
+        )
+
+    def _run(self, executor: CustomAgentExecutor, *callbacks: AsyncCallbackHandler):
+        return asyncio.run(
+            executor.acall(
+                {
+                    "date": "2023-12-01",
+                    "input": "how many?",
+                    "history": [],
+                    "top_k": 10,
+                    "dialect": "sqlite",
+                },
+                callbacks=list(callbacks),
+            )
+        )
+
+    def test_generate(self):
+        llm = AsyncOnlyLLM(
+            responses=[
+                json.dumps({"tool_name": "query_executor", "tool_input": "SELECT 42"}),
+                "There are 42.",
+            ]
+        )
+        collector = TokenCollector()
+        outputs = self._run(self._executor(llm, "generate"), collector)
+        self.assertEqual(outputs["output"], "There are 42.")
+        self.assertEqual(outputs["reason"], "early_stopped_generated")
+        self.assertEqual(collector.tokens[-3:], ["There", "are", "42."])
+
+    def test_generate_frames(self):
+        llm = AsyncOnlyLLM(
+            responses=[
+                json.dumps({"tool_name": "query_executor", "tool_input": "SELECT 42"}),
+                "Final Answer : There are 42.",
+            ]
+        )
+        websocket = FrameCollector()
+        handler = StreamingFinalAnswerCallbackHandler(websocket, "c1")
+        self._run(self._executor(llm, "generate"), handler)
+        # the answer is streamed, and not sent again once the agent finishes
+        self.assertEqual(
+            websocket.frames[-5:],
+            [
+                ("stream/start", None),
+                ("stream/text", "There"),
+                ("stream/text", "are"),
+                ("stream/text", "42."),
+                ("stream/end", None),
+            ],
+        )
+
+    def test_force_frames(self):
+        llm = AsyncOnlyLLM(
+            responses=[
+                json.dumps({"tool_name": "query_executor", "tool_input": "SELECT 42"})
+            ]
+        )
+        websocket = FrameCollector()
+        handler = StreamingFinalAnswerCallbackHandler(websocket, "c1")
+        self._run(self._executor(llm, "force"), handler)
+        self.assertEqual(
+            websocket.frames[-1],
+            ("text", "Agent stopped due to iteration limit or time limit."),
+        )
+
+    def test_force(self):
+        llm = AsyncOnlyLLM(
+            responses=[
+                json.dumps({"tool_name": "query_executor", "tool_input": "SELECT 42"})
+            ]
+        )
+        outputs = self._run(self._executor(llm, "force"), TokenCollector())
+        self.assertEqual(outputs["reason"], "early_stopped")
+        self.assertEqual(llm.i, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
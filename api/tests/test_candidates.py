@@ -0,0 +1,148 @@
+import asyncio
+import json
+import unittest
+from typing import Any, Optional
+
+from langchain.callbacks.base import AsyncCallbackHandler
+from langchain.chains import LLMChain
+from langchain.llms.base import LLM
+from langchain.prompts import PromptTemplate
+from langchain.schema import AgentAction, AgentFinish, LLMResult
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from sqlbot.agent.candidates import CandidateSampler
+from sqlbot.agent.output_parser import JsonOutputParser
+
+
+def action(tool: str, tool_input: str) -> str:
+    return json.dumps({"tool_name": tool, "tool_input": tool_input})
+
+
+class SeededLLM(LLM):
+    """Answers depending on the sampling seed, 0 being the greedy main plan."""
+
+    responses: dict[int, str]
+
+    @property
+    def _llm_type(self) -> str:
+        return "seeded"
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[list[str]] = None,
+        run_manager: Any = None,
+        **kwargs: Any,
+    ) -> str:
+        return self.responses[kwargs.get("seed", 0)]
+
+
+class TestCandidateSampler(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER, name TEXT)"))
+        self.sampler = CandidateSampler(SQLDatabase(engine), n=3)
+
+    def _plan(
+        self, responses: dict[int, str], callbacks: Optional[list] = None
+    ) -> AgentAction | AgentFinish:
+        chain = LLMChain(
+            llm=SeededLLM(responses=responses),
+            prompt=PromptTemplate.from_template("{input}"),
+        )
+        return asyncio.run(
+            self.sampler.aplan(
+                chain, JsonOutputParser(), {"input": "how many?"}, callbacks
+            )
+        )
+
+    def test_should_sample(self):
+        checked = AgentAction("query_checker", "SELECT 1", "")
+        failed = AgentAction("query_executor", "SELECT", "")
+        listed = AgentAction("list_tables_sql_db", "", "")
+        self.assertFalse(self.sampler.should_sample([]))
+        self.assertTrue(self.sampler.should_sample([(checked, "SELECT 1")]))
+        self.assertTrue(self.sampler.should_sample([(failed, "Error: syntax")]))
+        self.assertFalse(self.sampler.should_sample([(failed, "[(1,)]")]))
+        self.assertFalse(self.sampler.should_sample([(listed, "movies")]))
+
+    def test_pick_valid_alternative(self):
+        candidate = self._plan(
+            {
+                0: action("query_executor", "SELECT count(*) FROM movie"),
+                1: action("query_executor", "SELECT count(*) FROM film"),
+                2: action("query_executor", "SELECT count(*) FROM movies"),
+            }
+        )
+        self.assertEqual(candidate.tool_input, "SELECT count(*) FROM movies")
+        stats = self.sampler.stats()
+        self.assertEqual(stats["extra_calls"], 2)
+        self.assertEqual(stats["alternatives_picked"], 1)
+        # validations run in parallel, the ones still running when a candidate wins are cancelled
+        self.assertLessEqual(stats["invalid"], 2)
+
+    def test_keep_main(self):
+        candidate = self._plan(
+            {
+                0: action("query_executor", "SELECT id FROM movies"),
+                1: action("query_executor", "SELECT name FROM movie"),
+                2: action("query_executor", "SELECT name FROM film"),
+            }
+        )
+        self.assertEqual(candidate.tool_input, "SELECT id FROM movies")
+        # the main plan is not a query
+        candidate = self._plan(
+            {
+                0: action("table_schema_tool", "movies"),
+                1: action("query_executor", "SELECT name FROM movies"),
+                2: action("query_executor", "SELECT name FROM movies"),
+            }
+        )
+        self.assertEqual(candidate.tool, "table_schema_tool")
+        # no valid candidate
+        candidate = self._plan(
+            {
+                0: action("query_executor", "SELECT id FROM movie"),
+                1: action("query_executor", "SELECT name FROM movie"),
+                2: "I don't know",
+            }
+        )
+        self.assertEqual(candidate.tool_input, "SELECT id FROM movie")
+        self.assertEqual(self.sampler.stats()["alternatives_picked"], 0)
+
+    def test_stream_winner_only(self):
+        streamed = TokenCollector()
+        winner = action("query_executor", "SELECT count(*) FROM movies")
+        self._plan(
+            {
+                0: action("query_executor", "SELECT count(*) FROM movie"),
+                1: winner,
+                2: winner,
+            },
+            callbacks=[streamed],
+        )
+        self.assertEqual(streamed.outputs, [winner])
+        self.assertEqual("".join(streamed.tokens), winner)
+
+
+class TokenCollector(AsyncCallbackHandler):
+    def __init__(self):
+        self.tokens = []
+        self.outputs = []
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.tokens.append(token)
+
+    async def on_llm_end(self, response: LLMResult, **kwargs: Any) -> None:
+        self.outputs.append(response.generations[0][0].text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,26 @@
+import unittest
+
+from sqlbot.tools.column_stats import format_column_stats
+
+
+class TestFormatColumnStats(unittest.TestCase):
+    def test_format(self):
+        stats = {
+            "rows": 100,
+            "columns": {
+                "id": {"null_rate": 0.0, "distinct": 100, "min": 1, "max": 100},
+                "gender": {"null_rate": 0.25, "distinct": 2, "values": ["F", "M"]},
+                "year": {"null_rate": 0.0, "distinct": 2, "values": [2000, 2001]},
+            },
+        }
+        self.assertEqual(
+            format_column_stats(stats),
+            """Column stats (sampled 100 rows):
+id: 100 distinct; min 1, max 100
+gender: values ['F', 'M']; 25% null
+year: values [2000, 2001]""",
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from sqlbot.tools import CostGuard, QueryExecutorTool
+
+
+class TestCostGuard(unittest.TestCase):
+    def test_admitted(self):
+        guard = CostGuard(max_cost=1000, max_rows=100)
+        self.assertIsNone(guard.check(999, 100))
+
+    def test_rejected_cost(self):
+        guard = CostGuard(max_cost=1000)
+        rejection = guard.check(123456, 10**9)
+        self.assertTrue(rejection.startswith("Error:"))
+        self.assertIn("estimated cost is 123456", rejection)
+        self.assertNotIn("rows", rejection.split("Rewrite")[0])
+
+    def test_rejected_rows(self):
+        guard = CostGuard(max_rows=100)
+        rejection = guard.check(10, 1000)
+        self.assertIn("return 1000 rows", rejection)
+
+    def test_other_dialects_admitted(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER)"))
+            connection.execute(text("INSERT INTO movies VALUES (1)"))
+        tool = QueryExecutorTool(
+            db=SQLDatabase(engine), cost_guard=CostGuard(max_cost=1)
+        )
+        self.assertEqual(tool.run("SELECT * FROM movies"), "[(1,)]")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import asyncio
+import unittest
+
+import aiohttp
+
+from sqlbot.endpoints import EndpointPool
+
+
+class FakeClient:
+    def __init__(self, base_url: str, delay: float, fail: bool = False):
+        self.base_url = base_url
+        self.delay = delay
+        self.fail = fail
+        self.requests = 0
+        self.cancelled = False
+
+    async def generate(self, prompt: str, **kwargs):
+        self.requests += 1
+        if self.fail:
+            raise aiohttp.ClientConnectionError("connection refused")
+        return prompt
+
+    async def generate_stream(self, prompt: str, **kwargs):
+        self.requests += 1
+        try:
+            await asyncio.sleep(self.delay)
+            if self.fail:
+                raise aiohttp.ClientConnectionError("connection refused")
+            for token in prompt.split():
+                yield token
+        except asyncio.CancelledError:
+            self.cancelled = True
+            raise
+
+
+class TestEndpointPool(unittest.TestCase):
+    def _pool(self, delays: list[float], hedge_after=None, fail=()) -> EndpointPool:
+        pool = EndpointPool([f"http://llm-{i}" for i in range(len(delays))])
+        for i, (endpoint, delay) in enumerate(zip(pool.endpoints, delays)):
+            endpoint.client = FakeClient(endpoint.url, delay, fail=i in fail)
+        pool.hedge_after = hedge_after
+        return pool
+
+    def test_pick_fastest(self):
+        pool = self._pool([0, 0])
+        pool.endpoints[0].observe_ttft(1.0)
+        pool.endpoints[1].observe_ttft(0.1)
+        self.assertIs(pool.pick(), pool.endpoints[1])
+        # queue depth counts too
+        pool.endpoints[1].in_flight = 20
+        self.assertIs(pool.pick(), pool.endpoints[0])
+        # unhealthy endpoints are skipped
+        pool.endpoints[0].healthy = False
+        self.assertIs(pool.pick(), pool.endpoints[1])
+
+    def test_hedge(self):
+        async def run(pool: EndpointPool):
+            return [token async for token in pool.generate_stream("a b c")]
+
+        pool = self._pool([1.0, 0.0], hedge_after=0.01)
+        # the slow endpoint is picked first as it has no observations yet
+        pool.endpoints[1].ttft = 0.5
+        tokens = asyncio.run(run(pool))
+        self.assertEqual(tokens, ["a", "b", "c"])
+        self.assertEqual(pool.hedged, 1)
+        self.assertEqual(pool.hedges_won, 1)
+        self.assertTrue(pool.endpoints[0].client.cancelled)
+        self.assertEqual([e.in_flight for e in pool.endpoints], [0, 0])
+        self.assertIsNotNone(pool.endpoints[1].ttft)
+        self.assertLess(pool.endpoints[1].ttft, 0.5)
+
+    def test_no_hedge(self):
+        async def run(pool: EndpointPool):
+            return [token async for token in pool.generate_stream("a b")]
+
+        pool = self._pool([0.0, 0.0])
+        self.assertEqual(asyncio.run(run(pool)), ["a", "b"])
+        self.assertEqual(pool.hedged, 0)
+        self.assertEqual([e.in_flight for e in pool.endpoints], [0, 0])
+
+    def test_stream_failover(self):
+        async def run(pool: EndpointPool):
+            return [token async for token in pool.generate_stream("a b")]
+
+        # the primary fails before the hedge would be sent
+        pool = self._pool([0.0, 0.0], hedge_after=1.0, fail={0})
+        pool.endpoints[1].ttft = 0.5
+        self.assertEqual(asyncio.run(run(pool)), ["a", "b"])
+        self.assertEqual(pool.failovers, 1)
+        self.assertEqual(pool.hedged, 0)
+        self.assertFalse(pool.endpoints[0].healthy)
+        self.assertEqual([e.in_flight for e in pool.endpoints], [0, 0])
+
+    def test_generate_failover(self):
+        pool = self._pool([0.0, 0.0], fail={0})
+        pool.endpoints[1].ttft = 0.5
+        self.assertEqual(asyncio.run(pool.generate("a")), "a")
+        self.assertEqual(pool.failovers, 1)
+        # no healthy endpoint left to retry on
+        pool = self._pool([0.0, 0.0], fail={0, 1})
+        pool.endpoints[1].healthy = False
+        with self.assertRaises(aiohttp.ClientError):
+            asyncio.run(pool.generate("a"))
+        self.assertEqual(pool.endpoints[1].client.requests, 0)
+
+    def test_no_hedge_to_unhealthy(self):
+        async def run(pool: EndpointPool):
+            return [token async for token in pool.generate_stream("a")]
+
+        pool = self._pool([0.05, 0.0], hedge_after=0.01)
+        pool.endpoints[1].healthy = False
+        self.assertEqual(asyncio.run(run(pool)), ["a"])
+        self.assertEqual(pool.hedged, 0)
+        self.assertEqual(pool.endpoints[1].client.requests, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
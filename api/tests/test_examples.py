@@ -0,0 +1,37 @@
+import unittest
+
+from sqlbot.agent.examples import ExampleStore
+
+
+class TestExampleStore(unittest.TestCase):
+    def test_search(self):
+        store = ExampleStore()
+        store.add("How many movies are there?", "SELECT COUNT(*) FROM movies")
+        store.add("List all actors", "SELECT * FROM actors")
+        examples = store.search("how many movies were released in 2002?", k=1)
+        self.assertEqual(len(examples), 1)
+        self.assertEqual(examples[0].sql, "SELECT COUNT(*) FROM movies")
+
+    def test_search_no_match(self):
+        store = ExampleStore()
+        store.add("How many movies are there?", "SELECT COUNT(*) FROM movies")
+        self.assertListEqual(store.search("list directors"), [])
+
+    def test_replace_same_question(self):
+        store = ExampleStore()
+        store.add("How many movies are there?", "SELECT 1")
+        store.add("how many movies are there", "SELECT COUNT(*) FROM movies")
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.search("movies")[0].sql, "SELECT COUNT(*) FROM movies")
+
+    def test_evict_oldest(self):
+        store = ExampleStore(max_size=2)
+        store.add("count movies", "SELECT COUNT(*) FROM movies")
+        store.add("count actors", "SELECT COUNT(*) FROM actors")
+        store.add("count directors", "SELECT COUNT(*) FROM directors")
+        self.assertEqual(len(store), 2)
+        self.assertListEqual(store.search("movies"), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from sqlbot.exports import export_query, stream_query
+
+
+async def collect(iterator) -> list:
+    return [item async for item in iterator]
+
+
+async def export(*args) -> tuple[str, str]:
+    media_type, content = await export_query(*args)
+    return media_type, "".join(await collect(content))
+
+
+class TestExports(unittest.TestCase):
+    def setUp(self):
+        # the query runs in a worker thread, share the in-memory database
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER, name TEXT)"))
+            connection.execute(
+                text("INSERT INTO movies VALUES (1, 'foo'), (2, 'bar, baz'), (3, NULL)")
+            )
+        self.db = SQLDatabase(engine)
+
+    def test_stream_query(self):
+        chunks = asyncio.run(
+            collect(stream_query(self.db, "SELECT * FROM movies", chunk_size=2))
+        )
+        self.assertEqual(chunks[0], ["id", "name"])
+        self.assertEqual([len(chunk) for chunk in chunks[1:]], [2, 1])
+
+    def test_csv(self):
+        media_type, content = asyncio.run(
+            export(self.db, "SELECT * FROM movies", "csv")
+        )
+        self.assertEqual(media_type, "text/csv")
+        self.assertEqual(
+            content,
+            'id,name\r\n1,foo\r\n2,"bar, baz"\r\n3,\r\n',
+        )
+
+    def test_ndjson(self):
+        _, content = asyncio.run(export(self.db, "SELECT * FROM movies", "ndjson"))
+        self.assertEqual(
+            content,
+            '{"id": 1, "name": "foo"}\n{"id": 2, "name": "bar, baz"}\n{"id": 3, "name": null}\n',
+        )
+
+    def test_early_close(self):
+        async def first_chunk():
+            chunks = stream_query(self.db, "SELECT * FROM movies", chunk_size=1)
+            async for chunk in chunks:
+                break
+            await chunks.aclose()
+            return chunk
+
+        self.assertEqual(asyncio.run(first_chunk()), ["id", "name"])
+
+    def test_error(self):
+        with self.assertRaises(Exception):
+            asyncio.run(collect(stream_query(self.db, "SELECT * FROM missing")))
+
+    def test_error_before_content(self):
+        with self.assertRaises(Exception):
+            asyncio.run(export_query(self.db, "SELECT * FROM missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
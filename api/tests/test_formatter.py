@@ -0,0 +1,51 @@
+import unittest
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlbot.tools.formatter import ResultFormatter
+
+
+class TestResultFormatter(unittest.TestCase):
+    def test_format_numbers(self):
+        formatter = ResultFormatter(float_precision=2)
+        self.assertEqual(formatter.format_value(6.400000095367432), "6.4")
+        self.assertEqual(formatter.format_value(Decimal("12.346")), "12.35")
+        self.assertEqual(formatter.format_value(2.0), "2")
+        self.assertEqual(formatter.format_value(42), "42")
+        self.assertEqual(formatter.format_value(0.0), "0")
+
+    def test_format_small_numbers(self):
+        formatter = ResultFormatter(float_precision=4)
+        self.assertEqual(formatter.format_value(0.00001), "1e-05")
+        self.assertEqual(formatter.format_value(-1.25e-7), "-1.25e-07")
+        self.assertEqual(formatter.format_value(Decimal("0.00002")), "2e-5")
+        self.assertEqual(formatter.format_value(0.00012), "0.0001")
+
+    def test_format_small_numbers_no_decimals(self):
+        formatter = ResultFormatter(float_precision=0)
+        self.assertEqual(formatter.format_value(0.0003), "3e-04")
+        self.assertEqual(formatter.format_value(-0.4), "-4e-01")
+        self.assertEqual(formatter.format_value(2.4), "2")
+
+    def test_format_dates(self):
+        formatter = ResultFormatter()
+        self.assertEqual(formatter.format_value(date(2024, 1, 2)), "2024-01-02")
+        self.assertEqual(
+            formatter.format_value(datetime(2024, 1, 2, 3, 4, 5)),
+            "2024-01-02 03:04:05",
+        )
+
+    def test_format_strings(self):
+        formatter = ResultFormatter(max_value_length=10)
+        self.assertEqual(formatter.format_value("a|b\nc"), "a\\|b\\nc")
+        self.assertEqual(formatter.format_value("abcdefghijklmn"), "abcdefg...")
+        self.assertEqual(formatter.format_value(None), "NULL")
+
+    def test_format_row(self):
+        formatter = ResultFormatter()
+        self.assertEqual(formatter.format_header(["id", "name"]), "id|name")
+        self.assertEqual(formatter.format_row([1, None]), "1|NULL")
+
+
+if __name__ == "__main__":
+    unittest.main()
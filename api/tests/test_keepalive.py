@@ -0,0 +1,73 @@
+import asyncio
+import json
+import unittest
+
+from aiohttp import web
+
+from sqlbot.endpoints import ConnectionStats, KeepAliveClient, create_session
+
+
+async def generate(request: web.Request) -> web.StreamResponse:
+    body = await request.json()
+    tokens = body["inputs"].split()
+    if not body["stream"]:
+        return web.json_response(
+            [
+                {
+                    "generated_text": " ".join(tokens),
+                    "details": {
+                        "finish_reason": "length",
+                        "generated_tokens": len(tokens),
+                        "prefill": [],
+                        "tokens": [],
+                    },
+                }
+            ]
+        )
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for i, token in enumerate(tokens):
+        event = {
+            "token": {"id": i, "text": token, "logprob": 0.0, "special": False},
+            "generated_text": None,
+            "details": None,
+        }
+        await response.write(f"data:{json.dumps(event)}\n\n".encode())
+    await response.write_eof()
+    return response
+
+
+class TestKeepAliveClient(unittest.TestCase):
+    def test_reuse(self):
+        async def run():
+            app = web.Application()
+            app.router.add_post("/", generate)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, "127.0.0.1", 0)
+            await site.start()
+            port = site._server.sockets[0].getsockname()[1]
+            stats = ConnectionStats()
+            session = create_session(stats=stats)
+            try:
+                client = KeepAliveClient(f"http://127.0.0.1:{port}", session)
+                tokens = [
+                    response.token.text
+                    async for response in client.generate_stream("a b c")
+                ]
+                response = await client.generate("d e", max_new_tokens=5)
+                return tokens, response.generated_text, stats.stats()
+            finally:
+                await session.close()
+                await runner.cleanup()
+
+        tokens, text, stats = asyncio.run(run())
+        self.assertEqual(tokens, ["a", "b", "c"])
+        self.assertEqual(text, "d e")
+        self.assertEqual(stats["created"], 1)
+        self.assertEqual(stats["reused"], 1)
+        self.assertEqual(stats["reuse_rate"], 0.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,67 @@
+import asyncio
+import unittest
+from uuid import uuid4
+
+from langchain.schema.output import LLMResult
+from loguru import logger
+
+from sqlbot.callbacks import TracingLLMCallbackHandler
+
+
+class TestTracingLLMCallbackHandler(unittest.TestCase):
+    def setUp(self):
+        self.records = []
+        self.sink = logger.add(
+            lambda message: self.records.append(message.record), level="TRACE"
+        )
+
+    def tearDown(self):
+        logger.remove(self.sink)
+
+    def call(self, handler, tokens=("a", "b")):
+        async def run():
+            run_id = uuid4()
+            await handler.on_llm_start({}, ["prompt"], run_id=run_id)
+            for token in tokens:
+                await handler.on_llm_new_token(token, run_id=run_id)
+            await handler.on_llm_end(LLMResult(generations=[]), run_id=run_id)
+
+        asyncio.run(run())
+        return [(r["level"].name, r["message"].split(" ")[0]) for r in self.records]
+
+    def test_disabled_below_debug(self):
+        handler = TracingLLMCallbackHandler(level="INFO")
+        self.assertFalse(handler.enabled)
+        self.assertEqual(self.call(handler), [])
+
+    def test_debug(self):
+        handler = TracingLLMCallbackHandler(level="DEBUG")
+        self.assertTrue(handler.enabled)
+        self.assertEqual(
+            self.call(handler),
+            [("DEBUG", "on_llm_start"), ("DEBUG", "on_llm_end")],
+        )
+
+    def test_trace_logs_tokens(self):
+        handler = TracingLLMCallbackHandler(level="TRACE")
+        self.assertEqual(
+            [name for _, name in self.call(handler)],
+            ["on_llm_start", "on_llm_new_token", "on_llm_new_token", "on_llm_end"],
+        )
+
+    def test_sampled_prompts(self):
+        handler = TracingLLMCallbackHandler(level="WARNING", prompt_sample_rate=1.0)
+        self.assertTrue(handler.enabled)
+        self.assertEqual(
+            self.call(handler),
+            # at the level of the sink, which drops INFO
+            [("WARNING", "on_llm_start"), ("WARNING", "on_llm_end")],
+        )
+        self.assertEqual(handler._sampled, set())
+
+    def test_sampled_prompts_at_info(self):
+        handler = TracingLLMCallbackHandler(level="INFO", prompt_sample_rate=1.0)
+        self.assertEqual(
+            self.call(handler),
+            [("INFO", "on_llm_start"), ("INFO", "on_llm_end")],
+        )
@@ -0,0 +1,39 @@
+import asyncio
+import unittest
+
+from langchain.llms.fake import FakeListLLM
+
+from sqlbot.llms import LLMRouter
+
+
+class TestLLMRouter(unittest.TestCase):
+    def test_routes(self):
+        main = FakeListLLM(responses=["main"])
+        coder = FakeListLLM(responses=["coder"])
+        router = LLMRouter({"main": main, "coder": coder}, routes={"checker": "coder"})
+
+        self.assertEqual(router.get("checker").predict("SELECT 1"), "coder")
+        self.assertEqual(router.get("agent").predict("hi"), "main")
+        self.assertIs(router.get("checker"), router.get("checker"))
+        # the original LLMs are left untouched
+        self.assertIsNone(coder.callbacks)
+
+    def test_latency(self):
+        router = LLMRouter(
+            {"main": FakeListLLM(responses=["a", "b"])}, routes={"checker": "coder"}
+        )
+
+        async def run():
+            await router.get("agent").apredict("hi")
+            await router.get("agent").apredict("hi")
+
+        asyncio.run(run())
+        stats = router.stats()
+        self.assertEqual(list(stats), ["agent"])
+        self.assertEqual(stats["agent"]["requests"], 2)
+        self.assertEqual(stats["agent"]["errors"], 0)
+        self.assertGreaterEqual(stats["agent"]["max_seconds"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
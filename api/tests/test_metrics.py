@@ -0,0 +1,102 @@
+import asyncio
+import unittest
+from uuid import uuid4
+
+from langchain.schema import AgentAction
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+from sqlalchemy import create_engine, text
+
+from sqlbot.callbacks import MetricsCallbackHandler
+from sqlbot.metrics import (
+    StatsCollector,
+    instrument_engine,
+    register_stats,
+    unregister_stats,
+)
+
+
+def sample(name: str, labels: dict = None) -> float:
+    return REGISTRY.get_sample_value(name, labels or {}) or 0.0
+
+
+class TestMetrics(unittest.TestCase):
+    def test_stats_collector(self):
+        registry = CollectorRegistry()
+        registry.register(
+            StatsCollector(
+                "cache",
+                lambda: {"hits": 3, "size": 2, "name": "x"},
+                counters=["hits"],
+            )
+        )
+        registry.register(
+            StatsCollector(
+                "endpoint",
+                lambda: {"http://a": {"ttft": 0.5, "healthy": True}},
+                label="endpoint",
+            )
+        )
+        exposition = generate_latest(registry).decode()
+        self.assertIn("# TYPE sqlbot_cache_hits_total counter", exposition)
+        self.assertIn("sqlbot_cache_hits_total 3.0", exposition)
+        self.assertIn("# TYPE sqlbot_cache_size gauge", exposition)
+        self.assertNotIn("sqlbot_cache_name", exposition)
+        self.assertIn('sqlbot_endpoint_ttft{endpoint="http://a"} 0.5', exposition)
+        self.assertIn('sqlbot_endpoint_healthy{endpoint="http://a"} 1.0', exposition)
+
+    def test_register_stats_twice(self):
+        # e.g. the app started again in the same process
+        register_stats("restarted", lambda: {"hits": 1})
+        register_stats("restarted", lambda: {"hits": 2})
+        self.assertEqual(sample("sqlbot_restarted_hits"), 2)
+        unregister_stats()
+        self.assertIsNone(REGISTRY.get_sample_value("sqlbot_restarted_hits"))
+
+    def test_instrument_engine(self):
+        engine = create_engine("sqlite://")
+        instrument_engine(engine, "test")
+        labels = {"warehouse": "test"}
+        before = sample("sqlbot_warehouse_query_seconds_count", labels)
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+            with self.assertRaises(Exception):
+                connection.execute(text("SELECT * FROM nope"))
+            connection.execute(text("SELECT 2"))
+        self.assertEqual(
+            sample("sqlbot_warehouse_query_seconds_count", labels) - before, 2
+        )
+
+    def test_callback_handler(self):
+        handler = MetricsCallbackHandler()
+        chain_id, tool_id = uuid4(), uuid4()
+        action = AgentAction("query_executor", "SELECT 1", "")
+        tool_labels = {"tool": "query_executor"}
+        iterations = sample("sqlbot_agent_iterations_sum")
+        tools = sample("sqlbot_tool_duration_seconds_count", tool_labels)
+        errors = sample("sqlbot_tool_errors_total", tool_labels)
+
+        async def run():
+            await handler.on_chain_start({}, {}, run_id=chain_id)
+            for _ in range(2):
+                await handler.on_agent_action(action, run_id=chain_id)
+                await handler.on_tool_start(
+                    {"name": "query_executor"},
+                    "SELECT 1",
+                    run_id=tool_id,
+                    parent_run_id=chain_id,
+                )
+                await handler.on_tool_error(
+                    ValueError(), run_id=tool_id, parent_run_id=chain_id
+                )
+            await handler.on_chain_end({}, run_id=chain_id)
+
+        asyncio.run(run())
+        self.assertEqual(sample("sqlbot_agent_iterations_sum") - iterations, 2)
+        self.assertEqual(
+            sample("sqlbot_tool_duration_seconds_count", tool_labels) - tools, 2
+        )
+        self.assertEqual(sample("sqlbot_tool_errors_total", tool_labels) - errors, 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
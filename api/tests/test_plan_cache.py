@@ -0,0 +1,86 @@
+import unittest
+from datetime import date
+
+from sqlbot.agent.plan_cache import (
+    normalize_question,
+    parameterize_query,
+    relative_unit,
+    render_query,
+)
+
+
+class TestPlanCacheKey(unittest.TestCase):
+    def test_normalize_question(self):
+        normalized, dates = normalize_question("How many movies   were released?")
+        self.assertEqual(normalized, "how many movies were released")
+        self.assertListEqual(dates, [])
+
+    def test_normalize_question_with_dates(self):
+        normalized, dates = normalize_question(
+            "Orders between 2024-01-01 and 2024-02-01"
+        )
+        self.assertEqual(normalized, "orders between {date0} and {date1}")
+        self.assertListEqual(dates, ["2024-01-01", "2024-02-01"])
+
+
+class TestPlanCacheQuery(unittest.TestCase):
+    def test_parameterize_query(self):
+        query = "SELECT * FROM orders WHERE day >= '2024-01-01' AND day < '2024-03-08'"
+        template = parameterize_query(query, ["2024-01-01"], date(2024, 3, 15), "day")
+        self.assertEqual(
+            template,
+            "SELECT * FROM orders WHERE day >= '{date0}' AND day < '{today-7}'",
+        )
+
+    def test_parameterize_query_absolute(self):
+        # "How many movies were released in 2002?" must not drift with the day of the run
+        query = "SELECT count(*) FROM movies WHERE released BETWEEN '2002-01-01' AND '2002-12-31'"
+        template = parameterize_query(query, [], date(2024, 3, 15), None)
+        self.assertEqual(template, query)
+
+    def test_parameterize_query_periods(self):
+        query = "SELECT * FROM orders WHERE day BETWEEN '2024-02-01' AND '2024-02-29'"
+        template = parameterize_query(query, [], date(2024, 3, 15), "month")
+        self.assertEqual(
+            template,
+            "SELECT * FROM orders WHERE day BETWEEN '{month-1}' AND '{month-1:end}'",
+        )
+        self.assertEqual(
+            render_query(template, [], date(2024, 5, 2)),
+            "SELECT * FROM orders WHERE day BETWEEN '2024-04-01' AND '2024-04-30'",
+        )
+        query = "SELECT * FROM orders WHERE day >= '2023-01-01' AND day < '2024-01-01'"
+        template = parameterize_query(query, [], date(2024, 3, 15), "year")
+        self.assertEqual(
+            render_query(template, [], date(2025, 1, 10)),
+            "SELECT * FROM orders WHERE day >= '2024-01-01' AND day < '2025-01-01'",
+        )
+
+    def test_parameterize_query_unaligned(self):
+        query = "SELECT * FROM orders WHERE day >= '2024-02-15'"
+        self.assertIsNone(parameterize_query(query, [], date(2024, 3, 15), "month"))
+        self.assertIsNone(parameterize_query(query, [], date(2024, 3, 15), "mixed"))
+
+    def test_relative_unit(self):
+        self.assertIsNone(relative_unit("How many movies were released in 2002?"))
+        self.assertEqual(relative_unit("Orders of last month"), "month")
+        self.assertEqual(relative_unit("Orders of the past 7 days"), "day")
+        self.assertEqual(relative_unit("Orders since yesterday"), "day")
+        self.assertEqual(relative_unit("Orders 2 weeks ago"), "week")
+        self.assertEqual(relative_unit("Revenue year to date"), "year")
+        self.assertEqual(relative_unit("Orders of last year by last month"), "mixed")
+
+    def test_render_query(self):
+        template = "SELECT * FROM orders WHERE day >= '{date0}' AND day < '{today-7}'"
+        query = render_query(template, ["2023-01-01"], date(2024, 4, 1))
+        self.assertEqual(
+            query,
+            "SELECT * FROM orders WHERE day >= '2023-01-01' AND day < '2024-03-25'",
+        )
+
+    def test_render_query_missing_date(self):
+        self.assertIsNone(render_query("SELECT '{date0}'", [], date(2024, 4, 1)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+
+from sqlbot.agent.prefetch import match_tables
+
+
+class TestMatchTables(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER, title TEXT)"))
+            connection.execute(text("CREATE TABLE actors (id INTEGER, name TEXT)"))
+            connection.execute(
+                text("CREATE TABLE directors (id INTEGER, name TEXT, birth_year INT)")
+            )
+        self.db = SQLDatabase(engine)
+
+    def test_table_name(self):
+        self.assertEqual(
+            match_tables(self.db, "How many movies are there?"), ["movies"]
+        )
+
+    def test_column_name(self):
+        self.assertEqual(
+            match_tables(self.db, "Who was born in the earliest birth year?"),
+            ["directors"],
+        )
+
+    def test_generic_columns(self):
+        # `name` is a column of two tables, it is not enough to match
+        self.assertEqual(match_tables(self.db, "Give me a name"), [])
+
+    def test_max_tables(self):
+        tables = match_tables(self.db, "actors and directors of movies", max_tables=2)
+        self.assertEqual(len(tables), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,64 @@
+import asyncio
+import time
+import unittest
+
+from sqlbot.profiler import RunProfiler
+from sqlbot.watchdog import set_labels
+
+
+def busy(seconds: float) -> None:
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+async def wait_for_llm() -> None:
+    await asyncio.sleep(0.1)
+
+
+async def unrelated() -> None:
+    busy(0.1)
+
+
+class TestRunProfiler(unittest.TestCase):
+    def test_profile_run(self):
+        async def child():
+            await wait_for_llm()
+            busy(0.1)
+
+        async def run():
+            labels = set_labels(conversation="c1")
+            profiler = RunProfiler(labels, interval=0.002)
+            profiler.start()
+            try:
+                await asyncio.create_task(child())
+            finally:
+                profiler.stop()
+            return profiler
+
+        async def main():
+            other = asyncio.create_task(unrelated())
+            profiler = await asyncio.create_task(run())
+            await other
+            return profiler
+
+        profiler = asyncio.run(main())
+        profile = profiler.to_speedscope("c1")
+        frames = [frame["name"] for frame in profile["shared"]["frames"]]
+        samples = profile["profiles"][0]["samples"]
+        weights = profile["profiles"][0]["weights"]
+        self.assertEqual(len(samples), len(weights))
+
+        def seconds(root: str, function: str) -> float:
+            return sum(
+                weight
+                for sample, weight in zip(samples, weights)
+                if frames[sample[0]] == root
+                and function in (frames[frame] for frame in sample)
+            )
+
+        self.assertGreater(seconds("[waiting]", "wait_for_llm"), 0.05)
+        self.assertGreater(seconds("[running]", "busy"), 0.05)
+        # other tasks running on the loop are not attributed to the run
+        self.assertNotIn("unrelated", frames)
+        self.assertAlmostEqual(profile["profiles"][0]["endValue"], 0.2, delta=0.1)
@@ -0,0 +1,95 @@
+import asyncio
+import time
+import unittest
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from sqlbot.tools import QueryExecutorTool
+from sqlbot.tools.formatter import ResultFormatter
+from sqlbot.tools.summary import ResultSummarizer
+
+
+class TestQueryExecutorTool(unittest.TestCase):
+    def setUp(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER, name TEXT)"))
+            connection.execute(
+                text("INSERT INTO movies VALUES (1, 'foo'), (2, 'bar'), (3, 'baz')")
+            )
+        self.db = SQLDatabase(engine)
+
+    def test_all_rows(self):
+        tool = QueryExecutorTool(db=self.db)
+        self.assertEqual(
+            tool.run("SELECT * FROM movies"), self.db.run("SELECT * FROM movies")
+        )
+
+    def test_max_rows(self):
+        tool = QueryExecutorTool(db=self.db, max_rows=2)
+        observation = tool.run("SELECT * FROM movies")
+        self.assertTrue(observation.startswith("[(1, 'foo'), (2, 'bar')]\n"))
+        self.assertIn("1 more rows omitted", observation)
+
+    def test_max_bytes(self):
+        tool = QueryExecutorTool(db=self.db, max_bytes=20)
+        observation = tool.run("SELECT * FROM movies")
+        self.assertTrue(observation.startswith("[(1, 'foo')]\n"))
+        self.assertIn("2 more rows omitted", observation)
+
+    def test_compact_format(self):
+        tool = QueryExecutorTool(db=self.db, max_rows=2, formatter=ResultFormatter())
+        observation = tool.run("SELECT * FROM movies")
+        self.assertTrue(observation.startswith("id|name\n1|foo\n2|bar\n"))
+        self.assertIn("1 more rows omitted", observation)
+
+    def test_summary(self):
+        tool = QueryExecutorTool(
+            db=self.db,
+            max_rows=2,
+            formatter=ResultFormatter(),
+            summarizer=ResultSummarizer(),
+            summary_sample_rows=1,
+        )
+        observation = tool.run("SELECT * FROM movies")
+        self.assertTrue(observation.startswith("Summary of 3 rows:\nid: 3 non-null"))
+        self.assertTrue(observation.endswith("Sample rows:\nid|name\n1|foo"))
+
+    def test_empty_result(self):
+        tool = QueryExecutorTool(db=self.db)
+        self.assertEqual(tool.run("SELECT * FROM movies WHERE id > 3"), "")
+
+    def test_error(self):
+        tool = QueryExecutorTool(db=self.db)
+        self.assertTrue(tool.run("SELECT * FROM foo").startswith("Error:"))
+
+
+class TestQueryExecutorCancellation(unittest.TestCase):
+    def test_cancel(self):
+        # the query runs in a worker thread
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        tool = QueryExecutorTool(db=SQLDatabase(engine))
+        slow = """WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 1000000000)
+SELECT count(*) FROM c"""
+
+        async def cancel():
+            run = asyncio.create_task(tool.arun(slow))
+            await asyncio.sleep(0.2)
+            run.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await run
+
+        start = time.perf_counter()
+        # also waits for the worker thread
+        asyncio.run(cancel())
+        self.assertLess(time.perf_counter() - start, 5)
+
+
+if __name__ == "__main__":
+    unittest.main()
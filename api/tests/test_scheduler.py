@@ -0,0 +1,101 @@
+import asyncio
+import unittest
+
+from prometheus_client import REGISTRY
+
+from sqlbot.scheduler import LLMScheduler, current_user, queue_listener
+
+
+class TestLLMScheduler(unittest.TestCase):
+    def test_fair_queuing(self):
+        order = []
+
+        async def request(scheduler: LLMScheduler, user: str, i: int):
+            current_user.set(user)
+            async with scheduler.slot():
+                order.append(f"{user}{i}")
+                await asyncio.sleep(0.01)
+
+        async def run():
+            scheduler = LLMScheduler(max_concurrency=1)
+            # user a floods the queue before user b shows up
+            requests = [
+                asyncio.create_task(request(scheduler, "a", i)) for i in range(4)
+            ]
+            await asyncio.sleep(0)
+            requests.append(asyncio.create_task(request(scheduler, "b", 0)))
+            await asyncio.gather(*requests)
+            return scheduler
+
+        scheduler = asyncio.run(run())
+        self.assertEqual(order[:3], ["a0", "a1", "b0"])
+        self.assertEqual(scheduler.stats()["requests"], 5)
+        self.assertEqual(scheduler.running, 0)
+
+    def test_queue_wait_histogram(self):
+        labels = {"role": "check"}
+
+        def count() -> float:
+            return (
+                REGISTRY.get_sample_value("sqlbot_llm_queue_wait_seconds_count", labels)
+                or 0.0
+            )
+
+        async def run():
+            scheduler = LLMScheduler(max_concurrency=1)
+            for _ in range(2):
+                async with scheduler.slot("check"):
+                    pass
+
+        before = count()
+        asyncio.run(run())
+        self.assertEqual(count() - before, 2)
+
+    def test_queue_position(self):
+        positions = []
+
+        async def listener(position: int):
+            positions.append(position)
+
+        async def request(scheduler: LLMScheduler, duration: float):
+            async with scheduler.slot():
+                await asyncio.sleep(duration)
+
+        async def run():
+            scheduler = LLMScheduler(max_concurrency=1)
+            first = asyncio.create_task(request(scheduler, 0.05))
+            second = asyncio.create_task(request(scheduler, 0.05))
+            await asyncio.sleep(0)
+            queue_listener.set(listener)
+            third = asyncio.create_task(request(scheduler, 0))
+            await asyncio.gather(first, second, third)
+
+        asyncio.run(run())
+        self.assertEqual(positions, [1, 0])
+
+    def test_cancel_waiting(self):
+        async def run():
+            scheduler = LLMScheduler(max_concurrency=1)
+            release = asyncio.Event()
+
+            async def hold():
+                async with scheduler.slot():
+                    await release.wait()
+
+            holder = asyncio.create_task(hold())
+            await asyncio.sleep(0)
+            waiting = asyncio.create_task(hold())
+            await asyncio.sleep(0)
+            self.assertEqual(scheduler.waiting, 1)
+            waiting.cancel()
+            await asyncio.gather(waiting, return_exceptions=True)
+            self.assertEqual(scheduler.waiting, 0)
+            release.set()
+            await holder
+            self.assertEqual(scheduler.running, 0)
+
+        asyncio.run(run())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -161,6 +161,25 @@ class TestIntermediateSteps(unittest.TestCase):
             '[[{"tool":"some_tool","tool_input":"some_input","log":"some log","type":"AgentAction"},"baz"]]',
         )
 
+    def test_last_query(self):
+        steps = IntermediateSteps.model_validate(
+            [
+                (
+                    AgentAction(tool="query_executor", tool_input="SELECT 1", log=""),
+                    "[(1,)]",
+                ),
+                (
+                    AgentAction(tool="query_executor", tool_input="SELEC 2", log=""),
+                    "Error: syntax error",
+                ),
+                (
+                    AgentAction(tool="table_schema_tool", tool_input="foo", log=""),
+                    "CREATE TABLE foo ()",
+                ),
+            ]
+        )
+        self.assertEqual(steps.last_query(), "SELECT 1")
+
 
 class TestConversationSchema(unittest.TestCase):
     def test_create_conversation(self):
@@ -0,0 +1,53 @@
+import unittest
+
+from sqlbot.tools.summary import ResultSummarizer
+
+
+class TestResultSummarizer(unittest.TestCase):
+    def test_summarize(self):
+        rows = [(i, "odd" if i % 2 else "even", None) for i in range(1, 101)]
+        summary = ResultSummarizer(chunk_size=30, seed=0).summarize(
+            ["id", "parity", "empty"], rows
+        )
+        lines = summary.splitlines()
+        self.assertEqual(lines[0], "Summary of 100 rows:")
+        self.assertTrue(
+            lines[1].startswith(
+                "id: 100 non-null; 100 distinct; min 1, max 100; mean 50.5; p25 25.75, p50 50.5, p75 75.25"
+            )
+        )
+        self.assertEqual(
+            lines[2],
+            "parity: 100 non-null; 2 distinct; min even, max odd; top even (50%), odd (50%)",
+        )
+        self.assertEqual(lines[3], "empty: 0 non-null")
+
+    def test_max_rows(self):
+        rows = ((i,) for i in range(1000))
+        summary = ResultSummarizer(chunk_size=30, max_rows=100).summarize(["id"], rows)
+        self.assertTrue(summary.startswith("Summary of the first 100 rows"))
+        self.assertIn("max 99", summary)
+        self.assertNotIn("max 99.0", summary)
+
+    def test_integers(self):
+        rows = [(i % 3, i % 3 + 0.5) for i in range(10)]
+        summary = ResultSummarizer().summarize(["int", "float"], rows)
+        self.assertIn("int: 10 non-null; 3 distinct; min 0, max 2;", summary)
+        self.assertIn("top 0 (40%), 1 (30%), 2 (30%)", summary)
+        self.assertIn("float: 10 non-null; 3 distinct; min 0.5, max 2.5;", summary)
+
+    def test_mixed_types(self):
+        # e.g. SQLite, where a column holds numbers in some rows and strings in others
+        rows = [(1,), (2,), ("a",), ("b",)]
+        summary = ResultSummarizer(chunk_size=2).summarize(["mixed"], rows)
+        self.assertIn("mixed: 4 non-null; 4 distinct", summary)
+        self.assertNotIn("min", summary)
+
+    def test_max_tracked(self):
+        rows = [(str(i),) for i in range(100)]
+        summary = ResultSummarizer(max_tracked=10).summarize(["id"], rows)
+        self.assertIn("10+ distinct", summary)
+
+
+if __name__ == "__main__":
+    unittest.main()
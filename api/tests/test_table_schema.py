@@ -0,0 +1,101 @@
+import asyncio
+import threading
+import unittest
+
+from langchain.sql_database import SQLDatabase
+from sqlalchemy import create_engine, text
+from sqlalchemy.pool import StaticPool
+
+from sqlbot.tools import TableSchemaTool
+from sqlbot.tools.schema_cache import SchemaCache
+from sqlbot.tracing import Trace, current_trace, trace_engine
+
+
+class SlowSchemaCache(SchemaCache):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.release = threading.Event()
+
+    def _load(self, table: str) -> str:
+        if table == "slow":
+            self.release.wait(5)
+        return super()._load(table)
+
+
+class TestTableSchemaTool(unittest.TestCase):
+    def setUp(self):
+        # tables are fetched in worker threads, share the in-memory database
+        engine = create_engine(
+            "sqlite://",
+            connect_args={"check_same_thread": False},
+            poolclass=StaticPool,
+        )
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER, name TEXT)"))
+            connection.execute(text("CREATE TABLE slow (id INTEGER)"))
+        self.engine = engine
+        self.db = SQLDatabase(engine)
+        self.cache = SlowSchemaCache(self.db, ttl=60)
+        self.tool = TableSchemaTool(
+            db=self.db,
+            redis_url="redis://localhost:1",
+            table_timeout=0.2,
+            schema_cache=self.cache,
+        )
+
+    def tearDown(self):
+        self.cache.release.set()
+
+    def test_all_tables(self):
+        self.cache.release.set()
+        observation = self.tool.run("movies, slow")
+        self.assertIn("CREATE TABLE movies", observation)
+        self.assertIn("CREATE TABLE slow", observation)
+
+    def test_partial(self):
+        observation = self.tool.run("movies, slow")
+        self.assertIn("CREATE TABLE movies", observation)
+        self.assertIn("timed out getting the schema of slow", observation)
+
+    def test_partial_async(self):
+        observation = asyncio.run(self.tool.arun("slow,movies"))
+        self.assertIn("CREATE TABLE movies", observation)
+        self.assertIn("timed out getting the schema of slow", observation)
+
+    def test_cache(self):
+        self.cache.prefetch(["movies", "slow"])
+        self.tool.run("movies")
+        self.tool.run("movies")
+        self.cache.release.set()
+        self.cache._entries["slow"].future.result()
+        # expire the entries
+        for entry in self.cache._entries.values():
+            entry.expires_at = 0
+        self.assertEqual(
+            self.cache.stats(),
+            {
+                "hits": 2,
+                "misses": 0,
+                "prefetched": 2,
+                "prefetch_hits": 1,
+                "prefetch_wasted": 1,
+            },
+        )
+
+    def test_traced(self):
+        trace_engine(self.engine)
+        trace = Trace({})
+        token = current_trace.set(trace)
+        try:
+            self.cache.get("movies").result()
+        finally:
+            current_trace.reset(token)
+        # the schema is loaded in a worker thread, in the context of the lookup
+        self.assertTrue(trace.statements)
+
+    def test_missing_table(self):
+        self.assertIn("not found in database", self.tool.run("missing"))
+
+
+if __name__ == "__main__":
+    unittest.main()
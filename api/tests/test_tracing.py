@@ -0,0 +1,97 @@
+import asyncio
+import json
+import os
+import tempfile
+import unittest
+
+from langchain.llms.fake import FakeListLLM
+from langchain.tools import Tool
+from sqlalchemy import create_engine, text
+
+from sqlbot.agent.base import AppendThoughtAgent, CustomAgentExecutor
+from sqlbot.callbacks import SpanCallbackHandler
+from sqlbot.callbacks.spans import wait_for_exports
+from sqlbot.tracing import FileTraceExporter, Trace, current_trace, trace_engine
+
+
+class TestTracing(unittest.TestCase):
+    def test_span_tree(self):
+        engine = create_engine("sqlite://")
+        trace_engine(engine)
+
+        def execute(query: str) -> str:
+            with engine.connect() as connection:
+                return str(connection.execute(text(query)).fetchall())
+
+        async def aexecute(query: str) -> str:
+            return await asyncio.to_thread(execute, query)
+
+        tools = [
+            Tool(
+                name="query_executor",
+                func=execute,
+                coroutine=aexecute,
+                description="runs a query",
+            )
+        ]
+        llm = FakeListLLM(
+            responses=[
+                json.dumps({"tool_name": "query_executor", "tool_input": "SELECT 42"}),
+                "There are 42.",
+            ]
+        )
+        agent = AppendThoughtAgent.from_llm_and_tools(llm=llm, tools=tools)
+        executor = CustomAgentExecutor.from_agent_and_tools(agent=agent, tools=tools)
+
+        with tempfile.TemporaryDirectory() as directory:
+            trace = Trace({"conversation": "c1"})
+
+            async def run():
+                current_trace.set(trace)
+                await executor.acall(
+                    {
+                        "date": "2023-12-01",
+                        "input": "how many?",
+                        "history": [],
+                        "top_k": 10,
+                        "dialect": "sqlite",
+                    },
+                    callbacks=[
+                        SpanCallbackHandler(trace, FileTraceExporter(directory))
+                    ],
+                )
+                # exported in the background
+                await wait_for_exports()
+
+            asyncio.run(run())
+            with open(os.path.join(directory, f"{trace.trace_id}.json")) as f:
+                exported = json.load(f)
+
+        resource_spans = exported["resourceSpans"][0]
+        self.assertIn(
+            {"key": "conversation", "value": {"stringValue": "c1"}},
+            resource_spans["resource"]["attributes"],
+        )
+        spans = resource_spans["scopeSpans"][0]["spans"]
+        self.assertEqual({span["traceId"] for span in spans}, {trace.trace_id})
+        by_name = {}
+        for span in spans:
+            by_name.setdefault(span["name"], []).append(span)
+        (root,) = [span for span in spans if "parentSpanId" not in span]
+        (tool,) = by_name["query_executor"]
+        (sql,) = by_name["sql"]
+        self.assertEqual(tool["parentSpanId"], root["spanId"])
+        self.assertEqual(sql["parentSpanId"], tool["spanId"])
+        self.assertIn(
+            {"key": "db.statement", "value": {"stringValue": "SELECT 42"}},
+            sql["attributes"],
+        )
+        self.assertEqual(len(by_name["llm"]), 2)
+        for span in spans:
+            self.assertLessEqual(
+                int(span["startTimeUnixNano"]), int(span["endTimeUnixNano"])
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
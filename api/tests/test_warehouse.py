@@ -0,0 +1,99 @@
+import asyncio
+import unittest
+
+from sqlalchemy import create_engine, text
+
+from sqlbot.warehouse import ReplicaPool, Warehouse, WarehouseRegistry, begin_read
+
+
+class TestReplicaPool(unittest.TestCase):
+    def setUp(self):
+        self.primary = create_engine("sqlite://")
+        self.pool = ReplicaPool(self.primary, ["sqlite://", "sqlite://"])
+
+    def test_least_outstanding(self):
+        first, second = self.pool.replicas
+        with self.pool.connect() as connection:
+            with self.pool.connect():
+                self.assertEqual((first.outstanding, second.outstanding), (1, 1))
+        self.assertEqual((first.outstanding, second.outstanding), (0, 0))
+        self.assertIsNot(connection.engine, self.primary)
+        self.assertIn(connection.engine, (first.engine, second.engine))
+
+    def test_fallback_to_primary(self):
+        for replica in self.pool.replicas:
+            replica.healthy = False
+        with self.pool.connect() as connection:
+            self.assertIs(connection.engine, self.primary)
+
+    def test_failed_replica_out_of_rotation(self):
+        broken = self.pool.replicas[0]
+        broken.engine = create_engine("sqlite:////nonexistent/dir/db.sqlite")
+        # make the broken replica the least loaded one
+        self.pool.replicas[1].outstanding = 1
+        with self.pool.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        self.assertFalse(broken.healthy)
+        self.assertEqual(broken.outstanding, 0)
+
+
+class TestWarehouse(unittest.TestCase):
+    def test_begin_read(self):
+        engine = create_engine("sqlite://")
+        with engine.begin() as connection:
+            connection.execute(text("CREATE TABLE movies (id INTEGER)"))
+        db = Warehouse(engine)
+        with begin_read(db) as connection:
+            self.assertIs(connection.engine, engine)
+        self.assertIn("rows from movies table", db.get_table_info())
+        db.replicas = ReplicaPool(engine, ["sqlite://"])
+        with begin_read(db) as connection:
+            self.assertIs(connection.engine, db.replicas.replicas[0].engine)
+
+
+class TestWarehouseRegistry(unittest.TestCase):
+    def setUp(self):
+        self.loaded = []
+        self.evicted = []
+
+        def factory(warehouse_id: str) -> str:
+            self.loaded.append(warehouse_id)
+            return f"db-{warehouse_id}"
+
+        self.registry = WarehouseRegistry(
+            factory, on_evict=self.evicted.append, max_size=2, pinned=["default"]
+        )
+
+    def test_lazy_load_once(self):
+        async def load():
+            return await asyncio.gather(self.registry.get("a"), self.registry.get("a"))
+
+        self.assertEqual(asyncio.run(load()), ["db-a", "db-a"])
+        self.assertEqual(self.loaded, ["a"])
+
+    def test_lru_eviction(self):
+        self.registry.put("default", "db-default")
+
+        async def load():
+            await self.registry.get("a")
+            await self.registry.get("b")
+            await self.registry.get("default")
+            await self.registry.get("c")
+
+        asyncio.run(load())
+        # pinned warehouses are kept even when least recently used
+        self.assertEqual(self.evicted, ["db-a", "db-b"])
+        self.assertIn("default", self.registry)
+        self.assertIn("c", self.registry)
+
+    def test_idle_eviction(self):
+        self.registry.idle_timeout = 0
+        self.registry.put("default", "db-default")
+        self.registry.put("a", "db-a")
+        self.registry.evict_idle()
+        self.assertEqual(self.evicted, ["db-a"])
+        self.assertEqual(len(self.registry), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import asyncio
+import time
+import unittest
+
+from sqlbot.watchdog import LoopWatchdog, set_labels
+
+
+def blocking_call():
+    time.sleep(0.3)
+
+
+class TestLoopWatchdog(unittest.TestCase):
+    def test_report_stall(self):
+        async def child():
+            await asyncio.sleep(0.05)
+            blocking_call()
+
+        async def run():
+            watchdog = LoopWatchdog(threshold=0.1, interval=0.01)
+            watchdog.start()
+            try:
+                labels = set_labels(conversation="c1")
+                labels["run_id"] = "r1"
+                # labels are inherited by the tasks created by the run
+                await asyncio.create_task(child())
+                await asyncio.sleep(0.05)
+            finally:
+                watchdog.stop()
+            return watchdog
+
+        watchdog = asyncio.run(run())
+        self.assertEqual(watchdog.stall_count, 1)
+        stall = watchdog.stalls[0]
+        self.assertIn("blocking_call", stall.call_site)
+        self.assertIn("child", stall.stack)
+        self.assertEqual(stall.labels, {"conversation": "c1", "run_id": "r1"})
+        self.assertGreater(watchdog.stats()["max_lag_seconds"], 0.2)
+
+    def test_no_stall(self):
+        async def run():
+            watchdog = LoopWatchdog(threshold=0.1, interval=0.01)
+            watchdog.start()
+            await asyncio.sleep(0.1)
+            watchdog.stop()
+            return watchdog
+
+        self.assertEqual(asyncio.run(run()).stall_count, 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
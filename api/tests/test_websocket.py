@@ -0,0 +1,65 @@
+import asyncio
+import unittest
+
+from sqlbot.websocket import WebsocketWriter
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.frames = []
+        self.sending = 0
+        self.overlapped = False
+
+    async def send_text(self, data: str) -> None:
+        self.sending += 1
+        self.overlapped |= self.sending > 1
+        await asyncio.sleep(0)
+        self.frames.append(data)
+        self.sending -= 1
+
+
+class BrokenWebsocket:
+    async def send_text(self, data: str) -> None:
+        raise RuntimeError("closed")
+
+
+class TestWebsocketWriter(unittest.TestCase):
+    def test_single_writer(self):
+        websocket = FakeWebsocket()
+
+        async def write():
+            writer = WebsocketWriter(websocket)
+            writer.start()
+
+            async def stream(name: str):
+                for i in range(10):
+                    await writer.send_text(f"{name}{i}")
+                    await asyncio.sleep(0)
+
+            await asyncio.gather(stream("a"), stream("b"))
+            while len(websocket.frames) < 20:
+                await asyncio.sleep(0)
+            await writer.close()
+
+        asyncio.run(write())
+        self.assertFalse(websocket.overlapped)
+        self.assertEqual(
+            [f for f in websocket.frames if f.startswith("a")],
+            [f"a{i}" for i in range(10)],
+        )
+
+    def test_broken(self):
+        async def write():
+            writer = WebsocketWriter(BrokenWebsocket())
+            writer.start()
+            await writer.send_text("a")
+            await asyncio.sleep(0.01)
+            with self.assertRaises(RuntimeError):
+                await writer.send_text("b")
+            await writer.close()
+
+        asyncio.run(write())
+
+
+if __name__ == "__main__":
+    unittest.main()